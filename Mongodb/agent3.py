@@ -2,14 +2,25 @@
 #create table script addition
 #create app.py for the script
 from Mongodb.mongo_utils import execute_mongo_query, connect_mongo, load_config
-from Mongodb.llm_wrapper import Custom_GenAI
+from Mongodb.llm_wrapper import Custom_GenAI, LLMUnavailableError, run_pipeline, run_pipeline_async, static_prefix
 from pymongo import MongoClient
 from Mongodb.log_utils_mongo import insert_log
-from Mongodb.utils import clean_query, format_mongo_results, extract_json_block
+from Mongodb.utils import clean_query, format_mongo_results, extract_json_block, extract_query_object, load_query_object
+from Mongodb.query_validator import validate_mongo_query, query_object_schema
+from SQL.helper import preprocess_country_names
+from semantic_cache import SemanticQueryCache
+from schema_pruner import SchemaPruner
+from fast_rules import match_mongo, get_rule_stats
+from llm_fallback import FallbackLLM
+from deadline import Deadline, DeadlineExceeded
+from llm_metrics import trace
+import copy
 import json
 from datetime import datetime
 import re
 import os
+import threading
+import time
 from bson import ObjectId
 from pathlib import Path
 
@@ -17,10 +28,106 @@ BASE_DIR = Path(__file__).resolve().parent
 MONGO_SCHEMA_PATH = BASE_DIR / "db_schema_context_mongo.txt"
 MONGO_PROMPT_PATH = BASE_DIR / "llm_prompt_mongo.txt"
 
-PRIMARY_LLM = Custom_GenAI(os.getenv("LLM_API_KEY"))
-SYNTAX_LLM = Custom_GenAI(os.getenv("LLM_API_KEY"))
+PRIMARY_LLM = Custom_GenAI(os.getenv("LLM_API_KEY"), role="primary")
+SYNTAX_LLM = Custom_GenAI(os.getenv("LLM_API_KEY"), role="syntax")
 
 query_cache = {}
+SEMANTIC_CACHE = SemanticQueryCache(
+    "Mongo", [MONGO_SCHEMA_PATH, MONGO_PROMPT_PATH], normalizer=preprocess_country_names
+)
+SCHEMA_PRUNER = SchemaPruner(
+    "Mongo",
+    r"^\d+\.\s+`?(?P<name>\w+)`?",
+    keywords={
+        "recipes": {"recipe", "dish", "meal", "cook", "rating", "review", "instruction"},
+        "ingredient_nutrition": {"nutrition", "nutrient", "nutritional", "vitamin", "mineral", "kcal", "fdc_id"},
+        "food_prices": {"price", "cost", "cheap", "cheapest", "expensive", "market", "commodity", "usd", "usdprice"},
+    },
+    key_fields={"ingredient_nutrition": {"fdc_id", "ingredient_name", "category_name", "portion_description"}},
+    field_synonyms={
+        "calorie": {"energy_kcal"}, "energy": {"energy_kcal", "energy_kj"},
+        "salt": {"sodium_mg"}, "fibre": {"fiber_g"}, "folic": {"folate_ug"},
+    },
+)
+
+
+# How often the local validator let us skip the SYNTAX_LLM round trip
+validation_stats = {"local_passed": 0, "local_failed": 0, "llm_validations": 0}
+validation_lock = threading.Lock()
+
+# Why requests were answered with a FallbackLLM template instead
+fallback_stats = {"llm_unavailable": 0, "deadline_exceeded": 0}
+
+
+# How LLM output turned into a query object (structured output should make failures rare)
+parsing_stats = {"generations": 0, "parsed_directly": 0, "parse_failures": 0, "regenerations": 0}
+
+
+def count_validation(stat):
+    with validation_lock:
+        validation_stats[stat] += 1
+
+
+def count_parsing(stat):
+    with validation_lock:
+        parsing_stats[stat] += 1
+
+
+def fallback_confirmation(user_query, reason="llm_unavailable", interactive=True):
+    """Offer a template query when no LLM provider can answer in time"""
+    with validation_lock:
+        fallback_stats[reason] += 1
+    fallback = copy.deepcopy(FallbackLLM.get_fallback_response(user_query))
+    problem = "The LLM is unavailable" if reason == "llm_unavailable" else "The LLM ran out of time"
+    if not interactive:
+        return suggested_query(fallback, f"{problem} {fallback['explanation']}")
+    query_cache["pending"] = fallback
+    query_cache.pop("pending_question", None)  # never cache template answers
+    return {
+        "action": "confirm_query",
+        "prompt": f"⚠️ {problem} {fallback['explanation']}. Should I run this query on `{fallback['collection']}` instead?\nReply with: yes / no / rewrite"
+    }
+
+
+def suggested_query(wrapped_query, reason):
+    """A query a non-interactive caller gets back instead of a confirm_query prompt"""
+    return {
+        "action": "suggested_query",
+        "query": wrapped_query,
+        "prompt": f"⚠️ {reason}. The query was not run; ask on /ask to confirm it.",
+    }
+
+
+def run_confirmed(wrapped_query, pending_question, user_query, deadline):
+    """Execute a query the user confirmed (or a batch item did not need to)"""
+    try:
+        result = execute_mongo_query(wrapped_query, timeout=deadline.db_timeout())
+        insert_log(user_query, "EXECUTE", wrapped_query, success=True, matched=len(result))
+        if result and pending_question:
+            SEMANTIC_CACHE.store(pending_question, copy.deepcopy(wrapped_query))
+        return format_mongo_results(result)
+    except Exception as e:
+        return f"❌ Failed to execute query: {e}"
+
+
+def get_agent_stats():
+    with validation_lock:
+        validation = dict(validation_stats)
+        fallbacks = dict(fallback_stats)
+        parsing = dict(parsing_stats)
+    checked = validation["local_passed"] + validation["local_failed"]
+    validation["llm_skip_rate"] = round(validation["local_passed"] / checked, 3) if checked else 0.0
+    generations = parsing["generations"]
+    parsing["parse_failure_rate"] = round(parsing["parse_failures"] / generations, 3) if generations else 0.0
+    parsing["regeneration_rate"] = round(parsing["regenerations"] / generations, 3) if generations else 0.0
+    return {
+        "semantic_cache": SEMANTIC_CACHE.stats(),
+        "validation": validation,
+        "parsing": parsing,
+        "fallbacks": fallbacks,
+        "schema_pruning": SCHEMA_PRUNER.stats(),
+        "fast_rules": get_rule_stats("mongo"),
+    }
 
 
 field_defaults = {
@@ -44,19 +151,53 @@ field_defaults = {
 }
 
 
+# Sampled field names per collection, refreshed every SCHEMA_CACHE_TTL seconds
+SCHEMA_CACHE_TTL = float(os.getenv("MONGO_SCHEMA_CACHE_TTL", "300"))
+_field_cache = {}
+_field_cache_lock = threading.Lock()
+
+
 def get_valid_fields(collection_name):
-    db = MongoClient("mongodb://localhost:27017/")["recipe_chatbot"]
-    sample_doc = db[collection_name].find_one()
+    with _field_cache_lock:
+        cached = _field_cache.get(collection_name)
+    if cached and time.time() - cached[0] < SCHEMA_CACHE_TTL:
+        return cached[1]
+
     default_fields = set(field_defaults.get(collection_name, []))
+    try:
+        sample_doc = connect_mongo()[collection_name].find_one()
+    except Exception as e:
+        print(f"⚠️ Could not sample `{collection_name}`, using default fields: {e}")
+        sample_doc = None
     if sample_doc:
         # Combine actual keys + backup defaults to avoid missing anything
-        actual_fields = set(sample_doc.keys())
-        return actual_fields | default_fields  # union
-    
+        fields = set(sample_doc.keys()) | default_fields  # union
     else:
-        return default_fields
+        fields = default_fields
+
+    with _field_cache_lock:
+        _field_cache[collection_name] = (time.time(), fields)
+    return fields
+
+
+# Constrains PRIMARY_LLM output to {collection, query, limit, projection, sort}
+QUERY_OBJECT_FORMAT = query_object_schema(field_defaults)
+
+
+def get_schema(collection_name=None):
+    """Known collections and their fields for the local validator (only the queried one is sampled)"""
+    return {
+        collection: get_valid_fields(collection) if collection == collection_name else set(fields)
+        for collection, fields in field_defaults.items()
+    }
    
 
+def is_valid_query(raw_query):
+    """Cascade check: a smaller model's answer is kept if it parses and passes the local validator"""
+    parsed = load_query_object(raw_query) or extract_query_object(clean_query(raw_query))
+    return parsed is not None and not validate_mongo_query(parsed, get_schema(parsed.get("collection")))
+
+
 def match_intent(uq, keywords):
     return all(k in uq for k in keywords)
 
@@ -107,7 +248,44 @@ def parse_date_safe(val):
         return val
 
 
-def process_query(user_query):
+def process_query(user_query, deadline=None, interactive=True):
+    """
+    Answer a question within the request's time budget
+
+    Args:
+        user_query: Question or confirmation reply from the user
+        deadline: Deadline for the whole request (None = no budget, e.g. the CLI)
+        interactive: False for callers that cannot answer a confirmation (/ask/batch):
+            validated queries run straight away, others come back as a
+            suggested_query action, and the pending query of the /ask user is left alone
+
+    Returns:
+        Formatted results, or a confirm_query action. Once the budget runs out
+        the user is offered a FallbackLLM template query instead.
+    """
+    deadline = deadline or Deadline(None)
+    with trace():  # LLM calls made for this question are stored with its log row
+        try:
+            return run_pipeline(_process_query(user_query, deadline, interactive))
+        except DeadlineExceeded as e:
+            print(f"⏱️ {e}")
+            return fallback_confirmation(user_query, reason="deadline_exceeded", interactive=interactive)
+
+
+async def process_query_async(user_query, deadline=None, interactive=True):
+    """process_query on an event loop - LLM waits hold no thread (see run_pipeline_async)"""
+    deadline = deadline or Deadline(None)
+    with trace():
+        try:
+            return await run_pipeline_async(_process_query(user_query, deadline, interactive))
+        except DeadlineExceeded as e:
+            print(f"⏱️ {e}")
+            return fallback_confirmation(user_query, reason="deadline_exceeded", interactive=interactive)
+
+def _process_query(user_query, deadline, interactive=True):
+    # A generator: LLM calls are yielded (`yield LLM.call(...)`) and made by the driver
+    # Pending operations / queries wait for the user's next message; batch items keep theirs to themselves
+    state = query_cache if interactive else {}
 
     # Step 0: Handle structured form input like: name=abc, fat_g=5 ...
     if "=" in user_query:
@@ -139,7 +317,7 @@ def process_query(user_query):
                     structured_input[key] = val
 
             # ✅ Check operation context (prevents fallback to LLM)
-            op_info = query_cache.get("pending_op", {})
+            op_info = state.get("pending_op", {})
             collection = op_info.get("collection")
             operation = op_info.get("operation")
 
@@ -242,14 +420,10 @@ def process_query(user_query):
                 "prompt": "🔁 Please clarify your question:"
             }
         elif uq == "yes":
-            if "pending" in query_cache:
-                wrapped_query = query_cache.pop("pending")  
-                try:
-                    result = execute_mongo_query(db, wrapped_query)
-                    insert_log(user_query, "EXECUTE", wrapped_query, success=True, matched=len(result))
-                    return result
-                except Exception as e:
-                    return f"❌ Failed to execute query: {e}"
+            if "pending" in state:
+                wrapped_query = state.pop("pending")  
+                pending_question = state.pop("pending_question", None)
+                return run_confirmed(wrapped_query, pending_question, user_query, deadline)
             else:
                 return "⚠️ No query to execute."
     
@@ -311,7 +485,7 @@ def process_query(user_query):
             "name", "recipe_category", "recipe_ingredient_parts", "calories", "fat_g",
             "carbohydrate_g", "protein_g", "recipe_instructions"
         ]
-        query_cache["pending_op"] = {"collection": "recipes", "operation": "insert"}
+        state["pending_op"] = {"collection": "recipes", "operation": "insert"}
         return {
             "action": "collect_input",
             "operation": "insert",
@@ -328,7 +502,7 @@ def process_query(user_query):
             "countryiso3", "date", "market", "category", "commodity",
             "unit", "price", "usdprice"
         ]
-        query_cache["pending_op"] = {"collection": "food_prices", "operation": "insert"}
+        state["pending_op"] = {"collection": "food_prices", "operation": "insert"}
         return {
             "action": "collect_input",
             "operation": "insert",
@@ -347,7 +521,7 @@ def process_query(user_query):
             "ingredient_name", "food_category_id", "category_name", "portion_description",
             "gram_weight", "protein_g", "fat_g", "carbohydrate_g"
         ]
-        query_cache["pending_op"] = {"collection": "ingredient_nutrition", "operation": "insert"}
+        state["pending_op"] = {"collection": "ingredient_nutrition", "operation": "insert"}
         return {
             "action": "collect_input",
             "operation": "insert",
@@ -361,7 +535,7 @@ def process_query(user_query):
     # ---------------------- UPDATE ----------------------
     #recipe
     elif match_intent(uq, ["modify", "recipe"]) or match_intent(uq, ["change", "recipe"]) or match_intent(uq, ["update", "recipe"]) or match_intent(uq, ["Update", "recipe"]):
-        query_cache["pending_op"] = {"collection": "recipes", "operation": "update"}
+        state["pending_op"] = {"collection": "recipes", "operation": "update"}
         return {
             "action": "collect_input",
             "operation": "update",
@@ -374,7 +548,7 @@ def process_query(user_query):
 
 #price
     elif match_intent(uq, ["modify", "price"]) or match_intent(uq, ["change", "price"]) or match_intent(uq, ["update", "price"]) or match_intent(uq, ["Update", "price"]):
-        query_cache["pending_op"] = {"collection": "food_prices", "operation": "update"}
+        state["pending_op"] = {"collection": "food_prices", "operation": "update"}
         return {
             "action": "collect_input",
             "operation": "update",
@@ -386,7 +560,7 @@ def process_query(user_query):
 
 #nutrition
     elif match_intent(uq, ["modify", "nutrition"]) or match_intent(uq, ["change", "nutrition"]) or match_intent(uq, ["update", "nutrition"]) or match_intent(uq, ["Update", "nutrition"]):
-        query_cache["pending_op"] = {"collection": "ingredient_nutrition", "operation": "update"}
+        state["pending_op"] = {"collection": "ingredient_nutrition", "operation": "update"}
         return {
             "action": "collect_input",
             "operation": "update",
@@ -399,7 +573,7 @@ def process_query(user_query):
     # ---------------------- DELETE ----------------------
     #recipe
     elif match_intent(uq, ["delete", "recipe"]) or match_intent(uq, ["remove", "recipe"]):
-        query_cache["pending_op"] = {"collection": "recipes", "operation": "delete"}
+        state["pending_op"] = {"collection": "recipes", "operation": "delete"}
         return {
             "action": "collect_input",
             "operation": "delete",
@@ -412,7 +586,7 @@ def process_query(user_query):
 
 #price
     elif match_intent(uq, ["delete", "price"]) or match_intent(uq, ["remove", "price"]):
-        query_cache["pending_op"] = {"collection": "food_prices", "operation": "delete"}
+        state["pending_op"] = {"collection": "food_prices", "operation": "delete"}
         return {
             "action": "collect_input",
             "operation": "delete",
@@ -425,7 +599,7 @@ def process_query(user_query):
 
 #nutrition
     elif match_intent(uq, ["delete", "nutrition"]) or match_intent(uq, ["remove", "nutrition"]):
-        query_cache["pending_op"] = {"collection": "ingredient_nutrition", "operation": "delete"}
+        state["pending_op"] = {"collection": "ingredient_nutrition", "operation": "delete"}
         return {
             "action": "collect_input",
             "operation": "delete",
@@ -440,6 +614,30 @@ def process_query(user_query):
 
 
 
+    fast = match_mongo(user_query)
+    if fast:
+        print(f"⚡ Fast rule `{fast['rule']}` answered without the LLM: {fast['query']}")
+        try:
+            result = execute_mongo_query(fast["query"], timeout=deadline.db_timeout())
+            insert_log(user_query, "EXECUTE", dict(fast["query"], rule=fast["rule"]), success=bool(result), matched=len(result))
+        except Exception as e:
+            return f"❌ Failed to execute query: {e}"
+        if result:
+            return format_mongo_results(result)
+        # The shape matched but the question meant something else; let the LLM read it
+        print("⚡ Fast rule found no documents, asking the LLM instead")
+
+    cached_query = SEMANTIC_CACHE.lookup(user_query)
+    if cached_query and not interactive:
+        return run_confirmed(copy.deepcopy(cached_query), user_query, user_query, deadline)
+    if cached_query:
+        state["pending"] = copy.deepcopy(cached_query)
+        state["pending_question"] = user_query
+        return {
+            "action": "confirm_query",
+            "prompt": f"⚠️ Should I run this query on `{cached_query.get('collection')}`?\nReply with: yes / no / rewrite"
+        }
+
     # LLM-based Search
     with open(MONGO_SCHEMA_PATH, "r", encoding="utf-8") as schema_file:
         schema = schema_file.read()
@@ -447,41 +645,54 @@ def process_query(user_query):
         base_prompt = prompt_file.read()
 
     # user_query = user_query.replace("food_category_id", "").replace("category_name", "")
-    final_prompt = base_prompt.replace("{SCHEMA}", schema).replace("{QUESTION}", user_query)
-    raw_query = PRIMARY_LLM.ask_ai(final_prompt)
+    final_prompt = SCHEMA_PRUNER.render(base_prompt, schema, user_query)
+    try:
+        raw_query = yield PRIMARY_LLM.call(
+            final_prompt, stop_at="json", deadline=deadline, prefix=static_prefix(base_prompt),
+            output_schema=QUERY_OBJECT_FORMAT, validate=is_valid_query,
+        )
+    except LLMUnavailableError as e:
+        print(f"⚠️ {e}")
+        return fallback_confirmation(user_query, interactive=interactive)
+
+    # Structured output is a bare query object and parses in one pass
+    count_parsing("generations")
+    parsed = load_query_object(raw_query)
+    if parsed is not None:
+        count_parsing("parsed_directly")
 
     # Step 1: Clean and extract
-   # Clean raw query output
-    # Clean raw query output
     raw_cleaned = clean_query(raw_query)
 
     # Remove JSON prefix if present
     if raw_cleaned.lower().startswith("json"):
         raw_cleaned = raw_cleaned[4:].strip()
 
-    # Try extracting the first valid JSON object (handle LLM line breaks etc.)
-    try:
-        matches = re.findall(r'{[\s\S]+?}', raw_cleaned)
-        for candidate in matches:
-            try:
-                parsed = json.loads(candidate)
-                if "collection" in parsed and "query" in parsed:
-                    query_cache["pending"] = parsed
-                    return {
-                        "action": "confirm_query",
-                        "prompt": f"⚠️ Should I run this query on `{parsed.get('collection')}`?\nReply with: yes / no / rewrite"
-                    }
-            except Exception as e:
-                continue  # skip invalid chunks
-    except Exception as e:
+    # Otherwise take the first {collection, query} object (nested objects included).
+    # Either way it is validated locally - SYNTAX_LLM is only needed when this fails
+    if parsed is None:
+        parsed = extract_query_object(raw_cleaned)
+    validation_errors = []
+    if parsed is not None:
+        validation_errors = validate_mongo_query(parsed, get_schema(parsed.get("collection")))
+        if not validation_errors:
+            count_validation("local_passed")
+            if not interactive:
+                return run_confirmed(parsed, user_query, user_query, deadline)
+            state["pending"] = parsed
+            state["pending_question"] = user_query
+            return {
+                "action": "confirm_query",
+                "prompt": f"⚠️ Should I run this query on `{parsed.get('collection')}`?\nReply with: yes / no / rewrite"
+            }
+        count_validation("local_failed")
+        print("⚠️ Local validation failed:\n - " + "\n - ".join(validation_errors))
+        cleaned_query = json.dumps(parsed)
+    else:
+        count_parsing("parse_failures")
         print(f"❌ Could not extract JSON from:\n{raw_cleaned}")
-
-    # If nothing valid was parsed, fallback
-    cleaned_query = raw_cleaned
-
-
-
-
+        # If nothing valid was parsed, fallback
+        cleaned_query = raw_cleaned
 
     print("\n🧠 Generated Mongo Query (LLM):\n")
     print(cleaned_query)   
@@ -504,42 +715,15 @@ def process_query(user_query):
                         return f"⚠️ No sample found in `{coll_name[0]}`"
         except Exception as e:
             return f"❌ Failed to run client command: {e}"
-        
-    # Clean and extract raw LLM output
-    # Clean raw query output
-    raw_cleaned = clean_query(raw_query)
-
-    # Remove JSON prefix if present
-    if raw_cleaned.lower().startswith("json"):
-        raw_cleaned = raw_cleaned[4:].strip()
-
-    # Try extracting the first valid JSON object (handle LLM line breaks etc.)
-    try:
-        matches = re.findall(r'{[\s\S]+?}', raw_cleaned)
-        for candidate in matches:
-            try:
-                parsed = json.loads(candidate)
-                if "collection" in parsed and "query" in parsed:
-                    query_cache["pending"] = parsed
-                    return {
-                        "action": "confirm_query",
-                        "prompt": f"⚠️ Should I run this query on `{parsed.get('collection')}`?\nReply with: yes / no / rewrite"
-                    }
-            except Exception as e:
-                continue  # skip invalid chunks
-    except Exception as e:
-        print(f"❌ Could not extract JSON from:\n{raw_cleaned}")
 
-    # If nothing valid was parsed, fallback
-    cleaned_query = raw_cleaned
+    # Keep the collections the question and the generated query refer to
+    mongo_schema = SCHEMA_PRUNER.prune(schema, f"{user_query}\n{cleaned_query}")
 
- 
-
-    print("\n🧠 Generated Mongo Query (LLM):\n")
-    print(cleaned_query)
-
-    with open(MONGO_SCHEMA_PATH, "r", encoding="utf-8") as schema_file:
-        mongo_schema = schema_file.read()
+    problems = "\n    ".join(f"- {err}" for err in validation_errors)
+    problem_context = f"""
+    A local schema check found these problems:
+    {problems}
+    """ if validation_errors else ""
 
     syntax_prompt = f"""You are an expert MongoDB syntax and schema validator.
     Below is the database schema:
@@ -547,7 +731,7 @@ def process_query(user_query):
 
     And here is the generated query:
     {cleaned_query}
-
+    {problem_context}
     Please check if:
     - The syntax is valid
     - All field and collection names match the schema
@@ -555,21 +739,25 @@ def process_query(user_query):
 
     If something is wrong, suggest the corrected version. Otherwise, reply 'Valid ✅'.
     """
-    syntax_feedback = SYNTAX_LLM.ask_ai(syntax_prompt)
+    count_validation("llm_validations")
+    try:
+        syntax_feedback = yield SYNTAX_LLM.call(syntax_prompt, stop_at="json", deadline=deadline)
+    except LLMUnavailableError as e:
+        print(f"⚠️ {e}")
+        return fallback_confirmation(user_query, interactive=interactive)
     print("\n🧪 Syntax LLM feedback:\n", syntax_feedback)
 
     # Check if the feedback includes a corrected query
     if "{" in syntax_feedback and "collection" in syntax_feedback and "query" in syntax_feedback:
-        matches = re.findall(r'{[\s\S]+}', syntax_feedback)
-        if matches:
-            try:
-                corrected_query = json.loads(matches[0])
-                print("⚠️ Detected corrected query. Overriding previous query with this one:")
-                print(json.dumps(corrected_query, indent=2))
-                wrapped_query = corrected_query  # ✅ Assign corrected query
-            except json.JSONDecodeError as e:
-                print(f"❌ Could not parse corrected JSON: {e}")
-                return f"<b>Failed to parse regenerated query: {e}</b>"  # ✅ Make sure to return here
+        corrected_query = extract_query_object(syntax_feedback)
+        if corrected_query is not None:
+            print("⚠️ Detected corrected query. Overriding previous query with this one:")
+            print(json.dumps(corrected_query, indent=2))
+            remaining_errors = validate_mongo_query(corrected_query, get_schema(corrected_query.get("collection")))
+            if remaining_errors:
+                print("⚠️ Corrected query still fails local validation:", remaining_errors)
+                return "⚠️ The regenerated query is still invalid. Please rephrase your question."
+            wrapped_query = corrected_query  # ✅ Assign corrected query
 
         else:
             print("❌ No valid JSON query found in LLM feedback.")
@@ -581,12 +769,14 @@ def process_query(user_query):
 
 
     # Instead of asking for confirmation via input(), return a prompt to frontend
-        query_cache["pending"] = wrapped_query  # 🧠 Save for the next call
+        state["pending"] = wrapped_query  # 🧠 Save for the next call
 
         print("✅ Auto-running regenerated query for testing...")
         try:
-            result = execute_mongo_query(json.dumps(wrapped_query))
+            result = execute_mongo_query(json.dumps(wrapped_query), timeout=deadline.db_timeout())
             insert_log(user_query, "EXECUTE", wrapped_query, success=True, matched=len(result))
+            if result:
+                SEMANTIC_CACHE.store(user_query, copy.deepcopy(wrapped_query))
             return format_mongo_results(result)
         except Exception as e:
             return f"❌ Failed to execute regenerated query: {e}"
@@ -693,7 +883,7 @@ def process_query(user_query):
                 if wrapped_query["query"] == {}:
                     # If it's an empty but valid query, don't regenerate
                     print("⚠️ Query is empty but valid ({{}}), skipping regeneration.")
-                    results = execute_mongo_query(json.dumps(wrapped_query))
+                    results = execute_mongo_query(json.dumps(wrapped_query), timeout=deadline.db_timeout())
                     print("🔍 Executed query, results:")
                     print(results)
                     insert_log(user_query, "QUERY", wrapped_query, success=bool(results))
@@ -730,27 +920,33 @@ def process_query(user_query):
                     Use only valid fields from the schema.
                     """
 
-                regenerated_query = SYNTAX_LLM.ask_ai(clarification_prompt)
+                count_parsing("regenerations")
+                try:
+                    regenerated_query = yield SYNTAX_LLM.call(
+                        clarification_prompt, stop_at="json", deadline=deadline, role="regeneration",
+                        output_schema=QUERY_OBJECT_FORMAT,
+                    )
+                except LLMUnavailableError as e:
+                    print(f"⚠️ {e}")
+                    return fallback_confirmation(user_query, interactive=interactive)
 
                 # Parse JSON from LLM response
-                matches = re.findall(r'{[\s\S]+}', regenerated_query)
-                if matches:
-                    try:
-                        new_query = json.loads(matches[0])
-                        print("🔁 Recovered query after regeneration:")
-                        print(json.dumps(new_query, indent=2))
-                        wrapped_query = new_query
-                    except Exception as e:
-                        return f"<b>Failed to parse regenerated query: {e}</b>"
-                else:
+                new_query = load_query_object(regenerated_query) or extract_query_object(regenerated_query)
+                if new_query is None:
                     return "<b>Query could not be regenerated. Try rephrasing.</b>"
-                return "⚠️ Query regeneration completed but no output was returned. Please rephrase your question."
+                print("🔁 Recovered query after regeneration:")
+                print(json.dumps(new_query, indent=2))
+                remaining_errors = validate_mongo_query(new_query, get_schema(new_query.get("collection")))
+                if remaining_errors:
+                    print("⚠️ Regenerated query fails local validation:", remaining_errors)
+                    return "⚠️ The regenerated query is still invalid. Please rephrase your question."
+                wrapped_query = new_query
 
             else:
                 wrapped_query["query"] = filtered_query
 
 
-        results = execute_mongo_query(json.dumps(wrapped_query))
+        results = execute_mongo_query(json.dumps(wrapped_query), timeout=deadline.db_timeout())
 
         # Debug: Show raw results
         print("✅ Query executed successfully. Raw result preview:")
@@ -772,12 +968,15 @@ def process_query(user_query):
 
         # Log and return
         insert_log(user_query, "QUERY", wrapped_query, success=True, matched=len(results))
+        SEMANTIC_CACHE.store(user_query, copy.deepcopy(wrapped_query))
         print("✅ Formatted response:")
         print(response_text)
         return response_text
 
         
     
+    except DeadlineExceeded:
+        raise
     except Exception as e:
         return f"❌ Mongo query error: {e}"
     
@@ -3,7 +3,7 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from llm_wrapper_opensource import Custom_GenAI
+from llm_wrapper_opensource import Custom_GenAI, LLMUnavailableError, run_pipeline, run_pipeline_async, static_prefix
 
 # This module now uses open-source models via Ollama or HuggingFace
 # See ../llm_wrapper_opensource.py for configuration
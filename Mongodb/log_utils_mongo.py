@@ -1,5 +1,6 @@
 from pymongo import MongoClient
 from datetime import datetime
+from llm_metrics import current_trace, summarize_trace
 
 def insert_log(user_query, action_type, generated_query, related_collection="N/A", matched=0, success=True):
     db = MongoClient("mongodb://localhost:27017/")["recipe_chatbot"]
@@ -10,6 +11,7 @@ def insert_log(user_query, action_type, generated_query, related_collection="N/A
         "generated_query": generated_query,
         "related_collection": related_collection,
         "matched_count": matched,
-        "success": success
+        "success": success,
+        "llm_stats": summarize_trace(current_trace()),
     }
     db.query_logs.insert_one(log_doc)
@@ -22,13 +22,15 @@ def fix_js_syntax(js_str):
     js_str = re.sub(r'(?<!")(\$?\w+)\s*:', r'"\1":', js_str)
     return js_str
 
-def execute_mongo_query(query_obj):
+def execute_mongo_query(query_obj, timeout=None):
     if isinstance(query_obj, str):
         query_obj = json.loads(query_obj)
     
     collection_name = query_obj.get("collection")
     query_filter = query_obj.get("query", {})
     limit = query_obj.get("limit", 10)
+    projection = query_obj.get("projection")
+    sort = query_obj.get("sort")
 
     config = load_config()
     db = MongoClient(config["MONGODB_URI"])[config["DB_NAME"]]
@@ -36,7 +38,11 @@ def execute_mongo_query(query_obj):
 
     print(f"⚙️ Executing query on `{collection_name}` with filter {query_filter} and limit {limit}")
     
-    cursor = collection.find(query_filter)
+    cursor = collection.find(query_filter, projection) if projection else collection.find(query_filter)
+    if sort:
+        cursor = cursor.sort(list(sort.items()))
+    if timeout is not None:
+        cursor = cursor.max_time_ms(max(int(timeout * 1000), 1))
     if limit:
         cursor = cursor.limit(limit)
 
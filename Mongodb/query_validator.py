@@ -0,0 +1,136 @@
+"""
+Local validator for generated Mongo queries.
+Checks the {collection, query, limit, projection, sort} object against the
+known schema so SYNTAX_LLM is only consulted when something is actually wrong.
+"""
+
+# Operators allowed inside a field condition, e.g. {"calories": {"$lt": 300}}
+FIELD_OPERATORS = {
+    "$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin",
+    "$regex", "$options", "$exists", "$not", "$all", "$size", "$elemMatch",
+}
+
+# Operators allowed at the top level of a filter, each holding a list of filters
+LOGICAL_OPERATORS = {"$and", "$or", "$nor"}
+
+LIST_OPERATORS = {"$in", "$nin", "$all"}
+
+TOP_LEVEL_KEYS = {"collection", "query", "limit", "projection", "sort", "explanation"}
+
+
+def query_object_schema(collections):
+    """
+    JSON schema of the query object, for constrained generation (Ollama `format`)
+
+    Args:
+        collections: Names the "collection" key may take
+    """
+    return {
+        "type": "object",
+        "properties": {
+            "collection": {"type": "string", "enum": list(collections)},
+            "query": {"type": "object"},
+            "limit": {"type": "integer", "minimum": 1},
+            "projection": {"type": "object"},
+            "sort": {"type": "object"},
+        },
+        "required": ["collection", "query"],
+    }
+
+
+def _is_known_field(key, fields):
+    # Dotted paths are checked on their first segment: "nutrition.protein_g" -> "nutrition"
+    return key == "_id" or key in fields or key.split(".", 1)[0] in fields
+
+
+def _check_condition(field, condition, errors):
+    if not isinstance(condition, dict) or not any(k.startswith("$") for k in condition):
+        return  # plain equality match
+    for op, value in condition.items():
+        if op not in FIELD_OPERATORS:
+            errors.append(f"operator `{op}` is not allowed on `{field}`")
+        elif op in LIST_OPERATORS and not isinstance(value, list):
+            errors.append(f"`{op}` on `{field}` needs a list")
+        elif op == "$regex" and not isinstance(value, str):
+            errors.append(f"`$regex` on `{field}` needs a string")
+        elif op == "$options" and (not isinstance(value, str) or set(value) - set("imxs")):
+            errors.append(f"`$options` on `{field}` must only use i, m, x, s")
+        elif op == "$size" and (not isinstance(value, int) or isinstance(value, bool)):
+            errors.append(f"`$size` on `{field}` needs an integer")
+        elif op == "$not":
+            _check_condition(field, value, errors)
+
+
+def _check_filter(query_filter, fields, errors):
+    if not isinstance(query_filter, dict):
+        errors.append("`query` must be an object")
+        return
+    for key, value in query_filter.items():
+        if key.startswith("$"):
+            if key not in LOGICAL_OPERATORS:
+                errors.append(f"top-level operator `{key}` is not allowed")
+            elif not isinstance(value, list) or not all(isinstance(v, dict) for v in value):
+                errors.append(f"`{key}` needs a list of filters")
+            else:
+                for sub_filter in value:
+                    _check_filter(sub_filter, fields, errors)
+        elif not _is_known_field(key, fields):
+            errors.append(f"unknown field `{key}`")
+        else:
+            _check_condition(key, value, errors)
+
+
+def validate_mongo_query(query_obj, schema):
+    """
+    Validate a generated query object.
+
+    Args:
+        query_obj: Parsed LLM output, e.g. {"collection": ..., "query": {...}, "limit": 5}
+        schema: {collection_name: set of field names}
+
+    Returns:
+        List of problems; empty when the query can be run as-is
+    """
+    if not isinstance(query_obj, dict):
+        return ["query must be a JSON object"]
+
+    errors = []
+    unknown_keys = set(query_obj) - TOP_LEVEL_KEYS
+    if unknown_keys:
+        errors.append(f"unexpected keys: {', '.join(sorted(unknown_keys))}")
+
+    collection = query_obj.get("collection")
+    if collection not in schema:
+        errors.append(f"unknown collection `{collection}` (expected one of: {', '.join(sorted(schema))})")
+        return errors
+    fields = schema[collection]
+
+    _check_filter(query_obj.get("query"), fields, errors)
+
+    limit = query_obj.get("limit")
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 0):
+        errors.append("`limit` must be a non-negative integer")
+
+    projection = query_obj.get("projection")
+    if projection is not None:
+        if not isinstance(projection, dict):
+            errors.append("`projection` must be an object")
+        else:
+            for key, value in projection.items():
+                if not _is_known_field(key, fields):
+                    errors.append(f"unknown projection field `{key}`")
+                elif value not in (0, 1, True, False):
+                    errors.append(f"projection for `{key}` must be 0 or 1")
+
+    sort = query_obj.get("sort")
+    if sort is not None:
+        if not isinstance(sort, dict):
+            errors.append("`sort` must be an object")
+        else:
+            for key, value in sort.items():
+                if not _is_known_field(key, fields):
+                    errors.append(f"unknown sort field `{key}`")
+                elif value not in (1, -1):
+                    errors.append(f"sort direction for `{key}` must be 1 or -1")
+
+    return errors
@@ -10,6 +10,28 @@ def extract_json_block(text):
     match = re.search(r'(\{[\s\S]*?\})', text)
     return match.group(1) if match else text
 
+def extract_query_object(text):
+    """Return the first JSON object in text with "collection" and "query" keys (nesting allowed)"""
+    decoder = json.JSONDecoder()
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = decoder.raw_decode(text, start)
+            if isinstance(obj, dict) and "collection" in obj and "query" in obj:
+                return obj
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+def load_query_object(text):
+    """Parse schema-constrained output in one pass; None if it is not a bare query object"""
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        return None
+    return obj if isinstance(obj, dict) and "collection" in obj and "query" in obj else None
+
 def format_mongo_results(results):
     if not results:
         return "<b>No information found in database.</b>"
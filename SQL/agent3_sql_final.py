@@ -1,11 +1,18 @@
 # agent3_sql_final.py — Fully mirrored from MongoDB agent3.py for PostgreSQL
-from SQL.db_utils import execute_sql_query, get_db_connection
-from SQL.llm_wrapper import Custom_GenAI
+from SQL.db_utils import db_connection, execute_sql_query, explain_sql_query
+from SQL.llm_wrapper import Custom_GenAI, LLMUnavailableError, run_pipeline, run_pipeline_async, static_prefix
 from SQL.log_utils import insert_log
-from SQL.helper import get_country_iso3
+from SQL.helper import preprocess_country_names
 from SQL.utils import clean_sql_query, format_sql_results
+from semantic_cache import SemanticQueryCache
+from schema_pruner import SchemaPruner
+from fast_rules import match_sql, get_rule_stats
+from llm_fallback import FallbackLLM
+from deadline import Deadline, DeadlineExceeded
+from llm_metrics import trace
 import re
 import os
+import threading
 from datetime import datetime
 from pathlib import Path
 
@@ -13,67 +20,123 @@ BASE_DIR = Path(__file__).resolve().parent
 SQL_SCHEMA_PATH = BASE_DIR / "db_schema_context.sql"
 SQL_PROMPT_PATH = BASE_DIR / "llm_prompt.txt"
 
-PRIMARY_LLM = Custom_GenAI(os.getenv("LLM_API_KEY"))
-SYNTAX_LLM = Custom_GenAI(os.getenv("LLM_API_KEY"))
+PRIMARY_LLM = Custom_GenAI(os.getenv("LLM_API_KEY"), role="primary")
+SYNTAX_LLM = Custom_GenAI(os.getenv("LLM_API_KEY"), role="syntax")
 query_cache = {}
+SEMANTIC_CACHE = SemanticQueryCache(
+    "SQL", [SQL_SCHEMA_PATH, SQL_PROMPT_PATH], normalizer=preprocess_country_names
+)
+SCHEMA_PRUNER = SchemaPruner(
+    "SQL",
+    r"^TABLE:\s*(?P<name>\w+)",
+    keywords={
+        "recipes": {"recipe", "dish", "meal", "cook", "rating", "review", "instruction"},
+        "ingredient_nutrition": {"nutrition", "nutrient", "nutritional", "vitamin", "mineral", "kcal", "fdc_id"},
+        "food_prices": {"price", "cost", "cheap", "cheapest", "expensive", "market", "commodity", "usd", "usdprice"},
+        "country_codes": {"country", "iso3", "iso"},
+    },
+    links=[
+        ({"recipes", "ingredient_nutrition"}, {"recipe_ingredients"}),
+        ({"recipes", "food_prices"}, {"recipe_ingredients", "ingredient_nutrition"}),
+    ],
+    field_synonyms={"calorie": {"energy_kcal"}, "energy": {"energy_kcal"}},
+)
+
+# How often EXPLAIN let us skip the SYNTAX_LLM round trip
+validation_stats = {"explain_passed": 0, "explain_failed": 0, "explain_unavailable": 0, "llm_validations": 0}
+validation_lock = threading.Lock()
+
+# Why requests were answered with a FallbackLLM template instead
+fallback_stats = {"llm_unavailable": 0, "deadline_exceeded": 0}
+
+
+def count_validation(*stats):
+    with validation_lock:
+        for stat in stats:
+            validation_stats[stat] += 1
+
+
+def is_read_only(sql):
+    """Only SELECT queries are safe to reuse for a similar question"""
+    return sql.lstrip().upper().startswith(("SELECT", "WITH"))
+
+
+def fallback_confirmation(user_query, reason="llm_unavailable", interactive=True):
+    """Offer a template query when no LLM provider can answer in time"""
+    with validation_lock:
+        fallback_stats[reason] += 1
+    fallback = FallbackLLM.get_fallback_sql(user_query)
+    problem = "The LLM is unavailable" if reason == "llm_unavailable" else "The LLM ran out of time"
+    if not interactive:
+        return suggested_query(fallback["sql"], f"{problem} {fallback['explanation']}")
+    query_cache["pending_sql"] = fallback["sql"]
+    query_cache.pop("pending_question", None)  # never cache template answers
+    return {
+        "action": "confirm_query",
+        "query": fallback["sql"],
+        "prompt": f"⚠️ {problem} {fallback['explanation']}. Should I run this query instead?\nReply with: yes / no / rewrite"
+    }
+
+
+def suggested_query(sql, reason):
+    """A query a non-interactive caller gets back instead of a confirm_query prompt"""
+    return {
+        "action": "suggested_query",
+        "query": sql,
+        "prompt": f"⚠️ {reason}. The query was not run; ask on /ask to confirm it.",
+    }
+
+
+def get_agent_stats():
+    with validation_lock:
+        validation = dict(validation_stats)
+        fallbacks = dict(fallback_stats)
+    checked = validation["explain_passed"] + validation["explain_failed"] + validation["explain_unavailable"]
+    validation["llm_skip_rate"] = round(validation["explain_passed"] / checked, 3) if checked else 0.0
+    return {
+        "semantic_cache": SEMANTIC_CACHE.stats(),
+        "validation": validation,
+        "fallbacks": fallbacks,
+        "schema_pruning": SCHEMA_PRUNER.stats(),
+        "fast_rules": get_rule_stats("sql"),
+    }
 
 
 def get_valid_fields(table_name):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(f"SELECT * FROM {table_name} LIMIT 1")
-        return [desc[0] for desc in cur.description]
-    except:
-        return []
-    finally:
-        cur.close()
-        conn.close()
-
-def list_all_tables_and_fields():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';")
-    tables = [row[0] for row in cur.fetchall()]
-    result = []
-    for table in tables:
+    with db_connection() as conn, conn.cursor() as cur:
         try:
-            cur.execute(f"SELECT * FROM {table} LIMIT 1")
-            fields = [desc[0] for desc in cur.description]
-            result.append(f"📘 Table: `{table}`\nFields: {', '.join(fields)}")
+            cur.execute(f"SELECT * FROM {table_name} LIMIT 1")
+            return [desc[0] for desc in cur.description]
         except:
-            result.append(f"📘 Table: `{table}` (unable to fetch fields)")
-    cur.close()
-    conn.close()
+            return []
+
+def list_all_tables_and_fields():
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';")
+        tables = [row[0] for row in cur.fetchall()]
+        result = []
+        for table in tables:
+            try:
+                cur.execute(f"SELECT * FROM {table} LIMIT 1")
+                fields = [desc[0] for desc in cur.description]
+                result.append(f"📘 Table: `{table}`\nFields: {', '.join(fields)}")
+            except:
+                conn.rollback()  # a failed statement aborts the transaction for the next tables
+                result.append(f"📘 Table: `{table}` (unable to fetch fields)")
     return "\n\n".join(result)
 
 def preview_table(table):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(f"SELECT * FROM {table} LIMIT 1")
-        row = cur.fetchone()
-        if row:
-            fields = [desc[0] for desc in cur.description]
-            return f"📘 Table: `{table}`\nFields: {', '.join(fields)}"
-        else:
-            return f"📘 Table: `{table}` (no sample found)"
-    except Exception as e:
-        return f"⚠️ Error previewing table `{table}`: {e}"
-    finally:
-        cur.close()
-        conn.close()
-
-def preprocess_country_names(query):
-    words = query.split()
-    for word in words:
-        if len(word) < 4:  # Skip short ambiguous words like 'id', 'is', etc.
-            continue
-        iso = get_country_iso3(word)
-        if iso:
-            query = re.sub(rf"\b{re.escape(word)}\b", iso, query, flags=re.IGNORECASE)
-
-    return query
+    with db_connection() as conn, conn.cursor() as cur:
+        try:
+            cur.execute(f"SELECT * FROM {table} LIMIT 1")
+            row = cur.fetchone()
+            if row:
+                fields = [desc[0] for desc in cur.description]
+                return f"📘 Table: `{table}`\nFields: {', '.join(fields)}"
+            else:
+                return f"📘 Table: `{table}` (no sample found)"
+        except Exception as e:
+            return f"⚠️ Error previewing table `{table}`: {e}"
 
 def run_sql_interactively(sql, table, action, user_query):
     if input("Run? (yes/no): ").lower() == "yes":
@@ -170,7 +233,48 @@ def delete_price(_):
     print(sql)
     return run_sql_interactively(sql, "food_prices", "DELETE", _)
 
-def process_query(user_query):
+def process_query(user_query, deadline=None, interactive=True):
+    """
+    Answer a question within the request's time budget
+
+    Args:
+        user_query: Question or confirmation reply from the user
+        deadline: Deadline for the whole request (None = no budget, e.g. the CLI)
+        interactive: False for callers that cannot answer a confirmation (/ask/batch):
+            queries that would need one come back as a suggested_query action,
+            and the pending query of the /ask user is left alone
+
+    Returns:
+        Formatted results, or a confirm_query action. Once the budget runs out
+        the user is offered a FallbackLLM template query instead.
+    """
+    deadline = deadline or Deadline(None)
+    with trace():  # LLM calls made for this question are stored with its log row
+        try:
+            return run_pipeline(_process_query(user_query, deadline, interactive))
+        except DeadlineExceeded as e:
+            print(f"⏱️ {e}")
+            return fallback_confirmation(
+                preprocess_country_names(user_query), reason="deadline_exceeded", interactive=interactive
+            )
+
+
+async def process_query_async(user_query, deadline=None, interactive=True):
+    """process_query on an event loop - LLM waits hold no thread (see run_pipeline_async)"""
+    deadline = deadline or Deadline(None)
+    with trace():
+        try:
+            return await run_pipeline_async(_process_query(user_query, deadline, interactive))
+        except DeadlineExceeded as e:
+            print(f"⏱️ {e}")
+            return fallback_confirmation(
+                preprocess_country_names(user_query), reason="deadline_exceeded", interactive=interactive
+            )
+
+def _process_query(user_query, deadline, interactive=True):
+    # A generator: LLM calls are yielded (`yield LLM.call(...)`) and made by the driver
+    # Pending operations / queries wait for the user's next message; batch items keep theirs to themselves
+    state = query_cache if interactive else {}
 
     if "=" in user_query and "," in user_query:
         try:
@@ -195,7 +299,7 @@ def process_query(user_query):
                 if v.strip() == "":
                     structured_input[k] = None
 
-            op = query_cache.get("pending_op", {})
+            op = state.get("pending_op", {})
             table = op.get("table")
             action = op.get("operation")
 
@@ -278,7 +382,7 @@ def process_query(user_query):
     # Handle frontend response to confirmation
     if uq in ["yes", "no", "rewrite"]:
         if uq == "no":
-            insert_log("Query canceled", "CANCEL", query_cache.get("pending_sql", ""), success=False)
+            insert_log("Query canceled", "CANCEL", state.get("pending_sql", ""), success=False)
             return "❌ Query canceled."
         elif uq == "rewrite":
             return {
@@ -286,10 +390,13 @@ def process_query(user_query):
                 "prompt": "🔁 Please clarify your question:"
             }
         elif uq == "yes":
-            cleaned_sql = query_cache.pop("pending_sql", "")
+            cleaned_sql = state.pop("pending_sql", "")
+            pending_question = state.pop("pending_question", None)
             try:
-                rows, cols = execute_sql_query(cleaned_sql)
+                rows, cols = execute_sql_query(cleaned_sql, timeout=deadline.db_timeout())
                 insert_log(user_query, "QUERY", cleaned_sql, success=bool(rows))
+                if rows and pending_question and is_read_only(cleaned_sql):
+                    SEMANTIC_CACHE.store(pending_question, cleaned_sql)
                 return format_sql_results(rows, cols) if rows else "❗ No results."
             except Exception as e:
                 insert_log(user_query, "ERROR", cleaned_sql, success=False)
@@ -297,7 +404,7 @@ def process_query(user_query):
 
 
     if "add recipe" in uq:
-        query_cache["pending_op"] = {"table": "recipes", "operation": "insert"}
+        state["pending_op"] = {"table": "recipes", "operation": "insert"}
         return {
             "action": "collect_input",
             "operation": "insert",
@@ -311,7 +418,7 @@ def process_query(user_query):
         }
 
     if "update recipe" in uq or "modify recipe" in uq:
-        query_cache["pending_op"] = {"table": "recipes", "operation": "update"}
+        state["pending_op"] = {"table": "recipes", "operation": "update"}
         return {
             "action": "collect_input",
             "operation": "update",
@@ -321,7 +428,7 @@ def process_query(user_query):
         }
 
     if "delete recipe" in uq or "remove recipe" in uq:
-        query_cache["pending_op"] = {"table": "recipes", "operation": "delete"}
+        state["pending_op"] = {"table": "recipes", "operation": "delete"}
         return {
             "action": "collect_input",
             "operation": "delete",
@@ -331,7 +438,7 @@ def process_query(user_query):
         }
 
     if "add nutrition" in uq:
-        query_cache["pending_op"] = {"table": "ingredient_nutrition", "operation": "insert"}
+        state["pending_op"] = {"table": "ingredient_nutrition", "operation": "insert"}
         return {
             "action": "collect_input",
             "operation": "insert",
@@ -344,7 +451,7 @@ def process_query(user_query):
         }
 
     if "update nutrition" in uq or "modify nutrition" in uq:
-        query_cache["pending_op"] = {"table": "ingredient_nutrition", "operation": "update"}
+        state["pending_op"] = {"table": "ingredient_nutrition", "operation": "update"}
         return {
             "action": "collect_input",
             "operation": "update",
@@ -354,7 +461,7 @@ def process_query(user_query):
         }
 
     if "delete nutrition" in uq or "remove nutrition" in uq:
-        query_cache["pending_op"] = {"table": "ingredient_nutrition", "operation": "delete"}
+        state["pending_op"] = {"table": "ingredient_nutrition", "operation": "delete"}
         return {
             "action": "collect_input",
             "operation": "delete",
@@ -364,7 +471,7 @@ def process_query(user_query):
         }
 
     if "add price" in uq:
-        query_cache["pending_op"] = {"table": "food_prices", "operation": "insert"}
+        state["pending_op"] = {"table": "food_prices", "operation": "insert"}
         return {
             "action": "collect_input",
             "operation": "insert",
@@ -377,7 +484,7 @@ def process_query(user_query):
         }
 
     if "update price" in uq or "modify price" in uq:
-        query_cache["pending_op"] = {"table": "food_prices", "operation": "update"}
+        state["pending_op"] = {"table": "food_prices", "operation": "update"}
         return {
             "action": "collect_input",
             "operation": "update",
@@ -387,7 +494,7 @@ def process_query(user_query):
         }
 
     if "delete price" in uq or "remove price" in uq:
-        query_cache["pending_op"] = {"table": "food_prices", "operation": "delete"}
+        state["pending_op"] = {"table": "food_prices", "operation": "delete"}
         return {
             "action": "collect_input",
             "operation": "delete",
@@ -397,26 +504,92 @@ def process_query(user_query):
         }
 
 
+    fast = match_sql(user_query)
+    if fast:
+        print(f"\n⚡ Fast rule `{fast['rule']}` answered without the LLM:\n", fast["sql"], fast["params"])
+        logged_sql = f"-- fast rule: {fast['rule']} {list(fast['params'])}\n{fast['sql']}"
+        try:
+            rows, cols = execute_sql_query(fast["sql"], params=fast["params"], timeout=deadline.db_timeout())
+            insert_log(user_query, "QUERY", logged_sql, success=bool(rows))
+        except Exception as e:
+            insert_log(user_query, "ERROR", logged_sql, success=False)
+            return f"❌ SQL Execution Error: {e}"
+        if rows:
+            return format_sql_results(rows, cols)
+        # The shape matched but the question meant something else; let the LLM read it
+        print("⚡ Fast rule found no rows, asking the LLM instead")
+
+    cached_sql = SEMANTIC_CACHE.lookup(user_query)
+    if cached_sql:
+        print("\n♻️ Reusing SQL from a similar question:\n", cached_sql)
+        try:
+            rows, cols = execute_sql_query(cached_sql, timeout=deadline.db_timeout())
+            insert_log(user_query, "QUERY", cached_sql, success=bool(rows))
+            return format_sql_results(rows, cols) if rows else "❗ No results."
+        except Exception as e:
+            insert_log(user_query, "ERROR", cached_sql, success=False)
+            return f"❌ SQL Execution Error: {e}"
+
     with open(SQL_SCHEMA_PATH, "r", encoding="utf-8") as schema_file:
         schema = schema_file.read()
     with open(SQL_PROMPT_PATH, "r", encoding="utf-8") as prompt_file:
         prompt = prompt_file.read()
-    final_prompt = prompt.replace("{SCHEMA}", schema).replace("{QUESTION}", user_query)
-    raw_sql = PRIMARY_LLM.ask_ai(final_prompt)
+    final_prompt = SCHEMA_PRUNER.render(prompt, schema, user_query)
+
+    # The first SQL PostgreSQL can plan is kept: from a smaller model with
+    # OLLAMA_CASCADE_MODELS, or the first of several raced candidates with LLM_HEDGE_CANDIDATES
+    explained = {}
+
+    def plans(raw):
+        sql = clean_sql_query(raw)
+        explained[sql] = explain_sql_query(sql, timeout=deadline.db_timeout())
+        return explained[sql] is None
+
+    try:
+        raw_sql = yield PRIMARY_LLM.hedged_call(
+            final_prompt, plans, stop_at="sql", deadline=deadline, prefix=static_prefix(prompt)
+        )
+    except LLMUnavailableError as e:
+        print(f"⚠️ {e}")
+        return fallback_confirmation(user_query, interactive=interactive)
     cleaned_sql = clean_sql_query(raw_sql)
     print("\n🧠 Generated SQL Query:\n", cleaned_sql)
 
-    with open(SQL_SCHEMA_PATH, "r", encoding="utf-8") as schema_file:
-        sql_schema_context = schema_file.read()
+    # Dry-run with EXPLAIN first - only ask SYNTAX_LLM when PostgreSQL rejects the query
+    try:
+        if cleaned_sql in explained:
+            db_error = explained[cleaned_sql]  # already dry-run while generating
+        else:
+            db_error = explain_sql_query(cleaned_sql, timeout=deadline.db_timeout())
+    except Exception as e:
+        print(f"⚠️ EXPLAIN dry-run unavailable, falling back to LLM validation: {e}")
+        db_error = ""
+
+    if db_error is None:
+        count_validation("explain_passed")
+        print("\n✅ EXPLAIN dry-run passed, skipping syntax LLM")
+        feedback = "Valid ✅"
+    else:
+        count_validation("explain_failed" if db_error else "explain_unavailable", "llm_validations")
+        if db_error:
+            print("\n🧪 EXPLAIN dry-run failed:\n", db_error)
+
+        # Keep the tables the question and the generated query refer to
+        sql_schema_context = SCHEMA_PRUNER.prune(schema, f"{user_query}\n{cleaned_sql}")
 
-    syntax_prompt = f"""You are a PostgreSQL syntax and schema validator.
+        error_context = f"""
+        PostgreSQL rejected this query with the following error:
+        {db_error}
+        """ if db_error else ""
+
+        syntax_prompt = f"""You are a PostgreSQL syntax and schema validator.
 
         Below is the database schema:
         {sql_schema_context}
 
         And here is the generated SQL query:
         {cleaned_sql}
-
+        {error_context}
         Please check if:
         - The syntax is valid
         - All table and column names match the schema
@@ -429,13 +602,21 @@ def process_query(user_query):
         If invalid, reply only with the corrected SQL query enclosed in a ```sql block — and nothing else.
 
         """
-    feedback = SYNTAX_LLM.ask_ai(syntax_prompt)
-    print("\n🧪 Syntax LLM Feedback:\n", feedback)
+        try:
+            feedback = yield SYNTAX_LLM.call(syntax_prompt, deadline=deadline)
+        except LLMUnavailableError as e:
+            print(f"⚠️ {e}")
+            return fallback_confirmation(user_query, interactive=interactive)
+        print("\n🧪 Syntax LLM Feedback:\n", feedback)
+
     if "Valid ✅" not in feedback and any(kw in feedback for kw in ["SELECT", "INSERT", "UPDATE", "DELETE"]):
         cleaned_sql = clean_sql_query(feedback)
         print("\n✅ Using corrected SQL:\n", cleaned_sql)
+        if not interactive:
+            return suggested_query(cleaned_sql, "The syntax check rewrote the generated SQL")
 
-        query_cache["pending_sql"] = cleaned_sql  # store for later execution
+        state["pending_sql"] = cleaned_sql  # store for later execution
+        state["pending_question"] = user_query
         return {
             "action": "confirm_query",
             "query": cleaned_sql,
@@ -444,8 +625,10 @@ def process_query(user_query):
 
 
     try:
-        rows, cols = execute_sql_query(cleaned_sql)
+        rows, cols = execute_sql_query(cleaned_sql, timeout=deadline.db_timeout())
         insert_log(user_query, "QUERY", cleaned_sql, success=bool(rows))
+        if rows and is_read_only(cleaned_sql):
+            SEMANTIC_CACHE.store(user_query, cleaned_sql)
         return format_sql_results(rows, cols) if rows else "❗ No results."
     except Exception as e:
         insert_log(user_query, "ERROR", cleaned_sql, success=False)
@@ -1,34 +1,43 @@
 TABLE: recipes
-- RecipeId INT PRIMARY KEY
-- Name TEXT
-- RecipeIngredientParts TEXT[]
-- RecipeCategory TEXT
-- Calories NUMERIC
-- FatContent NUMERIC
-- CarbohydrateContent NUMERIC
-- ProteinContent NUMERIC
-- RecipeInstructions TEXT
-- AggregatedRating NUMERIC
-- ReviewCount NUMERIC
+- recipeid (text)
+- name (text)
+- recipeingredientparts (text[])
+- recipecategory (text)
+- calories (numeric)
+- fatcontent (numeric)
+- carbohydratecontent (numeric)
+- proteincontent (numeric)
+- recipeinstructions (text[])
+- aggregatedrating (numeric)
+- reviewcount (numeric)
 
 TABLE: ingredient_nutrition
-- id SERIAL PRIMARY KEY
-- fdc_id BIGINT NOT NULL
-- ingredient_name TEXT
-- [various nutrient columns such as protein_g, fat_g, etc.]
+- id (serial primary key)
+- fdc_id (bigint)
+- ingredient_name (text)
+- category_name (text)
+- fat_g (numeric)
+- carbohydrate_g (numeric)
+- protein_g (numeric)
+- energy_kcal (numeric)
+
+TABLE: recipe_ingredients (join table)
+- recipe_id (text) → recipes(recipeid)
+- ingredient_name (text)
+- fdc_id (bigint)
+- ingredient_id (int) → ingredient_nutrition(id)
 
 TABLE: food_prices
-- id SERIAL PRIMARY KEY
-- commodity TEXT
-- countryiso3 TEXT
-- market TEXT
-- date DATE
-- price NUMERIC
-- usdprice NUMERIC
+- id (serial primary key)
+- countryiso3 (text)
+- date (date)
+- market (text)
+- category (text)
+- commodity (text)
+- unit (text)
+- price (numeric)
+- usdprice (numeric)
 
-TABLE: recipe_ingredients
-- id SERIAL PRIMARY KEY
-- recipe_id → recipes(RecipeId)
-- ingredient_id → ingredient_nutrition(id)
-- ingredient_name (TEXT)
-- fdc_id (BIGINT)
+TABLE: country_codes (reference)
+- name (text)
+- iso3 (text)
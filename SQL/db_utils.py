@@ -1,30 +1,217 @@
 import psycopg2
+import psycopg2.pool
 import json
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from llm_metrics import histogram, register_collector
 
 
 load_dotenv()
 
+# Connection pool - one per process, shared by every thread. DB_POOL_MIN
+# connections are opened up front and kept; ones above that are closed when
+# returned. Checkout waits up to DB_POOL_TIMEOUT seconds for a free connection
+# once DB_POOL_MAX are in use.
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_MIN = min(int(os.getenv("DB_POOL_MIN", "4")), DB_POOL_MAX)
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_HEALTH_CHECK = os.getenv("DB_POOL_HEALTH_CHECK", "true").lower() == "true"  # SELECT 1 on checkout
+
+DB_POOL_WAIT_SECONDS = histogram(
+    "recipellm_db_pool_wait_seconds", "Time spent waiting for a pooled PostgreSQL connection",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_pool_stats = {"checkouts": 0, "waited": 0, "timeouts": 0, "discarded": 0, "connect_errors": 0}
+_pool_stats_lock = threading.Lock()
+
+
+def _connect_params():
+    return {
+        "dbname": os.getenv("DB_NAME", "recipe_chatbot"),
+        "user": os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASSWORD", ""),
+        "host": os.getenv("DB_HOST", "localhost"),
+        "port": os.getenv("DB_PORT", "5432"),
+    }
 
 def get_db_connection():
-    return psycopg2.connect(
-        dbname=os.getenv("DB_NAME", "recipe_chatbot"),
-        user=os.getenv("DB_USER", "postgres"),
-        password=os.getenv("DB_PASSWORD", ""),
-        host=os.getenv("DB_HOST", "localhost"),
-        port=os.getenv("DB_PORT", "5432")
-    )
+    """A new, unpooled connection; the caller closes it. Prefer db_connection()"""
+    return psycopg2.connect(**_connect_params())
+
+def _count(key):
+    with _pool_stats_lock:
+        _pool_stats[key] += 1
+
+def _get_pool():
+    """The process's pool, created on first use (and again in a forked worker)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # a forked worker must not share the parent's sockets: leave them unclosed
+            _pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **_connect_params())
+            _pool_pid = os.getpid()
+        return _pool
+
+def _healthy(conn):
+    if conn.closed:
+        return False
+    if not DB_POOL_HEALTH_CHECK:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _checkout():
+    """
+    Take a healthy connection from the pool. Connections broken by a
+    PostgreSQL restart are closed and replaced with fresh ones.
+    """
+    pool = _get_pool()
+    for _ in range(DB_POOL_MAX + 1):  # every idle connection may be stale after a restart
+        try:
+            conn = pool.getconn()
+        except psycopg2.OperationalError:
+            _count("connect_errors")
+            raise
+        if _healthy(conn):
+            return pool, conn
+        _count("discarded")
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("no healthy PostgreSQL connection in the pool")
+
+@contextmanager
+def db_connection(timeout=None):
+    """
+    Borrow a pooled connection for the block; it goes back to the pool on exit
+
+    Uncommitted work is rolled back when the connection is returned, and a
+    connection that was lost mid-query is closed instead of reused. timeout caps the wait for a free connection in seconds
+    (default DB_POOL_TIMEOUT).
 
-def execute_sql_query(sql_query):
-    conn = get_db_connection()
-    cur = conn.cursor()
+    Raises:
+        psycopg2.pool.PoolError: no connection was free within the timeout
+        psycopg2.OperationalError: PostgreSQL is unreachable
+    """
+    wait = DB_POOL_TIMEOUT if timeout is None else min(timeout, DB_POOL_TIMEOUT)
+    started = time.perf_counter()
+    acquired = _pool_slots.acquire(blocking=False)
+    if not acquired:
+        _count("waited")
+        acquired = _pool_slots.acquire(timeout=wait)
+    DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+    if not acquired:
+        _count("timeouts")
+        raise psycopg2.pool.PoolError(f"no PostgreSQL connection free after {wait:.1f}s ({DB_POOL_MAX} in use)")
+
+    try:
+        pool, conn = _checkout()
+    except Exception:
+        _pool_slots.release()
+        raise
+    _count("checkouts")
     try:
-        cur.execute(sql_query)
-        conn.commit()  
-        rows = cur.fetchall() if cur.description else []
-        cols = [desc[0] for desc in cur.description] if cur.description else []
-        return rows, cols
+        yield conn
     finally:
-        cur.close()
-        conn.close()
+        try:
+            # psycopg2 marks a connection lost mid-query as closed; the pool
+            # rolls back open transactions on the others
+            pool.putconn(conn, close=bool(conn.closed))
+        except Exception as e:
+            print(f"⚠️ Failed to return PostgreSQL connection to the pool: {e}")
+        _pool_slots.release()
+
+def get_pool_stats():
+    """Connection pool counters for the /diagnostics endpoint"""
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    with _pool_lock:
+        pool = _pool if _pool_pid == os.getpid() else None
+    stats.update(
+        min_size=DB_POOL_MIN,
+        max_size=DB_POOL_MAX,
+        in_use=len(pool._used) if pool else 0,
+        idle=len(pool._pool) if pool else 0,
+    )
+    return stats
+
+def _metrics_rows():
+    stats = get_pool_stats()
+    rows = [
+        ("recipellm_db_pool_connections", "gauge", "Pooled PostgreSQL connections by state", {"state": "in_use"},
+         stats["in_use"]),
+        ("recipellm_db_pool_connections", "gauge", "Pooled PostgreSQL connections by state", {"state": "idle"},
+         stats["idle"]),
+        ("recipellm_db_pool_max_connections", "gauge", "Upper bound of the PostgreSQL pool", {}, stats["max_size"]),
+    ]
+    for key in ("checkouts", "waited", "timeouts", "discarded", "connect_errors"):
+        rows.append((f"recipellm_db_pool_{key}_total", "counter",
+                     "Pool checkouts / that had to wait / that timed out / stale connections replaced / failed connects",
+                     {}, stats[key]))
+    return rows
+
+register_collector(_metrics_rows)
+
+def set_statement_timeout(cur, timeout):
+    """Cap statements in the current transaction at timeout seconds (None = no cap)"""
+    if timeout is not None:
+        cur.execute("SET LOCAL statement_timeout = %s", (max(int(timeout * 1000), 1),))
+
+def execute_sql_query(sql_query, params=None, timeout=None):
+    with db_connection(timeout) as conn:
+        with conn.cursor() as cur:
+            set_statement_timeout(cur, timeout)
+            cur.execute(sql_query, params)
+            conn.commit()  
+            rows = cur.fetchall() if cur.description else []
+            cols = [desc[0] for desc in cur.description] if cur.description else []
+            return rows, cols
+
+def single_statement(sql_query):
+    """Strip trailing semicolons; raise if more than one statement remains"""
+    statement = sql_query.strip().rstrip(";").strip()
+    quote = None
+    for ch in statement:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == ";":
+            raise ValueError("multiple SQL statements are not allowed")
+    return statement
+
+def explain_sql_query(sql_query, timeout=None):
+    """
+    Dry-run a statement with EXPLAIN (planned, never executed).
+    Returns None if PostgreSQL accepts it, otherwise the database error message.
+    Connection problems are raised to the caller.
+    timeout caps planning time in seconds, like execute_sql_query.
+    """
+    try:
+        statement = single_statement(sql_query)
+    except ValueError as e:
+        return str(e)
+
+    with db_connection(timeout) as conn:
+        with conn.cursor() as cur:
+            try:
+                set_statement_timeout(cur, timeout)
+                cur.execute(f"EXPLAIN {statement}")
+                return None
+            except psycopg2.Error as e:
+                return (e.pgerror or str(e)).strip()
+            finally:
+                if not conn.closed:
+                    conn.rollback()
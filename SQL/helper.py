@@ -1,3 +1,4 @@
+import re
 import pycountry
 
 def get_country_iso3(name):
@@ -5,3 +6,14 @@ def get_country_iso3(name):
         return pycountry.countries.lookup(name).alpha_3.upper()
     except LookupError:
         return None
+
+def preprocess_country_names(query):
+    words = query.split()
+    for word in words:
+        if len(word) < 4:  # Skip short ambiguous words like 'id', 'is', etc.
+            continue
+        iso = get_country_iso3(word)
+        if iso:
+            query = re.sub(rf"\b{re.escape(word)}\b", iso, query, flags=re.IGNORECASE)
+
+    return query
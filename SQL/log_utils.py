@@ -1,5 +1,7 @@
-from SQL.db_utils import get_db_connection
+from SQL.db_utils import db_connection
 from datetime import datetime
+from psycopg2.extras import Json
+from llm_metrics import current_trace, summarize_trace
 
 def insert_log(
     user_query,
@@ -11,34 +13,34 @@ def insert_log(
     price_id=None,
     success=True
 ):
+    # Per-call LLM latency / token figures for the question being answered
+    llm_stats = summarize_trace(current_trace())
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-
-        cur.execute("""
-            INSERT INTO query_logs (
-                timestamp,
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO query_logs (
+                    timestamp,
+                    user_query,
+                    action_type,
+                    executed_sql,
+                    related_table,
+                    ingredient_id,
+                    recipe_id,
+                    price_id,
+                    llm_stats
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                datetime.now(),
                 user_query,
-                action_type,
+                f"{action_type}_{'SUCCESS' if success else 'FAIL'}",
                 executed_sql,
                 related_table,
                 ingredient_id,
                 recipe_id,
-                price_id
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            datetime.now(),
-            user_query,
-            f"{action_type}_{'SUCCESS' if success else 'FAIL'}",
-            executed_sql,
-            related_table,
-            ingredient_id,
-            recipe_id,
-            price_id
-        ))
+                price_id,
+                Json(llm_stats) if llm_stats else None
+            ))
 
-        conn.commit()
-        cur.close()
-        conn.close()
+            conn.commit()
     except Exception as e:
         print(f"❌ Failed to log query: {e}")
@@ -1,14 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-import psycopg2
 import traceback
 import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError as FutureTimeout
 from pymongo import MongoClient
-from SQL.db_utils import execute_sql_query
+from SQL.db_utils import db_connection, execute_sql_query, get_pool_stats as db_pool_stats
 from SQL.log_utils import insert_log
-from Mongodb.agent3 import process_query as process_mongo
-from SQL.agent3_sql_final import process_query as process_sql
+from Mongodb.agent3 import (
+    process_query as process_mongo, process_query_async as process_mongo_async, get_agent_stats as mongo_agent_stats,
+)
+from SQL.agent3_sql_final import (
+    process_query as process_sql, process_query_async as process_sql_async, get_agent_stats as sql_agent_stats,
+)
 from Mongodb.mongo_utils import load_config as load_mongo_config
+from llm_wrapper_opensource import llm_diagnostics, llm_parallel_slots, llm_priority
+from deadline import Deadline, DeadlineExceeded, DEFAULT_ASK_DEADLINE, DEADLINE_HEADER
+from llm_metrics import render_prometheus
 # from SQL.db_utils import load_config as load_sql_config
 
 app = Flask(__name__)
@@ -18,6 +27,24 @@ CORS(app)
 mongo_config = load_mongo_config()
 # sql_config = load_sql_config
 
+# /ask/batch fans questions out over a pool no wider than the LLM servers'
+# parallel slots across all their endpoints, shared by every batch request
+ASK_BATCH_MAX_ITEMS = int(os.getenv("ASK_BATCH_MAX_ITEMS", "500"))
+ASK_BATCH_DEADLINE = float(os.getenv("ASK_BATCH_DEADLINE_SECONDS", "300"))  # whole batch, queueing included
+batch_executor = None
+batch_slots = None
+batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    """The batch pool, sized on first use once the LLM providers are known"""
+    global batch_executor, batch_slots
+    with batch_executor_lock:
+        if batch_executor is None:
+            batch_slots = llm_parallel_slots()
+            batch_executor = ThreadPoolExecutor(max_workers=batch_slots, thread_name_prefix="ask-batch")
+        return batch_executor
+
 @app.route("/health")
 def health():
     return jsonify({"status": "up"})
@@ -30,23 +57,17 @@ def diagnostics():
         "llm_api_key_present": bool(os.getenv("LLM_API_KEY")),
         "postgres": {"ok": False, "error": None},
         "mongo": {"ok": False, "error": None},
+        "llm": llm_diagnostics(),
+        "agents": {"sql": sql_agent_stats(), "mongo": mongo_agent_stats()},
     }
 
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432"),
-            database=os.getenv("DB_NAME", "recipe_chatbot"),
-            user=os.getenv("DB_USER", "postgres"),
-            password=os.getenv("DB_PASSWORD", ""),
-        )
-        cur = conn.cursor()
-        cur.execute("SELECT 1;")
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT 1;")
         result["postgres"]["ok"] = True
     except Exception as e:
         result["postgres"]["error"] = str(e)
+    result["postgres"]["pool"] = db_pool_stats()
 
     try:
         mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
@@ -59,6 +80,11 @@ def diagnostics():
     status = 200 if result["postgres"]["ok"] and result["mongo"]["ok"] else 503
     return jsonify(result), status
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Per-call LLM latency and token counters in Prometheus text format"""
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/")
 def home():
     return "👋 Welcome to RecipeLLM Backend (Hybrid Mongo + SQL)!"
@@ -68,16 +94,8 @@ def home():
 @app.route("/check-db", methods=["GET"])
 def check_db():
     try:
-        conn = psycopg2.connect(
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432"),
-            database=os.getenv("DB_NAME", "recipe_chatbot"),
-            user=os.getenv("DB_USER", "postgres"),
-            password=os.getenv("DB_PASSWORD", "")
-        )
-        cur = conn.cursor()
-        cur.execute("SELECT 1;")
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT 1;")
         return jsonify({"status": "✅ PostgreSQL connection successful!"})
     except Exception as e:
         print("❌ PostgreSQL connection failed:", e)
@@ -87,39 +105,156 @@ def check_db():
 @app.route("/ask", methods=["POST"])
 def ask():
     try:
-        data = request.get_json()
-        user_query = data.get("query", "")
-        mode = data.get("mode", "mongo").lower().strip()  # Default to Mongo
+        deadline = Deadline.from_headers(request.headers)  # X-Request-Timeout or ASK_DEADLINE_SECONDS
+        user_query, mode, error = ask_request(request.get_json(silent=True))
+        if error:
+            return jsonify(error[0]), error[1]
+        return jsonify(ask_body(run_query(user_query, mode, deadline)))
+    except Exception as e:
+        body, status_code = ask_error(e)
+        return jsonify(body), status_code
+
+# /ask helpers, shared with the ASGI entry point (asgi.py)
+def ask_request(data):
+    """
+    Read an /ask body (None when it was not valid JSON)
+
+    Returns:
+        (user_query, mode, None), or (None, None, (error body, status)) for a bad request
+    """
+    data = data if isinstance(data, dict) else {}
+    user_query = data.get("query", "")
+    mode = data.get("mode", "mongo").lower().strip()  # Default to Mongo
+
+    if not user_query:
+        return None, None, ({"error": "Query is required."}, 400)
+
+    print(f"\n🧠 User query: {user_query}")
+    print(f"🧭 Mode selected: {mode}")
+
+    if mode not in ("mongo", "sql"):
+        return None, None, ({"error": "Invalid mode. Use 'mongo' or 'sql'."}, 400)
+    return user_query, mode, None
+
+def ask_body(result):
+    """Handle return type: dict (action) vs string (result)"""
+    return result if isinstance(result, dict) else {"result": result}
+
+def ask_error(e):
+    """(error body, status) for an exception raised while answering /ask"""
+    print(f"❌ Backend error: {e}")
+    traceback.print_exc()
+    error_text = str(e)
+    status_code = 500
+    lowered = error_text.lower()
+    if "429" in error_text or "quota" in lowered or "rate limit" in lowered:
+        status_code = 429
+    return {"error": error_text}, status_code
+
+def run_query(user_query, mode, deadline, interactive=True):
+    """Send a question to the agent for mode ("mongo" or "sql")"""
+    if mode == "mongo":
+        return process_mongo(user_query, deadline=deadline, interactive=interactive)
+    return process_sql(user_query, deadline=deadline, interactive=interactive)
+
+async def run_query_async(user_query, mode, deadline):
+    """run_query on an event loop (asgi.py)"""
+    if mode == "mongo":
+        return await process_mongo_async(user_query, deadline=deadline)
+    return await process_sql_async(user_query, deadline=deadline)
+
+
+def run_batch_item(user_query, mode, budget, batch_deadline):
+    """Answer one batch question; the deadline starts when a worker picks it up, capped by the batch's"""
+    started = time.perf_counter()
+    try:
+        remaining = batch_deadline.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Batch deadline of {batch_deadline.budget}s exceeded before this item started")
+        # Batch LLM calls queue behind interactive /ask calls
+        with llm_priority("batch"):
+            # Nobody can answer a confirmation here, and the /ask user's pending query must survive
+            result = run_query(user_query, mode, Deadline(min(budget, remaining)), interactive=False)
+        # Same body /ask would return: the action dict, or {"result": text}
+        item = {"response": ask_body(result)}
+    except DeadlineExceeded as e:
+        item = {"error": str(e), "timed_out": True}
+    except Exception as e:
+        print(f"❌ Batch item failed ({mode}): {e}")
+        item = {"error": str(e)}
+    item["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return item
+
+
+@app.route("/ask/batch", methods=["POST"])
+def ask_batch():
+    """
+    Answer a list of {query, mode} items concurrently
+
+    Identical questions (same mode, same text) run once. Results come back in
+    input order, each with its own elapsed_ms. Validated queries run without a
+    confirmation; ones that would need it come back as a suggested_query action. X-Request-Timeout sets the
+    budget per item; ASK_BATCH_DEADLINE_SECONDS bounds the whole batch, queueing included, and items
+    still unfinished when it runs out come back with a timed-out error.
+    """
+    started = time.perf_counter()
+    data = request.get_json(silent=True)
+    items = data.get("items") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Body must be a non-empty list of {query, mode} items (or {\"items\": [...]})."}), 400
+    if len(items) > ASK_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Too many items ({len(items)}); the limit is {ASK_BATCH_MAX_ITEMS}."}), 400
 
+    try:
+        budget = float(request.headers.get(DEADLINE_HEADER) or DEFAULT_ASK_DEADLINE)
+    except ValueError:
+        budget = 0
+    if not budget > 0:
+        return jsonify({"error": f"{DEADLINE_HEADER} must be a positive number of seconds."}), 400
+    executor = get_batch_executor()
+    batch_deadline = Deadline(ASK_BATCH_DEADLINE)
+
+    results = [None] * len(items)
+    futures = {}  # (mode, query) -> (first index, future)
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        user_query = str(item.get("query", "")).strip()
+        mode = str(item.get("mode", "mongo")).lower().strip()
+        entry = {"index": index, "query": user_query, "mode": mode}
         if not user_query:
-            return jsonify({"error": "Query is required."}), 400
-
-        print(f"\n🧠 User query: {user_query}")
-        print(f"🧭 Mode selected: {mode}")
-
-        if mode == "mongo":
-            result = process_mongo(user_query)
-        elif mode == "sql":
-            result = process_sql(user_query)
+            results[index] = dict(entry, error="Query is required.")
+        elif mode not in ("mongo", "sql"):
+            results[index] = dict(entry, error="Invalid mode. Use 'mongo' or 'sql'.")
+        elif user_query.lower() in ("yes", "no", "rewrite"):
+            results[index] = dict(entry, error="Confirmation replies are only supported on /ask.")
         else:
-            return jsonify({"error": "Invalid mode. Use 'mongo' or 'sql'."}), 400
+            key = (mode, " ".join(user_query.lower().split()))
+            if key not in futures:
+                futures[key] = (index, executor.submit(run_batch_item, user_query, mode, budget, batch_deadline))
+            results[index] = (entry, key)
+
+    for index, value in enumerate(results):
+        if isinstance(value, tuple):
+            entry, key = value
+            first_index, future = futures[key]
+            try:
+                outcome = future.result(timeout=max(batch_deadline.remaining(), 0))
+            except (FutureTimeout, CancelledError):
+                future.cancel()  # drops it if no worker has picked it up yet
+                outcome = {"error": f"Batch deadline of {ASK_BATCH_DEADLINE}s exceeded before this item finished.",
+                           "timed_out": True}
+            results[index] = dict(entry, **outcome)
+            if first_index != index:
+                results[index]["duplicate_of"] = first_index
+
+    return jsonify({
+        "results": results,
+        "items": len(items),
+        "unique": len(futures),
+        "slots": batch_slots,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
 
-        # Handle return type: dict (action) vs string (result)
-        if isinstance(result, dict):
-            return jsonify(result)
-        else:
-            return jsonify({"result": result})
-
-    except Exception as e:
-        print(f"❌ Backend error: {e}")
-        import traceback
-        traceback.print_exc()
-        error_text = str(e)
-        status_code = 500
-        lowered = error_text.lower()
-        if "429" in error_text or "quota" in lowered or "rate limit" in lowered:
-            status_code = 429
-        return jsonify({"error": error_text}), status_code
 
 @app.route("/submit", methods=["POST"])
 def submit():
@@ -0,0 +1,135 @@
+"""
+ASGI entry point - answers /ask on an event loop, so a question waiting on
+the LLM holds no worker thread and one process can keep hundreds pending.
+
+    uvicorn asgi:app --port 5001
+
+POST /ask runs the agents' process_query_async. Every other request (and the
+/ask CORS preflight) is handed to the Flask app in a worker thread, so those
+routes behave exactly as under `python app.py`.
+"""
+
+import asyncio
+import sys
+from io import BytesIO
+
+from werkzeug.datastructures import Headers
+
+from app import app as flask_app, ask_body, ask_error, ask_request, run_query_async
+from deadline import Deadline
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    body = await _read_body(receive)
+    if scope["method"] == "POST" and scope["path"] == "/ask":
+        payload, status = await _ask(scope, body)
+        await _respond(send, status, [
+            ("Content-Type", "application/json"),
+            ("Access-Control-Allow-Origin", "*"),  # as flask_cors does for the Flask routes
+        ], flask_app.json.dumps(payload).encode("utf-8"))
+        return
+
+    status, headers, content = await asyncio.to_thread(_call_flask, _wsgi_environ(scope, body))
+    await _respond(send, status, headers, content)
+
+
+async def _ask(scope, body):
+    """The /ask view, awaiting the agent instead of blocking on it"""
+    headers = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]])
+    try:
+        deadline = Deadline.from_headers(headers)  # X-Request-Timeout or ASK_DEADLINE_SECONDS
+        try:
+            data = flask_app.json.loads(body)
+        except ValueError:
+            data = None  # a 400 from ask_request, as get_json(silent=True) gives the WSGI /ask
+        user_query, mode, error = ask_request(data)
+        if error:
+            return error
+        return ask_body(await run_query_async(user_query, mode, deadline)), 200
+    except Exception as e:
+        return ask_error(e)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+async def _respond(send, status, headers, content: bytes):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+    await send({"type": "http.response.body", "body": content})
+
+
+def _wsgi_environ(scope, body: bytes) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[name] = value
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_flask(environ):
+    """Run one request through the Flask app: (status, headers, body)"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    result = flask_app(environ, start_response)
+    try:
+        content = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started["status"], started["headers"], content
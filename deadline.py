@@ -0,0 +1,73 @@
+"""
+Request Deadlines - One time budget for a whole /ask request.
+The deadline is created when the request arrives and passed down through
+process_query, the LLM calls and DB execution, so each stage only gets the
+time that is left instead of its own fixed timeout.
+"""
+
+import os
+import time
+from typing import Optional
+
+DEFAULT_ASK_DEADLINE = float(os.getenv("ASK_DEADLINE_SECONDS", "90"))
+DEADLINE_HEADER = "X-Request-Timeout"  # seconds, e.g. "X-Request-Timeout: 20"
+
+# Never hand a DB stage less than this - it should fail fast, not instantly
+MIN_DB_TIMEOUT = 0.05
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a stage starts (or an LLM call times out) after the budget ran out"""
+    pass
+
+
+class Deadline:
+    """
+    Absolute point in time by which a request must finish.
+
+    Deadline(None) never expires, so code paths without a budget (CLI loops)
+    can share the same calls.
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+
+    @classmethod
+    def from_headers(cls, headers) -> "Deadline":
+        """Budget from the X-Request-Timeout header, else ASK_DEADLINE_SECONDS"""
+        value = headers.get(DEADLINE_HEADER)
+        try:
+            seconds = float(value) if value else DEFAULT_ASK_DEADLINE
+        except ValueError:
+            seconds = DEFAULT_ASK_DEADLINE
+        return cls(seconds if seconds > 0 else DEFAULT_ASK_DEADLINE)
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, cap: Optional[float] = None, stage: str = "LLM call") -> Optional[float]:
+        """
+        Time a stage may use: the remaining budget, capped by the stage's own timeout
+
+        Raises:
+            DeadlineExceeded: if the budget is already spent
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.budget}s exceeded before {stage}")
+        if remaining == float("inf"):
+            return cap
+        return min(cap, remaining) if cap is not None else remaining
+
+    def db_timeout(self) -> Optional[float]:
+        """Remaining budget for a DB statement; never raises so the DB reports its own timeout"""
+        remaining = self.remaining()
+        if remaining == float("inf"):
+            return None
+        return max(remaining, MIN_DB_TIMEOUT)
@@ -0,0 +1,275 @@
+"""
+Fast Rules - Answers common question shapes without calling the LLM.
+"recipes with chicken under 400 calories", "price of rice in Kenya" and
+"protein in spinach" map directly to a query, so they are matched against
+precompiled patterns and turned into parameterized SQL or a Mongo query
+object in well under a millisecond. Ingredients and commodities are one or
+two plain words; anything that does not match exactly, or whose fast query
+finds nothing, goes on to the semantic cache and the LLM as before.
+
+Configuration via .env:
+- FAST_RULES: answer matching questions without the LLM (true by default)
+"""
+
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from SQL.helper import get_country_iso3
+
+FAST_RULES = os.getenv("FAST_RULES", "true").lower() == "true"
+
+# Question words that make a shape ambiguous ("chicken and rice", "without nuts")
+_BLOCKING_WORDS = re.compile(r"\b(?:and|or|not|no|without|except|but)\b")
+
+_LEAD = r"(?:please )?(?:(?:show|find|list|give|get|fetch|display)(?: me)? )?(?:some |all |the )?"
+_TERM = r"[a-z][a-z'-]+(?: [a-z][a-z'-]+)?"  # one or two words: "chicken", "olive oil"
+_PLACE = r"[a-z][a-z'-]+(?: [a-z][a-z'-]+){0,3}"  # resolved by _country, which rejects the rest
+
+# Words that mean a captured "ingredient" is really a ranking, a filter or a
+# number ("the most reviews", "high protein", "a rating above four")
+_NON_INGREDIENT_WORDS = frozenset("""
+    a an the this that these those my your any each every
+    most least more less much many high higher highest low lower lowest top best worst
+    rating ratings rated review reviews popular average sorted sort order ordered by
+    recipe recipes above below over under than per between
+    zero one two three four five six seven eight nine ten eleven twelve fifteen twenty
+    thirty forty fifty hundred thousand dozen half
+""".split())
+_TERM_GROUPS = ("ingredient", "commodity")
+
+# Question word -> ingredient_nutrition column (fixed list, safe to format into SQL)
+NUTRIENT_COLUMNS = {
+    "protein": "protein_g", "fat": "fat_g", "carb": "carbohydrate_g", "carbs": "carbohydrate_g",
+    "carbohydrate": "carbohydrate_g", "carbohydrates": "carbohydrate_g", "calories": "energy_kcal",
+    "energy": "energy_kcal", "kcal": "energy_kcal", "fiber": "fiber_g", "fibre": "fiber_g",
+    "sodium": "sodium_mg", "salt": "sodium_mg", "iron": "iron_mg", "calcium": "calcium_mg",
+    "potassium": "potassium_mg", "magnesium": "magnesium_mg", "zinc": "zinc_mg",
+}
+
+
+def _stem(term: str) -> str:
+    """Drop plural endings so "eggs" also finds "Egg, whole" (berries -> berr, tomatoes -> tomato)"""
+    if len(term) > 4 and term.endswith("ies"):
+        return term[:-3]
+    if len(term) > 4 and term.endswith("oes"):
+        return term[:-2]
+    if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        return term[:-1]
+    return term
+
+
+def _like(term: str) -> str:
+    return f"%{_stem(term)}%"
+
+
+def _regex(term: str) -> Dict[str, str]:
+    return {"$regex": re.escape(_stem(term)), "$options": "i"}
+
+
+def _country(name: str) -> Optional[str]:
+    name = name.strip()
+    iso = get_country_iso3(name)
+    if iso is None and re.fullmatch(r"[a-z]{3}", name):
+        iso = name.upper()  # already an ISO3 code (preprocess_country_names)
+    return iso
+
+
+class Rule:
+    """A question shape with builders for the SQL and the Mongo query it maps to"""
+
+    def __init__(
+        self,
+        name: str,
+        pattern: str,
+        sql: Callable[[dict], Optional[tuple]],
+        mongo: Callable[[dict], Optional[dict]],
+    ):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.sql = sql
+        self.mongo = mongo
+
+    def match(self, question: str) -> Optional[dict]:
+        match = self.pattern.fullmatch(question)
+        if not match:
+            return None
+        groups = {k: v.strip() for k, v in match.groupdict().items()}
+        if any(_BLOCKING_WORDS.search(v) for v in groups.values() if isinstance(v, str)):
+            return None
+        if any(word in _NON_INGREDIENT_WORDS for key in _TERM_GROUPS for word in groups.get(key, "").split()):
+            return None
+        return groups
+
+
+def _recipes_under_calories_sql(g):
+    return (
+        "SELECT * FROM recipes WHERE array_to_string(recipeingredientparts, ',') ILIKE %s "
+        "AND calories < %s ORDER BY calories LIMIT 10;",
+        (_like(g["ingredient"]), float(g["calories"])),
+    )
+
+
+def _recipes_under_calories_mongo(g):
+    return {
+        "collection": "recipes",
+        "query": {"recipeingredientparts": _regex(g["ingredient"]), "calories": {"$lt": float(g["calories"])}},
+        "sort": {"calories": 1},
+        "limit": 10,
+    }
+
+
+def _recipes_with_sql(g):
+    return (
+        "SELECT * FROM recipes WHERE array_to_string(recipeingredientparts, ',') ILIKE %s LIMIT 10;",
+        (_like(g["ingredient"]),),
+    )
+
+
+def _recipes_with_mongo(g):
+    return {"collection": "recipes", "query": {"recipeingredientparts": _regex(g["ingredient"])}, "limit": 10}
+
+
+def _price_in_country_sql(g):
+    iso = _country(g["country"])
+    if iso is None:
+        return None
+    return (
+        "SELECT commodity, market, date, price, unit, usdprice FROM food_prices "
+        "WHERE commodity ILIKE %s AND countryiso3 = %s ORDER BY date DESC LIMIT 10;",
+        (_like(g["commodity"]), iso),
+    )
+
+
+def _price_in_country_mongo(g):
+    iso = _country(g["country"])
+    if iso is None:
+        return None
+    return {
+        "collection": "food_prices",
+        "query": {"commodity": _regex(g["commodity"]), "countryiso3": iso},
+        "sort": {"date": -1},
+        "limit": 10,
+    }
+
+
+def _nutrient_in_sql(g):
+    column = NUTRIENT_COLUMNS[g["nutrient"]]
+    return (
+        f"SELECT ingredient_name, {column} FROM ingredient_nutrition WHERE ingredient_name ILIKE %s LIMIT 5;",
+        (_like(g["ingredient"]),),
+    )
+
+
+def _nutrient_in_mongo(g):
+    column = NUTRIENT_COLUMNS[g["nutrient"]]
+    return {
+        "collection": "ingredient_nutrition",
+        "query": {"ingredient_name": _regex(g["ingredient"])},
+        "projection": {"ingredient_name": 1, column: 1, "_id": 0},
+        "limit": 5,
+    }
+
+
+_NUTRIENT = "|".join(sorted(NUTRIENT_COLUMNS, key=len, reverse=True))
+
+# Most specific shapes first
+RULES = [
+    Rule(
+        "recipes_with_ingredient_under_calories",
+        rf"{_LEAD}recipes? (?:with|containing|using|that (?:have|contain|use)) (?P<ingredient>{_TERM}) "
+        r"(?:under|below|less than|fewer than) (?P<calories>\d+(?:\.\d+)?) ?(?:calories|kcal|cal)",
+        _recipes_under_calories_sql, _recipes_under_calories_mongo,
+    ),
+    Rule(
+        "price_of_commodity_in_country",
+        rf"(?:what(?: is|'s) |{_LEAD})(?:the )?(?:current )?(?:price|prices|cost) (?:of|for) (?P<commodity>{_TERM}) "
+        rf"in (?P<country>{_PLACE})",
+        _price_in_country_sql, _price_in_country_mongo,
+    ),
+    Rule(
+        "nutrient_in_ingredient",
+        rf"(?:how much |what(?: is|'s) (?:the )?)?(?P<nutrient>{_NUTRIENT}) (?:is )?(?:in|of) (?P<ingredient>{_TERM})",
+        _nutrient_in_sql, _nutrient_in_mongo,
+    ),
+    Rule(
+        "recipes_with_ingredient",
+        rf"{_LEAD}recipes? (?:with|containing|using|that (?:have|contain|use)) (?P<ingredient>{_TERM})",
+        _recipes_with_sql, _recipes_with_mongo,
+    ),
+]
+
+_stats_lock = threading.Lock()
+_stats = {
+    mode: {"checked": 0, "answered": 0, "match_seconds": 0.0, "rules": {rule.name: 0 for rule in RULES}}
+    for mode in ("sql", "mongo")
+}
+
+
+def _normalize(question: str) -> str:
+    question = " ".join(question.lower().split())
+    return question.rstrip("?.! ")
+
+
+def _match(question: str, mode: str) -> Optional[Dict[str, Any]]:
+    if not FAST_RULES:
+        return None
+    started = time.perf_counter()
+    question = _normalize(question)
+    answer = None
+    for rule in RULES:
+        groups = rule.match(question)
+        if groups is None:
+            continue
+        built = (rule.sql if mode == "sql" else rule.mongo)(groups)
+        if built is not None:
+            answer = {"rule": rule.name}
+            if mode == "sql":
+                answer["sql"], answer["params"] = built
+            else:
+                answer["query"] = built
+            break
+
+    with _stats_lock:
+        stats = _stats[mode]
+        stats["checked"] += 1
+        stats["match_seconds"] += time.perf_counter() - started
+        if answer:
+            stats["answered"] += 1
+            stats["rules"][answer["rule"]] += 1
+    return answer
+
+
+def match_sql(question: str) -> Optional[Dict[str, Any]]:
+    """
+    Parameterized SQL for a known question shape
+
+    Returns:
+        {"rule", "sql", "params"} or None when no rule applies
+    """
+    return _match(question, "sql")
+
+
+def match_mongo(question: str) -> Optional[Dict[str, Any]]:
+    """
+    Mongo query object for a known question shape
+
+    Returns:
+        {"rule", "query"} or None when no rule applies
+    """
+    return _match(question, "mongo")
+
+
+def get_rule_stats(mode: str) -> Dict[str, Any]:
+    """Fast-path hit counters per rule for /diagnostics ("sql" or "mongo")"""
+    with _stats_lock:
+        stats = dict(_stats[mode])
+        stats["rules"] = dict(stats["rules"])
+    checked = stats["checked"]
+    match_seconds = stats.pop("match_seconds")
+    stats["hit_rate"] = round(stats["answered"] / checked, 3) if checked else 0.0
+    stats["avg_match_us"] = round(match_seconds / checked * 1e6, 1) if checked else 0.0
+    stats["enabled"] = FAST_RULES
+    return stats
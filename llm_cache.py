@@ -0,0 +1,194 @@
+"""
+LLM Response Cache - Persistent on-disk cache for LLM generations.
+Backed by SQLite in WAL mode, so every gunicorn worker shares one store and
+cached answers survive restarts. Entries are keyed by provider, model,
+temperature and prompt hash, expire after a TTL and are evicted least
+recently used first once the store grows past its size budget.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent / ".cache" / "llm_cache.sqlite3"
+
+# Hits only rewrite last_access when it is older than this, so hot keys do not
+# turn every read into a write
+TOUCH_INTERVAL_SECONDS = 60
+
+
+class LLMResponseCache:
+    """
+    SQLite-backed response cache shared across processes.
+
+    Configuration via .env:
+    - LLM_CACHE_PATH: database file (default .cache/llm_cache.sqlite3)
+    - LLM_CACHE_MAX_BYTES: size budget before LRU eviction (default 64 MB)
+    - LLM_CACHE_TTL: seconds an entry stays valid (default 7 days)
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+    ):
+        self.path = Path(path or os.getenv("LLM_CACHE_PATH", str(DEFAULT_CACHE_PATH)))
+        self.max_bytes = int(max_bytes or os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.ttl_seconds = float(ttl_seconds or os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+        self._local = threading.local()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_responses (
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                temperature REAL NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (provider, model, temperature, prompt_hash)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_access ON llm_responses (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets readers and a writer work concurrently"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _count(self, stat: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+    @staticmethod
+    def hash_prompt(prompt: str, variant: str = "") -> str:
+        """Hash the prompt plus any option that changes the output (e.g. stop mode)"""
+        return hashlib.sha256(f"{variant}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def get(self, provider: str, model: str, temperature: float, prompt_hash: str) -> Optional[str]:
+        """
+        Look up a cached response
+
+        Returns:
+            The cached text, or None on a miss / expired entry / cache error
+        """
+        key = (provider, model, float(temperature), prompt_hash)
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT response, created_at, last_access FROM llm_responses "
+                "WHERE provider = ? AND model = ? AND temperature = ? AND prompt_hash = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+
+            response, created_at, last_access = row
+            if now - created_at > self.ttl_seconds:
+                conn.execute(
+                    "DELETE FROM llm_responses "
+                    "WHERE provider = ? AND model = ? AND temperature = ? AND prompt_hash = ?",
+                    key,
+                )
+                self._count("misses")
+                return None
+
+            if now - last_access > TOUCH_INTERVAL_SECONDS:
+                conn.execute(
+                    "UPDATE llm_responses SET last_access = ? "
+                    "WHERE provider = ? AND model = ? AND temperature = ? AND prompt_hash = ?",
+                    (now, *key),
+                )
+            self._count("hits")
+            return response
+        except sqlite3.Error as e:
+            print(f"⚠️ LLM cache read failed: {e}")
+            self._count("errors")
+            return None
+
+    def put(self, provider: str, model: str, temperature: float, prompt_hash: str, response: str) -> None:
+        """Store a response and evict least recently used entries beyond the size budget"""
+        now = time.time()
+        size = len(response.encode("utf-8")) + len(prompt_hash)
+        try:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses "
+                "(provider, model, temperature, prompt_hash, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (provider, model, float(temperature), prompt_hash, response, size, now, now),
+            )
+            self._count("writes")
+            self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"⚠️ LLM cache write failed: {e}")
+            self._count("errors")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        expired = conn.execute(
+            "DELETE FROM llm_responses WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()[0]
+        excess = total - self.max_bytes
+        victims = []
+        if excess > 0:
+            for rowid, size in conn.execute("SELECT rowid, size FROM llm_responses ORDER BY last_access"):
+                victims.append((rowid,))
+                excess -= size
+                if excess <= 0:
+                    break
+            conn.executemany("DELETE FROM llm_responses WHERE rowid = ?", victims)
+        if expired or victims:
+            self._count("evictions", expired + len(victims))
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters plus current entry count and size"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        try:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_responses"
+            ).fetchone()
+            stats.update(entries=entries, bytes=size, max_bytes=self.max_bytes)
+        except sqlite3.Error as e:
+            stats["error"] = str(e)
+        return stats
+
+
+_cache = None
+_cache_disabled = False
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[LLMResponseCache]:
+    """Process-wide cache instance, or None when LLM_CACHE=false or the store cannot be opened"""
+    global _cache, _cache_disabled
+    if _cache_disabled or os.getenv("LLM_CACHE", "true").lower() != "true":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = LLMResponseCache()
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️ LLM cache disabled: {e}")
+                _cache_disabled = True
+        return _cache
@@ -1,6 +1,7 @@
 """
-LLM Fallback Handler - Provides graceful degradation when Gemini API quota is exhausted.
-When the API is unavailable, returns template-based responses or cached results.
+LLM Fallback Handler - Provides graceful degradation when the LLM is unavailable
+(quota exhausted, every provider down or its circuit breaker open).
+Returns template-based Mongo queries or SQL statements instead.
 """
 
 import json
@@ -17,25 +18,25 @@ class FallbackLLM:
     RESPONSE_TEMPLATES = {
         "chicken": {
             "collection": "recipes",
-            "query": {"ingredients": {"$regex": "chicken", "$options": "i"}},
+            "query": {"recipeingredientparts": {"$regex": "chicken", "$options": "i"}},
             "limit": 5,
             "explanation": "(Fallback: Pre-cached chicken recipes)"
         },
         "pasta": {
             "collection": "recipes",
-            "query": {"ingredients": {"$regex": "pasta", "$options": "i"}},
+            "query": {"recipeingredientparts": {"$regex": "pasta", "$options": "i"}},
             "limit": 5,
             "explanation": "(Fallback: Pre-cached pasta recipes)"
         },
         "salad": {
             "collection": "recipes",
-            "query": {"ingredients": {"$regex": "lettuce|greens", "$options": "i"}},
+            "query": {"recipeingredientparts": {"$regex": "lettuce|greens", "$options": "i"}},
             "limit": 5,
             "explanation": "(Fallback: Pre-cached salad recipes)"
         },
         "vegetarian": {
             "collection": "recipes",
-            "query": {"dietary": "vegetarian"},
+            "query": {"recipecategory": {"$regex": "vegetable|vegan", "$options": "i"}},
             "limit": 5,
             "explanation": "(Fallback: Pre-cached vegetarian recipes)"
         },
@@ -59,7 +60,32 @@ class FallbackLLM:
             "collection": "recipes",
             "query": {},
             "limit": 10,
-            "explanation": "(Fallback: Showing all recipes - Gemini API quota exceeded)"
+            "explanation": "(Fallback: Showing all recipes - LLM unavailable)"
+        }
+
+    # Same templates for the PostgreSQL agent
+    SQL_TEMPLATES = {
+        "chicken": "SELECT * FROM recipes WHERE array_to_string(recipeingredientparts, ',') ILIKE '%chicken%' LIMIT 5;",
+        "pasta": "SELECT * FROM recipes WHERE array_to_string(recipeingredientparts, ',') ILIKE '%pasta%' LIMIT 5;",
+        "salad": "SELECT * FROM recipes WHERE array_to_string(recipeingredientparts, ',') ~* 'lettuce|greens' LIMIT 5;",
+        "vegetarian": "SELECT * FROM recipes WHERE recipecategory ~* 'vegetable|vegan' LIMIT 5;",
+    }
+
+    @staticmethod
+    def get_fallback_sql(query: str) -> Dict[str, Any]:
+        """
+        Returns a fallback SQL statement based on query keywords.
+        If no matching template, returns a generic recipe listing.
+        """
+        query_lower = query.lower()
+
+        for keyword, sql in FallbackLLM.SQL_TEMPLATES.items():
+            if keyword in query_lower:
+                return {"sql": sql, "explanation": f"(Fallback: Pre-cached {keyword} recipes)"}
+
+        return {
+            "sql": "SELECT * FROM recipes LIMIT 10;",
+            "explanation": "(Fallback: Showing all recipes - LLM unavailable)"
         }
     
     @staticmethod
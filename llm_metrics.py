@@ -0,0 +1,242 @@
+"""
+LLM Metrics - Per-call latency and token accounting.
+Every Custom_GenAI call records wall time plus the token counts and durations
+Ollama reports (prompt_eval_count, eval_count, load_duration, ...). Totals are
+exposed in Prometheus text format on /metrics, and the calls made while
+answering one question are collected in a trace that is stored with its
+query log row.
+"""
+
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}  # sorted label items -> value
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[tuple]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, dict(key), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # sorted label items -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self) -> Iterable[tuple]:
+        with self._lock:
+            values = {k: list(v) for k, v in self._values.items()}
+        for key, data in values.items():
+            labels = dict(key)
+            for bound, count in zip(self.buckets, data):
+                yield f"{self.name}_bucket", dict(labels, le=repr(float(bound))), count
+            yield f"{self.name}_bucket", dict(labels, le="+Inf"), data[-1]
+            yield f"{self.name}_sum", labels, round(data[-2], 6)
+            yield f"{self.name}_count", labels, data[-1]
+
+
+_metrics = []
+_collectors = []  # callables returning [(name, kind, help, labels, value)]
+_registry_lock = threading.Lock()
+
+
+def counter(name: str, help_text: str) -> Counter:
+    metric = Counter(name, help_text)
+    with _registry_lock:
+        _metrics.append(metric)
+    return metric
+
+
+def histogram(name: str, help_text: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+    metric = Histogram(name, help_text, buckets)
+    with _registry_lock:
+        _metrics.append(metric)
+    return metric
+
+
+def register_collector(collector: Callable[[], List[tuple]]) -> None:
+    """Add a callback whose (name, kind, help, labels, value) rows are read at scrape time"""
+    with _registry_lock:
+        _collectors.append(collector)
+
+
+def render_prometheus() -> str:
+    """All metrics in Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_metrics)
+        collectors = list(_collectors)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    described = set()
+    for collector in collectors:
+        try:
+            rows = collector()
+        except Exception as e:
+            print(f"⚠️ Metrics collector failed: {e}")
+            continue
+        for name, kind, help_text, labels, value in rows:
+            if name not in described:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+LLM_CALLS = counter("recipellm_llm_calls_total", "LLM calls by provider, model, caller role and outcome")
+LLM_CALL_SECONDS = histogram("recipellm_llm_call_seconds", "Wall time of LLM provider calls")
+LLM_PROMPT_TOKENS = counter("recipellm_llm_prompt_tokens_total", "Prompt tokens evaluated (prompt_eval_count)")
+LLM_COMPLETION_TOKENS = counter("recipellm_llm_completion_tokens_total", "Tokens generated (eval_count)")
+LLM_PROMPT_EVAL_SECONDS = counter("recipellm_llm_prompt_eval_seconds_total", "Time spent evaluating prompts")
+LLM_EVAL_SECONDS = counter("recipellm_llm_eval_seconds_total", "Time spent generating tokens")
+LLM_LOAD_SECONDS = counter("recipellm_llm_load_seconds_total", "Time spent loading models")
+
+# Ollama reports durations in nanoseconds
+_NS_FIELDS = {
+    "prompt_eval_duration": "prompt_eval_ms",
+    "eval_duration": "eval_ms",
+    "load_duration": "load_ms",
+    "total_duration": "server_total_ms",
+}
+
+_trace = contextvars.ContextVar("llm_trace", default=None)
+
+
+@contextmanager
+def trace():
+    """Collect every LLM call made inside the block (one question) into a list"""
+    calls = []
+    token = _trace.set(calls)
+    try:
+        yield calls
+    finally:
+        _trace.reset(token)
+
+
+def current_trace() -> Optional[list]:
+    """Calls recorded so far for the question being answered, or None outside a trace"""
+    return _trace.get()
+
+
+def record_llm_call(
+    provider: str,
+    model: str,
+    role: str,
+    outcome: str,
+    wall_seconds: float,
+    stats: Optional[dict] = None,
+) -> dict:
+    """
+    Count one call in the metrics and append it to the current trace
+
+    Args:
+        provider / model: Who answered
+        role: Caller role, e.g. "primary", "syntax", "regeneration"
+        outcome: "ok", "error", "cache_hit", "coalesced", ...
+        wall_seconds: Time the caller spent waiting
+        stats: Provider figures (prompt_eval_count, eval_count, *_duration in ns)
+
+    Returns:
+        The call record as stored in the trace
+    """
+    stats = stats or {}
+    record = {
+        "role": role,
+        "provider": provider,
+        "model": model,
+        "outcome": outcome,
+        "wall_ms": round(wall_seconds * 1000, 1),
+    }
+    if "prompt_eval_count" in stats:
+        record["prompt_tokens"] = stats["prompt_eval_count"]
+    if "eval_count" in stats:
+        record["completion_tokens"] = stats["eval_count"]
+    for field, key in _NS_FIELDS.items():
+        if field in stats:
+            record[key] = round(stats[field] / 1e6, 1)
+
+    labels = {"provider": provider, "model": model, "role": role}
+    LLM_CALLS.inc(outcome=outcome, **labels)
+    if outcome in ("ok", "error"):
+        LLM_CALL_SECONDS.observe(wall_seconds, provider=provider, role=role)
+    if "prompt_tokens" in record:
+        LLM_PROMPT_TOKENS.inc(record["prompt_tokens"], **labels)
+    if "completion_tokens" in record:
+        LLM_COMPLETION_TOKENS.inc(record["completion_tokens"], **labels)
+    if "prompt_eval_ms" in record:
+        LLM_PROMPT_EVAL_SECONDS.inc(record["prompt_eval_ms"] / 1000, **labels)
+    if "eval_ms" in record:
+        LLM_EVAL_SECONDS.inc(record["eval_ms"] / 1000, **labels)
+    if "load_ms" in record:
+        LLM_LOAD_SECONDS.inc(record["load_ms"] / 1000, **labels)
+
+    calls = _trace.get()
+    if calls is not None:
+        calls.append(record)
+    return record
+
+
+def summarize_trace(calls: Optional[list]) -> Optional[dict]:
+    """Totals plus the individual calls, as stored with a query log row"""
+    if not calls:
+        return None
+    return {
+        "llm_calls": len(calls),
+        "wall_ms": round(sum(c["wall_ms"] for c in calls), 1),
+        "prompt_tokens": sum(c.get("prompt_tokens", 0) for c in calls),
+        "completion_tokens": sum(c.get("completion_tokens", 0) for c in calls),
+        "calls": list(calls),
+    }
@@ -11,13 +11,678 @@ Models supported:
 - llama2 (7B) - Reliable and powerful
 """
 
+import asyncio
 import requests
+import contextvars
+import hashlib
+import heapq
+import itertools
+import json
 import os
-from typing import Optional
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from contextlib import contextmanager
+from typing import Callable, Optional
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx  # async HTTP client for ask_ai_async
+except ImportError:
+    httpx = None
+try:
+    import llama_cpp  # in-process GGUF inference (LlamaCppLLM)
+except ImportError:
+    llama_cpp = None
 from dotenv import load_dotenv
+from llm_cache import LLMResponseCache, get_response_cache
+from deadline import Deadline, DeadlineExceeded
+from llm_metrics import histogram, record_llm_call, register_collector
 
 load_dotenv()
 
+# Shared HTTP connection pools - one keep-alive session per provider, reused
+# by every Custom_GenAI instance (PRIMARY_LLM and SYNTAX_LLM in both agents)
+LLM_POOL_CONNECTIONS = int(os.getenv("LLM_POOL_CONNECTIONS", "4"))  # hosts cached per provider
+LLM_POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", "8"))  # connections kept per host
+LLM_POOL_BLOCK = os.getenv("LLM_POOL_BLOCK", "true").lower() == "true"  # hard per-host limit
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "true").lower() == "true"
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_http_session(provider: str) -> requests.Session:
+    """
+    Get the shared, pooled HTTP session for a provider
+
+    Sessions are created once per process and are safe to share between
+    threads: urllib3 hands each request its own connection from the pool.
+
+    Args:
+        provider: Provider name ("ollama", "openai", "huggingface")
+
+    Returns:
+        requests.Session mounted with a sized connection pool
+    """
+    with _sessions_lock:
+        session = _sessions.get(provider)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=LLM_POOL_CONNECTIONS,
+                pool_maxsize=LLM_POOL_MAXSIZE,
+                pool_block=LLM_POOL_BLOCK,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["Connection"] = "keep-alive" if LLM_KEEP_ALIVE else "close"
+            _sessions[provider] = session
+        return session
+
+
+_async_clients = {}  # provider -> (event loop, httpx.AsyncClient)
+
+# httpx errors the async paths translate; empty / plain TimeoutError when httpx is missing
+_ASYNC_CONNECT_ERRORS = (httpx.ConnectError,) if httpx is not None else ()
+_ASYNC_TIMEOUT_ERRORS = (httpx.TimeoutException, TimeoutError) if httpx is not None else (TimeoutError,)
+
+
+def get_async_client(provider: str):
+    """
+    Get the shared, pooled async HTTP client for a provider
+
+    httpx clients are bound to the event loop that uses them, so there is one
+    client per provider on the running loop (replaced if another loop asks).
+
+    Raises:
+        LLMUnavailableError: httpx is not installed
+    """
+    if httpx is None:
+        raise LLMUnavailableError("ask_ai_async needs httpx: pip install httpx")
+    loop = asyncio.get_running_loop()
+    with _sessions_lock:
+        entry = _async_clients.get(provider)
+        if entry is None or entry[0] is not loop:
+            limits = httpx.Limits(
+                max_connections=LLM_POOL_MAXSIZE,
+                max_keepalive_connections=LLM_POOL_MAXSIZE if LLM_KEEP_ALIVE else 0,
+            )
+            client = httpx.AsyncClient(limits=limits, headers={"Connection": "keep-alive" if LLM_KEEP_ALIVE else "close"})
+            entry = _async_clients[provider] = (loop, client)
+        return entry[1]
+
+
+def get_pool_stats() -> dict:
+    """
+    Connection reuse counters for every provider session
+
+    Returns:
+        {provider: {"hosts", "requests", "connections_opened", "connections_reused"}}
+    """
+    with _sessions_lock:
+        sessions = list(_sessions.items())
+
+    stats = {}
+    for provider, session in sessions:
+        hosts = requests_sent = connections_opened = 0
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                try:
+                    pool = pools[key]
+                except KeyError:
+                    continue  # evicted while we were reading
+                hosts += 1
+                requests_sent += pool.num_requests
+                connections_opened += pool.num_connections
+        stats[provider] = {
+            "hosts": hosts,
+            "requests": requests_sent,
+            "connections_opened": connections_opened,
+            "connections_reused": max(requests_sent - connections_opened, 0),
+        }
+    return stats
+
+
+# Token streaming - read Ollama's NDJSON output and stop once the answer is complete
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "true").lower() == "true"
+
+# Per-call figures Ollama reports with the final response (durations in ns)
+OLLAMA_STAT_FIELDS = (
+    "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration",
+    "load_duration", "total_duration",
+)
+
+_stream_stats = {"streams": 0, "early_stops": 0}
+_stream_stats_lock = threading.Lock()
+
+
+def _count_stream(stopped_early: bool) -> None:
+    with _stream_stats_lock:
+        _stream_stats["streams"] += 1
+        _stream_stats["early_stops"] += int(stopped_early)
+
+
+_SQL_START = re.compile(r"(?:^|\n|```(?:sql)?)\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+
+def _has_complete_json_query(text: str) -> bool:
+    """True once text holds a balanced JSON object with "collection" and "query" keys"""
+    start = text.find("{")
+    while start != -1:
+        depth = 0
+        in_string = escaped = False
+        for i in range(start, len(text)):
+            ch = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        parsed = json.loads(text[start:i + 1])
+                    except ValueError:
+                        break
+                    if isinstance(parsed, dict) and "collection" in parsed and "query" in parsed:
+                        return True
+                    break
+        start = text.find("{", start + 1)
+    return False
+
+
+def _has_complete_sql_statement(text: str) -> bool:
+    """True once text holds a SQL statement terminated by a ';' outside of quotes"""
+    match = _SQL_START.search(text)
+    if not match:
+        return False
+    quote = None
+    for ch in text[match.start(1):]:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == ";":
+            return True
+    return False
+
+
+def is_complete_output(stop_at: Optional[str], text: str, token: str = "") -> bool:
+    """
+    Check whether a partial generation already holds the answer the caller needs
+
+    Args:
+        stop_at: "json" (Mongo query object), "sql" (single statement) or None
+        text: Generated text so far
+        token: Latest token - used to skip the scan when it cannot close anything
+
+    Returns:
+        True if generation can be stopped
+    """
+    if stop_at == "json":
+        return (not token or "}" in token) and _has_complete_json_query(text)
+    if stop_at == "sql":
+        return (not token or ";" in token) and _has_complete_sql_statement(text)
+    return False
+
+
+# Prefix caching - prime the static part of a prompt template once and send
+# only the question part afterwards, continuing from the returned context
+OLLAMA_PREFIX_CACHE = os.getenv("OLLAMA_PREFIX_CACHE", "false").lower() == "true"
+OLLAMA_PREFIX_CACHE_SIZE = int(os.getenv("OLLAMA_PREFIX_CACHE_SIZE", "8"))  # prefixes kept per model
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE") or ("30m" if OLLAMA_PREFIX_CACHE else None)
+
+_prefix_stats = {"primes": 0, "prime_failures": 0, "hits": 0, "tokens_reused": 0}
+_prefix_stats_lock = threading.Lock()
+
+
+# Structured output - constrain generation to a JSON schema (Ollama `format`)
+OLLAMA_STRUCTURED_OUTPUT = os.getenv("OLLAMA_STRUCTURED_OUTPUT", "true").lower() == "true"
+OLLAMA_JSON_NUM_PREDICT = int(os.getenv("OLLAMA_JSON_NUM_PREDICT", "256"))
+# Constrained models can pad a finished object with whitespace until num_predict runs out
+OLLAMA_JSON_STOP = ["\n\n\n"]
+
+
+# OpenAI-compatible servers - constrain calls that pass output_schema via response_format
+OPENAI_STRUCTURED_OUTPUT = os.getenv("OPENAI_STRUCTURED_OUTPUT", "true").lower() == "true"
+
+
+# In-process llama.cpp - constrain calls that pass output_schema with a JSON-schema grammar
+LLAMA_CPP_STRUCTURED_OUTPUT = os.getenv("LLAMA_CPP_STRUCTURED_OUTPUT", "true").lower() == "true"
+
+
+# Several Ollama servers - OLLAMA_URL may list endpoints separated by commas;
+# calls go to the endpoint with the model loaded and the fewest calls running
+OLLAMA_ENDPOINT_REFRESH = float(os.getenv("OLLAMA_ENDPOINT_REFRESH", "30"))  # seconds between /api/ps checks
+
+
+# Model cascade - calls that pass a validate callback try these smaller models
+# first, in order, and only reach OLLAMA_MODEL when validate rejects their answer
+OLLAMA_CASCADE_MODELS = [m.strip() for m in os.getenv("OLLAMA_CASCADE_MODELS", "").split(",") if m.strip()]
+
+_cascade_stats = {}  # model -> {"calls", "accepted", "rejected", "errors", "seconds"}
+_cascade_stats_lock = threading.Lock()
+
+
+def _count_tier(model: str, outcome: str, seconds: float) -> None:
+    """outcome: "accepted" / "rejected" / "errors" (the last model's answers are always accepted)"""
+    with _cascade_stats_lock:
+        stats = _cascade_stats.setdefault(
+            model, {"calls": 0, "accepted": 0, "rejected": 0, "errors": 0, "seconds": 0.0}
+        )
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        stats[outcome] += 1
+
+
+def output_variant(stop_at: Optional[str], output_schema: Optional[dict] = None) -> str:
+    """Cache / single-flight key part for the options that change a prompt's output"""
+    if not output_schema:
+        return stop_at or ""
+    return f"{stop_at or ''}|{json.dumps(output_schema, sort_keys=True)}"
+
+
+# Single-flight - concurrent identical prompts share one generation
+LLM_SINGLE_FLIGHT = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() == "true"
+
+_in_flight = {}  # prompt hash -> Future of the leading call
+_in_flight_lock = threading.Lock()
+_single_flight_stats = {"leader_calls": 0, "coalesced_calls": 0, "leader_retries": 0}
+
+
+def static_prefix(template: str, placeholders: tuple = ("{SCHEMA}", "{QUESTION}")) -> str:
+    """
+    The part of a prompt template before its first placeholder
+
+    This text is the same for every question, so it can be primed once with
+    prefix caching. Because it is the template text itself, editing the prompt
+    file changes the prefix and the next call primes it again.
+    """
+    positions = [template.find(p) for p in placeholders if p in template]
+    return template[:min(positions)] if positions else ""
+
+
+# Scheduling - a local Ollama only generates LLM_PARALLEL_SLOTS responses at
+# once, so calls queue for a slot and interactive work is served first
+LLM_PARALLEL_SLOTS = int(os.getenv("LLM_PARALLEL_SLOTS", os.getenv("OLLAMA_NUM_PARALLEL", "4")))
+LLM_SCHEDULER = os.getenv("LLM_SCHEDULER", "true").lower() == "true"
+
+# Lower rank is served first; FIFO within a class
+PRIORITY_CLASSES = {"interactive": 0, "batch": 1, "background": 2}
+
+LLM_QUEUE_WAIT_SECONDS = histogram(
+    "recipellm_llm_queue_wait_seconds", "Time LLM calls waited for a provider slot",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+_priority = contextvars.ContextVar("llm_priority", default="interactive")
+
+
+@contextmanager
+def llm_priority(priority: str):
+    """Run the block's LLM calls in a priority class ("interactive", "batch", "background")"""
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown LLM priority {priority!r} (expected one of: {', '.join(PRIORITY_CLASSES)})")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class LLMScheduler:
+    """
+    Priority queue in front of one provider's parallel slots
+
+    A call takes a free slot straight away when nobody is queued. Otherwise it
+    waits; each released slot is handed to the best-ranked waiter (lowest
+    PRIORITY_CLASSES rank, then arrival order). A waiter whose deadline runs
+    out leaves the queue with DeadlineExceeded.
+    """
+
+    def __init__(self, name: str, slots: int):
+        self.name = name
+        self.slots = max(slots, 1)
+        self.busy = 0
+        self._lock = threading.Lock()
+        self._queue = []  # heap of (rank, seq, waiter)
+        self._seq = itertools.count()
+        self._waiting = {p: 0 for p in PRIORITY_CLASSES}
+        self._stats = {"granted": 0, "queued": 0, "timeouts": 0}
+
+    @contextmanager
+    def slot(self, priority: str, timeout: Optional[float] = None):
+        """Hold a slot for the duration of the block"""
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, priority: str, timeout: Optional[float] = None) -> float:
+        """
+        Wait for a slot
+
+        Args:
+            priority: Key of PRIORITY_CLASSES
+            timeout: Seconds to wait at most (None = until a slot is free)
+
+        Returns:
+            Seconds spent waiting
+
+        Raises:
+            DeadlineExceeded: no slot became free within timeout
+        """
+        started = time.perf_counter()
+        event = threading.Event()
+        waiter = self._enqueue(priority, event.set)
+        if waiter is not None:
+            event.wait(timeout)
+            self._end_wait(waiter, timeout)
+        return self._granted(priority, started)
+
+    async def acquire_async(self, priority: str, timeout: Optional[float] = None) -> float:
+        """acquire() for coroutines - waits on the event loop instead of blocking a thread"""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        waiter = self._enqueue(priority, lambda: loop.call_soon_threadsafe(_resolve, ready))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(ready), timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            self._end_wait(waiter, timeout)
+        return self._granted(priority, started)
+
+    def _enqueue(self, priority: str, notify) -> Optional["_Waiter"]:
+        """Take a free slot (returns None) or join the queue (returns the waiter)"""
+        with self._lock:
+            if self.busy < self.slots and not any(self._waiting.values()):
+                self.busy += 1
+                return None
+            waiter = _Waiter(priority, notify)
+            heapq.heappush(self._queue, (PRIORITY_CLASSES[priority], next(self._seq), waiter))
+            self._waiting[priority] += 1
+            self._stats["queued"] += 1
+            return waiter
+
+    def _end_wait(self, waiter: "_Waiter", timeout: Optional[float]) -> None:
+        with self._lock:
+            if waiter.granted:
+                return  # also covers a slot handed over just as the wait timed out
+            waiter.cancelled = True  # skipped when slots are handed out
+            self._waiting[waiter.priority] -= 1
+            self._stats["timeouts"] += 1
+        raise DeadlineExceeded(f"No {self.name} slot became free within {timeout:.2f}s")
+
+    def _abandon(self, waiter: "_Waiter") -> None:
+        """A cancelled coroutine leaves the queue, passing on a slot it was already given"""
+        with self._lock:
+            if not waiter.granted:
+                waiter.cancelled = True
+                self._waiting[waiter.priority] -= 1
+                return
+        self.release()
+
+    def _granted(self, priority: str, started: float) -> float:
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._stats["granted"] += 1
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, provider=self.name, priority=priority)
+        return waited
+
+    def release(self) -> None:
+        """Hand the slot to the next waiter, or free it"""
+        with self._lock:
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                waiter.granted = True  # the slot passes straight to the waiter
+                self._waiting[waiter.priority] -= 1
+                waiter.notify()
+                return
+            self.busy -= 1
+
+    def status(self) -> dict:
+        with self._lock:
+            return dict(self._stats, slots=self.slots, busy=self.busy, queued_now=dict(self._waiting))
+
+
+class _Waiter:
+    __slots__ = ("priority", "notify", "granted", "cancelled")
+
+    def __init__(self, priority: str, notify):
+        self.priority = priority
+        self.notify = notify
+        self.granted = False
+        self.cancelled = False
+
+
+def _resolve(future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(provider: str, slots: Optional[int]) -> Optional[LLMScheduler]:
+    """Shared scheduler for a provider, or None when its calls are not limited"""
+    if not LLM_SCHEDULER or not slots:
+        return None
+    with _schedulers_lock:
+        scheduler = _schedulers.get(provider)
+        if scheduler is None:
+            scheduler = _schedulers[provider] = LLMScheduler(provider, slots)
+        return scheduler
+
+
+def get_scheduler_stats() -> dict:
+    """Slot usage and queue depth per provider"""
+    with _schedulers_lock:
+        schedulers = dict(_schedulers)
+    return {
+        "enabled": LLM_SCHEDULER,
+        "priorities": list(PRIORITY_CLASSES),
+        "providers": {name: scheduler.status() for name, scheduler in schedulers.items()},
+    }
+
+
+def get_single_flight_stats() -> dict:
+    """Leader / coalesced call counters plus the number of prompts in flight"""
+    with _in_flight_lock:
+        stats = dict(_single_flight_stats, in_flight=len(_in_flight))
+    total = stats["leader_calls"] + stats["coalesced_calls"]
+    stats["coalesced_rate"] = round(stats["coalesced_calls"] / total, 3) if total else 0.0
+    stats["enabled"] = LLM_SINGLE_FLIGHT
+    return stats
+
+
+def get_cascade_stats() -> dict:
+    """Per-tier calls, acceptance rate and latency of the model cascade"""
+    with _cascade_stats_lock:
+        tiers = {model: dict(stats) for model, stats in _cascade_stats.items()}
+    answered = sum(stats["accepted"] for stats in tiers.values())
+    served = sum(stats["accepted"] for model, stats in tiers.items() if model in OLLAMA_CASCADE_MODELS)
+    for stats in tiers.values():
+        calls = stats["calls"]
+        seconds = stats.pop("seconds")
+        stats["hit_rate"] = round(stats["accepted"] / calls, 3) if calls else 0.0
+        stats["avg_latency_ms"] = round(seconds / calls * 1000, 1) if calls else 0.0
+    return {
+        "models": OLLAMA_CASCADE_MODELS,
+        "tiers": tiers,
+        "served_by_cascade_rate": round(served / answered, 3) if answered else 0.0,
+        "enabled": bool(OLLAMA_CASCADE_MODELS),
+    }
+
+
+# Hedging - race extra generations of a prompt and keep the first answer that
+# passes the caller's check (Custom_GenAI.ask_hedged)
+LLM_HEDGE_CANDIDATES = int(os.getenv("LLM_HEDGE_CANDIDATES", "1"))  # 1 = off
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "3"))  # 0 = start all at once
+LLM_HEDGE_TEMPERATURE = float(os.getenv("LLM_HEDGE_TEMPERATURE", "0.7"))  # so extra candidates differ
+
+LLM_HEDGE_EXTRA_CALLS = histogram(
+    "recipellm_llm_hedge_extra_calls", "Extra LLM calls a hedged question started",
+    buckets=(0, 1, 2, 3, 4, 8),
+)
+
+_hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm-hedge")  # threads stay until exit
+_hedge_stats = {"questions": 0, "extra_calls": 0, "won_by_extra": 0, "none_accepted": 0, "cancelled": 0}
+_hedge_stats_lock = threading.Lock()
+
+# Set by a hedge once another candidate has won; providers with cancellable = True
+# check it between tokens, so a losing candidate gives its slot back at once
+_cancel = contextvars.ContextVar("llm_cancel", default=None)
+
+
+def _cancelled() -> bool:
+    event = _cancel.get()
+    return event is not None and event.is_set()
+
+
+def _count_hedge(extra_calls: int, winner: Optional[int], cancelled: int) -> None:
+    """winner: index of the accepted candidate, None if no answer passed"""
+    LLM_HEDGE_EXTRA_CALLS.observe(extra_calls)
+    with _hedge_stats_lock:
+        _hedge_stats["questions"] += 1
+        _hedge_stats["extra_calls"] += extra_calls
+        _hedge_stats["won_by_extra"] += int(bool(winner))
+        _hedge_stats["none_accepted"] += int(winner is None)
+        _hedge_stats["cancelled"] += cancelled
+
+
+def get_hedge_stats() -> dict:
+    """Hedged questions, the extra calls they made and how often an extra candidate won"""
+    with _hedge_stats_lock:
+        stats = dict(_hedge_stats)
+    questions = stats["questions"]
+    stats["extra_calls_per_question"] = round(stats["extra_calls"] / questions, 2) if questions else 0.0
+    stats.update(
+        candidates=LLM_HEDGE_CANDIDATES,
+        hedge_after_seconds=LLM_HEDGE_AFTER_SECONDS,
+        enabled=LLM_HEDGE_CANDIDATES > 1,
+    )
+    return stats
+
+
+def llm_diagnostics() -> dict:
+    """Snapshot of LLM client internals for the /diagnostics endpoint"""
+    cache = get_response_cache()
+    return {
+        "providers": get_provider_registry().status(),
+        "pools": get_pool_stats(),
+        "streaming": dict(_stream_stats, enabled=OLLAMA_STREAM),
+        "prefix_cache": dict(_prefix_stats, enabled=OLLAMA_PREFIX_CACHE, keep_alive=OLLAMA_KEEP_ALIVE),
+        "single_flight": get_single_flight_stats(),
+        "scheduler": get_scheduler_stats(),
+        "cascade": get_cascade_stats(),
+        "hedging": get_hedge_stats(),
+        "response_cache": cache.stats() if cache else {"enabled": False},
+    }
+
+
+def _model_tag(name: str) -> str:
+    """Ollama lists "mistral" as "mistral:latest" """
+    return name if ":" in name else f"{name}:latest"
+
+
+class OllamaEndpoint:
+    """
+    One Ollama server from OLLAMA_URL and what routing knows about it
+
+    healthy comes from /api/tags, loaded (model tags in memory) from /api/ps
+    and from the endpoint answering a call. outstanding counts calls sent to
+    it and not yet finished; it is changed under the owning OllamaLLM's
+    routing lock.
+    """
+
+    def __init__(self, url: str, model: str, lock: threading.Lock):
+        self.url = url.rstrip("/")
+        self.model = model
+        self.healthy = False
+        self.loaded = set()
+        self.outstanding = 0
+        self.checked_at = 0.0
+        self._lock = lock
+        self._stats = {"requests": 0, "errors": 0, "seconds": 0.0}
+
+    def check(self, session: requests.Session) -> bool:
+        """Refresh health and model residency from /api/tags and /api/ps"""
+        healthy = False
+        loaded = set()
+        try:
+            healthy = session.get(f"{self.url}/api/tags", timeout=2).status_code == 200
+            if healthy:
+                response = session.get(f"{self.url}/api/ps", timeout=2)
+                if response.status_code == 200:
+                    loaded = {
+                        _model_tag(m.get("name") or m.get("model", ""))
+                        for m in response.json().get("models", [])
+                    }
+        except Exception:
+            pass
+        with self._lock:
+            self.healthy, self.loaded = healthy, loaded
+            self.checked_at = time.monotonic()
+        return healthy
+
+    def has_model(self, model: str) -> bool:
+        return _model_tag(model) in self.loaded
+
+    def finish(self, started: float, ok: bool, model: str, unreachable: bool = False) -> None:
+        """Record a call for model that was routed here (started is a time.perf_counter() value)"""
+        with self._lock:
+            self.outstanding -= 1
+            self._stats["requests"] += 1
+            self._stats["seconds"] += time.perf_counter() - started
+            if not ok:
+                self._stats["errors"] += 1
+            if unreachable:
+                self.healthy = False
+                self.loaded = set()
+            elif ok:
+                self.healthy = True
+                self.loaded = self.loaded | {_model_tag(model)}  # it just ran the model
+
+    def status(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            status = {
+                "healthy": self.healthy,
+                "model_loaded": _model_tag(self.model) in self.loaded,
+                "loaded_models": sorted(self.loaded),
+                "outstanding": self.outstanding,
+            }
+        calls = stats["requests"]
+        status.update(
+            requests=calls,
+            errors=stats["errors"],
+            error_rate=round(stats["errors"] / calls, 3) if calls else 0.0,
+            avg_latency_ms=round(stats["seconds"] / calls * 1000, 1) if calls else 0.0,
+        )
+        return status
+
+
 class OllamaLLM:
     """
     Local LLM via Ollama - Completely free, runs on your machine
@@ -31,57 +696,856 @@ class OllamaLLM:
     """
     
     def __init__(self, model: str = "mistral"):
-        self.base_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
+        urls = [u.strip() for u in os.getenv("OLLAMA_URL", "http://localhost:11434").split(",") if u.strip()]
         self.model = os.getenv("OLLAMA_MODEL", model)
+        self._route_lock = threading.Lock()
+        self.endpoints = [OllamaEndpoint(url, self.model, self._route_lock) for url in urls]
+        self.base_url = ", ".join(e.url for e in self.endpoints)  # for messages
+        self.temperature = 0.1  # Low temp for deterministic queries
+        self.timeout = 60
+        self.parallel_slots = LLM_PARALLEL_SLOTS * len(self.endpoints)  # generations the servers run at once
+        self.cancellable = OLLAMA_STREAM  # a hedge can close a losing candidate's stream
+        self.cascade_models = OLLAMA_CASCADE_MODELS
+        self.session = get_http_session("ollama")
+        self._prefixes = OrderedDict()  # sha256(model, prefix) -> primed context tokens
+        self._prefixes_lock = threading.Lock()
+        self._refreshing = False
         self.available = self._check_connection()
         
+    def check_health(self) -> bool:
+        """Re-probe the servers and update availability (used by the background prober)"""
+        self.available = self._check_connection()
+        return self.available
+
     def _check_connection(self) -> bool:
-        """Check if Ollama server is running"""
-        try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=2)
-            return response.status_code == 200
-        except:
+        """Check which Ollama servers are running and which have the model loaded"""
+        return any([endpoint.check(self.session) for endpoint in self.endpoints])
+
+    def _claim_endpoint(self, tried: set, model: str) -> OllamaEndpoint:
+        """
+        Endpoint for the next call to model, counted as outstanding until finish()
+
+        Healthy endpoints come first, then those with a free slot
+        (LLM_PARALLEL_SLOTS each), then those with the model already loaded
+        (no load delay), then the fewest outstanding calls. Endpoints that
+        refused a connection for this call (tried) are skipped.
+        """
+        self._refresh_endpoints()
+        with self._route_lock:
+            endpoint = min(
+                (e for e in self.endpoints if e.url not in tried),
+                key=lambda e: (
+                    not e.healthy,
+                    e.outstanding >= LLM_PARALLEL_SLOTS,
+                    not e.has_model(model),
+                    e.outstanding,
+                ),
+            )
+            endpoint.outstanding += 1
+        return endpoint
+
+    def _refresh_endpoints(self) -> None:
+        """Re-check health and residency in the background once OLLAMA_ENDPOINT_REFRESH has passed"""
+        if len(self.endpoints) < 2 or OLLAMA_ENDPOINT_REFRESH <= 0:
+            return
+        with self._route_lock:
+            oldest = min(e.checked_at for e in self.endpoints)
+            if self._refreshing or time.monotonic() - oldest < OLLAMA_ENDPOINT_REFRESH:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.check_health()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, name="ollama-endpoint-refresh", daemon=True).start()
+
+    def _endpoint_failed(self, endpoint: OllamaEndpoint, started: float, tried: set, model: str) -> bool:
+        """
+        Mark an unreachable endpoint down
+
+        Returns:
+            True if another endpoint is left to try for this call
+        """
+        endpoint.finish(started, ok=False, model=model, unreachable=True)
+        tried.add(endpoint.url)
+        self.available = any(e.healthy for e in self.endpoints)
+        if len(tried) == len(self.endpoints):
             return False
+        print(f"⚠️ Ollama at {endpoint.url} unreachable, trying the next endpoint")
+        return True
+
+    def endpoint_stats(self) -> dict:
+        """Per-endpoint routing state, latency and errors for /diagnostics"""
+        return {endpoint.url: endpoint.status() for endpoint in self.endpoints}
     
-    def ask_ai(self, prompt: str) -> str:
+    def ask_ai(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        stats: Optional[dict] = None,
+        output_schema: Optional[dict] = None,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
         """
         Send prompt to Ollama and get response
         
         Args:
             prompt: The prompt to send to the model
+            stop_at: "json" or "sql" - close the stream as soon as a complete
+                query object / statement has been generated (streaming mode only)
+            timeout: Seconds the whole generation may take (default 60)
+            prefix: Static start of prompt; with OLLAMA_PREFIX_CACHE only the
+                rest is sent, continuing from the primed prefix context
+            stats: Filled with Ollama's token counts and durations (OLLAMA_STAT_FIELDS)
+            output_schema: JSON schema the response must follow; with
+                OLLAMA_STRUCTURED_OUTPUT it is sent as `format`, together with
+                OLLAMA_JSON_NUM_PREDICT and OLLAMA_JSON_STOP
+            model: Model to run instead of OLLAMA_MODEL (a cascade tier)
+            temperature: Sampling temperature instead of the default 0.1
             
         Returns:
             Generated text response
         """
+        self._require_server()
+        model = model or self.model
+        give_up_at = time.monotonic() + (timeout or self.timeout)
+        payload = self._payload(prompt, output_schema, model, temperature)
+        tried = set()
+
+        try:
+            while True:
+                endpoint = self._claim_endpoint(tried, model)
+                started = time.perf_counter()
+                try:
+                    response = self._generate(endpoint, dict(payload), prompt, prefix, stop_at, give_up_at, stats)
+                except requests.exceptions.ConnectionError:
+                    if self._endpoint_failed(endpoint, started, tried, model):
+                        continue
+                    raise
+                except BaseException:
+                    endpoint.finish(started, ok=False, model=model)
+                    raise
+                endpoint.finish(started, ok=True, model=model)
+                return response
+        except (requests.exceptions.Timeout, TimeoutError):
+            raise TimeoutError("Ollama response timeout - try shorter prompts")
+        except requests.exceptions.ConnectionError:
+            raise ConnectionError(
+                f"Cannot connect to Ollama at {self.base_url}\n"
+                "Make sure Ollama is running: ollama serve"
+            )
+        except Exception as e:
+            raise Exception(f"Ollama error: {str(e)}")
+
+    def _generate(
+        self,
+        endpoint: OllamaEndpoint,
+        payload: dict,
+        prompt: str,
+        prefix: Optional[str],
+        stop_at: Optional[str],
+        give_up_at: float,
+        stats: Optional[dict],
+    ) -> str:
+        """One /api/generate call on endpoint"""
+        timeout = max(give_up_at - time.monotonic(), 0.001)
+        if OLLAMA_PREFIX_CACHE and prefix and prompt.startswith(prefix):
+            payload["raw"] = True  # primed or not, the model sees the same plain-text prompt
+            context = self._prefix_context(endpoint.url, payload["model"], prefix, timeout)
+            if context is not None:
+                self._use_prefix(payload, prompt, prefix, context)
+                timeout = max(give_up_at - time.monotonic(), 0.001)
+
+        response = self.session.post(
+            f"{endpoint.url}/api/generate",
+            json=payload,
+            timeout=timeout,
+            stream=OLLAMA_STREAM,
+        )
+        response.raise_for_status()
+        if not OLLAMA_STREAM:
+            return self._final_response(response.json(), stats)
+        return self._read_stream(response, stop_at, give_up_at, stats)
+
+    async def ask_ai_async(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        stats: Optional[dict] = None,
+        output_schema: Optional[dict] = None,
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """
+        ask_ai over the shared httpx pool - same arguments, response and errors
+
+        Waiting for Ollama holds no thread; only priming a new prefix runs in one.
+        """
+        self._require_server()
+        client = get_async_client("ollama")
+        model = model or self.model
+        give_up_at = time.monotonic() + (timeout or self.timeout)
+        payload = self._payload(prompt, output_schema, model, temperature)
+        tried = set()
+
+        try:
+            while True:
+                endpoint = self._claim_endpoint(tried, model)
+                started = time.perf_counter()
+                try:
+                    response = await self._generate_async(
+                        client, endpoint, dict(payload), prompt, prefix, stop_at, give_up_at, stats
+                    )
+                except _ASYNC_CONNECT_ERRORS:
+                    if self._endpoint_failed(endpoint, started, tried, model):
+                        continue
+                    raise
+                except BaseException:
+                    endpoint.finish(started, ok=False, model=model)
+                    raise
+                endpoint.finish(started, ok=True, model=model)
+                return response
+        except _ASYNC_TIMEOUT_ERRORS:
+            raise TimeoutError("Ollama response timeout - try shorter prompts")
+        except _ASYNC_CONNECT_ERRORS:
+            raise ConnectionError(
+                f"Cannot connect to Ollama at {self.base_url}\n"
+                "Make sure Ollama is running: ollama serve"
+            )
+        except Exception as e:
+            raise Exception(f"Ollama error: {str(e)}")
+
+    async def _generate_async(
+        self,
+        client,
+        endpoint: OllamaEndpoint,
+        payload: dict,
+        prompt: str,
+        prefix: Optional[str],
+        stop_at: Optional[str],
+        give_up_at: float,
+        stats: Optional[dict],
+    ) -> str:
+        """_generate over the shared httpx client"""
+        url = f"{endpoint.url}/api/generate"
+        timeout = max(give_up_at - time.monotonic(), 0.001)
+        if OLLAMA_PREFIX_CACHE and prefix and prompt.startswith(prefix):
+            payload["raw"] = True  # primed or not, the model sees the same plain-text prompt
+            context = await asyncio.to_thread(self._prefix_context, endpoint.url, payload["model"], prefix, timeout)
+            if context is not None:
+                self._use_prefix(payload, prompt, prefix, context)
+                timeout = max(give_up_at - time.monotonic(), 0.001)
+
+        if not OLLAMA_STREAM:
+            response = await client.post(url, json=payload, timeout=timeout)
+            response.raise_for_status()
+            return self._final_response(response.json(), stats)
+
+        chunks = []
+        state = None
+        try:
+            # Leaving the block early closes the connection, which aborts the generation
+            async with client.stream("POST", url, json=payload, timeout=timeout) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    state = self._stream_line(line, chunks, stop_at, give_up_at, stats)
+                    if state:
+                        break
+        finally:
+            _count_stream(state == "early")
+        return "".join(chunks)
+
+    def _require_server(self) -> None:
         if not self.available:
             raise ConnectionError(
                 f"❌ Ollama not running at {self.base_url}\n"
                 "Start Ollama: ollama serve\n"
                 "Or switch to HuggingFace in .env: LLM_PROVIDER=huggingface"
             )
-        
+
+    def _payload(
+        self, prompt: str, output_schema: Optional[dict], model: str, temperature: Optional[float] = None
+    ) -> dict:
+        """/api/generate request body"""
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "stream": OLLAMA_STREAM,
+            "options": {"temperature": self.temperature if temperature is None else temperature},
+        }
+        if OLLAMA_KEEP_ALIVE:
+            payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+        if output_schema and OLLAMA_STRUCTURED_OUTPUT:
+            payload["format"] = output_schema
+            payload["options"].update(num_predict=OLLAMA_JSON_NUM_PREDICT, stop=OLLAMA_JSON_STOP)
+        return payload
+
+    @staticmethod
+    def _use_prefix(payload: dict, prompt: str, prefix: str, context: list) -> None:
+        # payload is raw (see _generate): the model sees exactly prefix + suffix, as one plain-text prompt
+        payload.update(prompt=prompt[len(prefix):], context=context)
+        with _prefix_stats_lock:
+            _prefix_stats["hits"] += 1
+            _prefix_stats["tokens_reused"] += len(context)
+
+    @staticmethod
+    def _final_response(data: dict, stats: Optional[dict]) -> str:
+        if stats is not None:
+            stats.update((k, data[k]) for k in OLLAMA_STAT_FIELDS if k in data)
+        return data["response"]
+
+    def _prefix_context(self, url: str, model: str, prefix: str, timeout: float) -> Optional[list]:
+        """
+        Context tokens for prefix, priming the model on first use
+
+        Priming evaluates the prefix once (raw, generating a single token) and
+        keeps the returned context minus the generated tokens. Keys hash the
+        model and the prefix text, so a changed prompt file is primed anew and
+        the least recently used prefixes are dropped beyond OLLAMA_PREFIX_CACHE_SIZE.
+
+        Returns:
+            Context token list, or None if priming failed (send the full prompt)
+        """
+        key = hashlib.sha256(f"{model}\0{prefix}".encode("utf-8")).hexdigest()
+        with self._prefixes_lock:
+            context = self._prefixes.get(key)
+            if context is not None:
+                self._prefixes.move_to_end(key)
+                return context
+
+        try:
+            payload = {
+                "model": model,
+                "prompt": prefix,
+                "raw": True,
+                "stream": False,
+                "options": {"num_predict": 1},
+            }
+            if OLLAMA_KEEP_ALIVE:
+                payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+            response = self.session.post(f"{url}/api/generate", json=payload, timeout=timeout)
+            response.raise_for_status()
+            data = response.json()
+            context = data.get("context")
+            if not context:
+                raise ValueError("no context returned")
+            generated = data.get("eval_count", 0)
+            if generated >= len(context):
+                raise ValueError("context holds no prefix tokens")
+            if generated:
+                context = context[:-generated]  # keep only the prefix tokens
+        except Exception as e:
+            print(f"⚠️ Prefix priming failed, sending full prompt: {e}")
+            with _prefix_stats_lock:
+                _prefix_stats["prime_failures"] += 1
+            return None
+
+        print(f"🧷 Primed {len(context)}-token prompt prefix for {model}")
+        with _prefix_stats_lock:
+            _prefix_stats["primes"] += 1
+        with self._prefixes_lock:
+            self._prefixes[key] = context
+            while len(self._prefixes) > OLLAMA_PREFIX_CACHE_SIZE:
+                self._prefixes.popitem(last=False)
+        return context
+
+    def _read_stream(
+        self,
+        response: requests.Response,
+        stop_at: Optional[str],
+        give_up_at: float,
+        stats: Optional[dict] = None,
+    ) -> str:
+        """
+        Collect NDJSON tokens until Ollama reports done or the answer is complete
+
+        Closing the response early drops the connection, which makes Ollama
+        abort the rest of the generation. The read timeout only bounds the gap
+        between tokens, so the total generation time is checked against
+        give_up_at (a time.monotonic() value) as tokens arrive. Ollama only
+        reports its figures with the final chunk, so an early stop records the
+        number of streamed chunks as eval_count.
+        """
+        chunks = []
+        state = None
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json={
-                    "model": self.model,
-                    "prompt": prompt,
-                    "stream": False,  # Wait for complete response
-                    "temperature": 0.1,  # Low temp for deterministic queries
-                },
-                timeout=60
+            for line in response.iter_lines():
+                state = self._stream_line(line, chunks, stop_at, give_up_at, stats)
+                if state:
+                    break
+        finally:
+            response.close()
+            _count_stream(state == "early")
+        return "".join(chunks)
+
+    @staticmethod
+    def _stream_line(
+        line,
+        chunks: list,
+        stop_at: Optional[str],
+        give_up_at: float,
+        stats: Optional[dict],
+    ) -> Optional[str]:
+        """
+        Handle one NDJSON line of a stream
+
+        Returns:
+            "done" when Ollama finished, "early" when the answer is already
+            complete, "cancelled" when a hedge no longer needs it, None to keep reading
+        """
+        if _cancelled():
+            return "cancelled"
+        if not line:
+            return None
+        data = json.loads(line)
+        if "error" in data:
+            raise Exception(data["error"])
+        token = data.get("response", "")
+        chunks.append(token)
+        if data.get("done"):
+            if stats is not None:
+                stats.update((k, data[k]) for k in OLLAMA_STAT_FIELDS if k in data)
+            return "done"
+        if stop_at and is_complete_output(stop_at, "".join(chunks), token):
+            print(f"⏹️ Stopped generation early ({stop_at} complete)")
+            if stats is not None:
+                stats["eval_count"] = len(chunks)
+            return "early"
+        if time.monotonic() > give_up_at:
+            raise TimeoutError("generation ran past its time budget")
+        return None
+
+
+class OpenAICompatibleLLM:
+    """
+    Any local server speaking the OpenAI chat completions API - llama.cpp server,
+    vLLM (also on CPU), LM Studio, LocalAI. Servers like vLLM batch concurrent
+    requests continuously instead of running them one after another.
+
+    Setup (llama.cpp example):
+    1. llama-server -m mistral-7b-instruct.Q4_K_M.gguf --port 8080 --parallel 8
+    2. Set in .env: LLM_PROVIDER=openai, OPENAI_BASE_URL=http://localhost:8080/v1
+    3. Optionally OPENAI_MODEL (sent as `model`; vLLM needs the served name)
+    """
+
+    def __init__(self, model: str = "local"):
+        self.base_url = os.getenv("OPENAI_BASE_URL", "").rstrip("/")
+        if not self.base_url:
+            if os.getenv("LLM_PROVIDER", "").lower().strip() != "openai":
+                raise ValueError("OPENAI_BASE_URL not set in .env")
+            self.base_url = "http://localhost:8080/v1"
+        self.model = os.getenv("OPENAI_MODEL", model)
+        self.api_key = os.getenv("OPENAI_API_KEY", "")  # local servers usually accept any
+        self.temperature = 0.1
+        self.timeout = 60
+        self.max_tokens = int(os.getenv("OPENAI_MAX_TOKENS", "512"))
+        self.stream = os.getenv("OPENAI_STREAM", "true").lower() == "true"
+        self.cancellable = self.stream  # a hedge can close a losing candidate's stream
+        # The server batches and queues itself; set to keep priorities for a fixed number of slots
+        self.parallel_slots = int(os.getenv("OPENAI_PARALLEL_SLOTS", "0")) or None
+        self.session = get_http_session("openai")
+        self.available = self._check_connection()
+
+    def check_health(self) -> bool:
+        """Re-probe the server and update availability (used by the background prober)"""
+        self.available = self._check_connection()
+        return self.available
+
+    def _check_connection(self) -> bool:
+        """Check if the server answers /models"""
+        try:
+            response = self.session.get(f"{self.base_url}/models", headers=self._headers(), timeout=2)
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    def ask_ai(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        stats: Optional[dict] = None,
+        output_schema: Optional[dict] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """
+        Send prompt as one user message to /chat/completions and get the reply
+
+        The server applies the model's chat template, so instruct models see
+        the prompt the way they were trained to.
+
+        Args:
+            prompt: The prompt to send
+            stop_at: "json" or "sql" - close the stream once the query is complete
+            timeout: Seconds the whole generation may take (default 60)
+            prefix: Ignored - servers with a prompt cache reuse the prefix themselves
+            stats: Filled with the token counts from `usage`
+            output_schema: Sent as a json_schema response_format (OPENAI_STRUCTURED_OUTPUT)
+            temperature: Sampling temperature instead of the default 0.1
+
+        Returns:
+            Generated text response
+        """
+        self._require_server()
+        timeout = timeout or self.timeout
+        give_up_at = time.monotonic() + timeout
+        try:
+            response = self.session.post(
+                f"{self.base_url}/chat/completions",
+                headers=self._headers(),
+                json=self._payload(prompt, output_schema, temperature),
+                timeout=timeout,
+                stream=self.stream,
             )
             response.raise_for_status()
-            return response.json()["response"]
-        except requests.exceptions.Timeout:
-            raise TimeoutError("Ollama response timeout - try shorter prompts")
+            if not self.stream:
+                return self._completion_text(response.json(), stats)
+
+            chunks = []
+            state = None
+            try:
+                for line in response.iter_lines():
+                    state = self._sse_line(line, chunks, stop_at, give_up_at, stats)
+                    if state:
+                        break
+            finally:
+                response.close()  # drops the connection, which cancels the rest of the generation
+                _count_stream(state == "early")
+            return "".join(chunks)
+        except (requests.exceptions.Timeout, TimeoutError):
+            raise TimeoutError("OpenAI-compatible server response timeout")
         except requests.exceptions.ConnectionError:
+            raise ConnectionError(f"Cannot connect to the OpenAI-compatible server at {self.base_url}")
+        except Exception as e:
+            raise Exception(f"OpenAI-compatible server error: {str(e)}")
+
+    async def ask_ai_async(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        stats: Optional[dict] = None,
+        output_schema: Optional[dict] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """ask_ai over the shared httpx pool - same arguments, response and errors"""
+        self._require_server()
+        client = get_async_client("openai")
+        timeout = timeout or self.timeout
+        give_up_at = time.monotonic() + timeout
+        url = f"{self.base_url}/chat/completions"
+        payload = self._payload(prompt, output_schema, temperature)
+        try:
+            if not self.stream:
+                response = await client.post(url, headers=self._headers(), json=payload, timeout=timeout)
+                response.raise_for_status()
+                return self._completion_text(response.json(), stats)
+
+            chunks = []
+            state = None
+            try:
+                async with client.stream("POST", url, headers=self._headers(), json=payload, timeout=timeout) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        state = self._sse_line(line, chunks, stop_at, give_up_at, stats)
+                        if state:
+                            break
+            finally:
+                _count_stream(state == "early")
+            return "".join(chunks)
+        except _ASYNC_TIMEOUT_ERRORS:
+            raise TimeoutError("OpenAI-compatible server response timeout")
+        except _ASYNC_CONNECT_ERRORS:
+            raise ConnectionError(f"Cannot connect to the OpenAI-compatible server at {self.base_url}")
+        except Exception as e:
+            raise Exception(f"OpenAI-compatible server error: {str(e)}")
+
+    def _require_server(self) -> None:
+        if not self.available:
             raise ConnectionError(
-                f"Cannot connect to Ollama at {self.base_url}\n"
-                "Make sure Ollama is running: ollama serve"
+                f"❌ OpenAI-compatible server not running at {self.base_url}\n"
+                "Start it (e.g. llama-server ... --port 8080) or change OPENAI_BASE_URL"
             )
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    def _payload(self, prompt: str, output_schema: Optional[dict], temperature: Optional[float] = None) -> dict:
+        """/chat/completions request body"""
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature if temperature is None else temperature,
+            "max_tokens": self.max_tokens,
+            "stream": self.stream,
+        }
+        if self.stream:
+            payload["stream_options"] = {"include_usage": True}
+        if output_schema and OPENAI_STRUCTURED_OUTPUT:
+            payload["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": "query", "schema": output_schema},
+            }
+            payload["max_tokens"] = OLLAMA_JSON_NUM_PREDICT
+        return payload
+
+    @staticmethod
+    def _usage(data: dict, stats: Optional[dict]) -> None:
+        """Record `usage` under the Ollama names the metrics use"""
+        usage = data.get("usage")
+        if stats is not None and usage:
+            stats["prompt_eval_count"] = usage.get("prompt_tokens", 0)
+            stats["eval_count"] = usage.get("completion_tokens", 0)
+
+    def _completion_text(self, data: dict, stats: Optional[dict]) -> str:
+        self._usage(data, stats)
+        return data["choices"][0]["message"].get("content") or ""
+
+    def _sse_line(
+        self,
+        line,
+        chunks: list,
+        stop_at: Optional[str],
+        give_up_at: float,
+        stats: Optional[dict],
+    ) -> Optional[str]:
+        """
+        Handle one server-sent event line of a stream
+
+        Returns:
+            "done" at [DONE], "early" when the answer is already complete,
+            "cancelled" when a hedge no longer needs it, None to keep reading
+        """
+        if _cancelled():
+            return "cancelled"
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return "done"
+        data = json.loads(data)
+        if "error" in data:
+            raise Exception(data["error"])
+        self._usage(data, stats)
+        if not data.get("choices"):
+            return None  # the usage-only chunk
+        token = data["choices"][0].get("delta", {}).get("content") or ""
+        chunks.append(token)
+        if stop_at and is_complete_output(stop_at, "".join(chunks), token):
+            print(f"⏹️ Stopped generation early ({stop_at} complete)")
+            if stats is not None:
+                stats["eval_count"] = len(chunks)
+            return "early"
+        if time.monotonic() > give_up_at:
+            raise TimeoutError("generation ran past its time budget")
+        return None
+
+
+class LlamaCppLLM:
+    """
+    In-process llama.cpp (llama-cpp-python) - no HTTP hop or JSON per call
+
+    The GGUF file is memory-mapped, so forked gunicorn workers share one copy
+    of the weights through the page cache. Each process loads the model once,
+    on its first call (again after a fork). A Llama instance runs one
+    generation at a time, so other calls wait in the provider's queue.
+
+    Setup:
+    1. pip install llama-cpp-python
+    2. Download a GGUF model, e.g. mistral-7b-instruct-v0.2.Q4_K_M.gguf
+    3. Set LLAMA_CPP_MODEL_PATH in .env (and LLM_PROVIDER=llama_cpp to prefer it)
+    """
+
+    def __init__(self):
+        self.model_path = os.getenv("LLAMA_CPP_MODEL_PATH", "")
+        if not self.model_path:
+            raise ValueError("LLAMA_CPP_MODEL_PATH not set in .env")
+        if llama_cpp is None:
+            raise ValueError("llama-cpp-python is not installed: pip install llama-cpp-python")
+        if not os.path.isfile(self.model_path):
+            raise ValueError(f"GGUF model not found at {self.model_path}")
+        self.model = os.path.basename(self.model_path)
+        self.n_threads = int(os.getenv("LLAMA_CPP_THREADS", "0")) or None  # None: llama.cpp's default
+        self.n_ctx = int(os.getenv("LLAMA_CPP_CTX", "4096"))
+        self.n_gpu_layers = int(os.getenv("LLAMA_CPP_GPU_LAYERS", "0"))
+        self.max_tokens = int(os.getenv("LLAMA_CPP_MAX_TOKENS", "512"))
+        self.temperature = 0.1
+        self.timeout = 60
+        self.parallel_slots = 1  # one generation at a time per process
+        self.cancellable = True  # the token loop checks for a hedge winner
+        self.available = True
+        self._llama = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._grammars = {}  # json.dumps(schema) -> LlamaGrammar
+        self._stats = {"loads": 0, "load_seconds": None, "calls": 0, "tokens": 0, "eval_seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def ask_ai(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        stats: Optional[dict] = None,
+        output_schema: Optional[dict] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """
+        Generate a response in this process
+
+        Args:
+            prompt: The prompt to send to the model
+            stop_at: "json" or "sql" - stop as soon as the query is complete
+            timeout: Seconds the whole generation may take (default 60)
+            prefix: Ignored - llama.cpp keeps the previous prompt's KV cache
+                and only evaluates what follows the longest common prefix
+            stats: Filled with token counts and durations under Ollama's names
+                (load_duration only on the call that loaded the model)
+            output_schema: Enforced with a JSON-schema grammar (LLAMA_CPP_STRUCTURED_OUTPUT)
+            temperature: Sampling temperature instead of the default 0.1
+
+        Returns:
+            Generated text response
+        """
+        timeout = timeout or self.timeout
+        give_up_at = time.monotonic() + timeout
+        if not self._lock.acquire(timeout=timeout):
+            raise TimeoutError("llama.cpp busy - timed out waiting for the model")
+        try:
+            llama, load_seconds = self._loaded()
+            return self._generate(llama, prompt, stop_at, give_up_at, stats, output_schema, temperature, load_seconds)
+        except TimeoutError:
+            raise
         except Exception as e:
-            raise Exception(f"Ollama error: {str(e)}")
+            raise Exception(f"llama.cpp error: {str(e)}")
+        finally:
+            self._lock.release()
+
+    async def ask_ai_async(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        stats: Optional[dict] = None,
+        output_schema: Optional[dict] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """ask_ai in a worker thread - generation is CPU work in this process"""
+        return await asyncio.to_thread(
+            self.ask_ai, prompt, stop_at, timeout, prefix, stats, output_schema, temperature
+        )
+
+    def _loaded(self) -> tuple:
+        """(Llama instance for this process, seconds spent loading it now or 0.0)"""
+        if self._llama is not None and self._pid == os.getpid():
+            return self._llama, 0.0
+        started = time.perf_counter()
+        self._llama = llama_cpp.Llama(
+            model_path=self.model_path,
+            n_ctx=self.n_ctx,
+            n_threads=self.n_threads,
+            n_gpu_layers=self.n_gpu_layers,
+            use_mmap=True,  # weights stay in the page cache, shared between processes
+            verbose=False,
+        )
+        self._pid = os.getpid()
+        self._grammars.clear()
+        seconds = time.perf_counter() - started
+        with self._stats_lock:
+            self._stats["loads"] += 1
+            self._stats["load_seconds"] = round(seconds, 2)
+        print(f"🦙 Loaded {self.model} in {seconds:.1f}s (n_ctx={self.n_ctx}, n_threads={self.n_threads or 'auto'})")
+        return self._llama, seconds
+
+    def _grammar(self, output_schema: dict):
+        key = json.dumps(output_schema, sort_keys=True)
+        grammar = self._grammars.get(key)
+        if grammar is None:
+            grammar = self._grammars[key] = llama_cpp.LlamaGrammar.from_json_schema(key, verbose=False)
+        return grammar
+
+    def _generate(self, llama, prompt, stop_at, give_up_at, stats, output_schema, temperature, load_seconds) -> str:
+        """
+        Stream tokens from llama.cpp until it stops, the answer is complete
+        or a hedge cancels it
+
+        Closing the token generator early ends the generation.
+        """
+        options = {
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature if temperature is None else temperature,
+        }
+        if output_schema and LLAMA_CPP_STRUCTURED_OUTPUT:
+            options.update(grammar=self._grammar(output_schema), max_tokens=OLLAMA_JSON_NUM_PREDICT)
+
+        started = time.perf_counter()
+        first_token_at = None
+        chunks = []
+        state = None
+        completion = llama.create_completion(prompt, stream=True, **options)
+        try:
+            for chunk in completion:
+                if _cancelled():
+                    break
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                token = chunk["choices"][0]["text"]
+                chunks.append(token)
+                if stop_at and is_complete_output(stop_at, "".join(chunks), token):
+                    print(f"⏹️ Stopped generation early ({stop_at} complete)")
+                    state = "early"
+                    break
+                if time.monotonic() > give_up_at:
+                    raise TimeoutError("generation ran past its time budget")
+        finally:
+            completion.close()
+            _count_stream(state == "early")
+        finished = time.perf_counter()
+
+        first_token_at = first_token_at or finished
+        eval_seconds = finished - first_token_at
+        with self._stats_lock:
+            self._stats["calls"] += 1
+            self._stats["tokens"] += len(chunks)
+            self._stats["eval_seconds"] += eval_seconds
+        if stats is not None:
+            stats.update(
+                prompt_eval_count=len(llama.tokenize(prompt.encode("utf-8"))),
+                eval_count=len(chunks),  # one streamed chunk per token
+                prompt_eval_duration=int((first_token_at - started) * 1e9),
+                eval_duration=int(eval_seconds * 1e9),
+                total_duration=int((finished - started + load_seconds) * 1e9),
+            )
+            if load_seconds:
+                stats["load_duration"] = int(load_seconds * 1e9)
+        return "".join(chunks)
+
+    def runtime_stats(self) -> dict:
+        """Model load time and generation speed for /diagnostics"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        eval_seconds = stats.pop("eval_seconds")
+        stats["tokens_per_second"] = round(stats["tokens"] / eval_seconds, 1) if eval_seconds else 0.0
+        stats.update(
+            loaded=self._llama is not None and self._pid == os.getpid(),
+            n_ctx=self.n_ctx,
+            n_threads=self.n_threads or "auto",
+        )
+        return stats
 
 
 class HuggingFaceLLM:
@@ -99,7 +1563,13 @@ class HuggingFaceLLM:
     def __init__(self, model: str = "mistralai/Mistral-7B-Instruct-v0.1"):
         self.api_key = os.getenv("HUGGINGFACE_API_KEY", "")
         self.model = os.getenv("HUGGINGFACE_MODEL", model)
+        self.temperature = 0.1
+        self.timeout = 30
+        self.parallel_slots = None  # hosted API, no local slot limit
+        self.cancellable = False  # one blocking request per call
         self.base_url = "https://api-inference.huggingface.co/models"
+        self.session = get_http_session("huggingface")
+        self.available = True
         
         if not self.api_key:
             raise ValueError(
@@ -108,40 +1578,39 @@ class HuggingFaceLLM:
                 "Add to .env: HUGGINGFACE_API_KEY=your_key_here"
             )
     
-    def ask_ai(self, prompt: str) -> str:
+    def ask_ai(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        stats: Optional[dict] = None,
+        output_schema: Optional[dict] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
         """
         Send prompt to HuggingFace and get response
         
         Args:
             prompt: The prompt to send
+            stop_at: Ignored - the Inference API returns the full generation
+            timeout: Seconds to wait for the response (default 30)
+            prefix: Ignored - the full prompt is always sent
+            stats: Ignored - the Inference API reports no token counts
+            output_schema: Ignored - the Inference API cannot constrain output
+            temperature: Sampling temperature instead of the default 0.1
             
         Returns:
             Generated text response
         """
         try:
-            headers = {"Authorization": f"Bearer {self.api_key}"}
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/{self.model}",
-                headers=headers,
-                json={
-                    "inputs": prompt,
-                    "parameters": {
-                        "max_length": 1000,
-                        "temperature": 0.1,
-                    }
-                },
-                timeout=30
+                headers=self._headers(),
+                json=self._payload(prompt, temperature),
+                timeout=timeout or self.timeout
             )
-            
-            if response.status_code == 429:
-                raise RateLimitError("HuggingFace rate limit exceeded - try later")
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            if isinstance(result, list) and len(result) > 0:
-                return result[0].get("generated_text", "")
-            return str(result)
+            return self._generated_text(response)
             
         except requests.exceptions.Timeout:
             raise TimeoutError("HuggingFace response timeout")
@@ -150,6 +1619,313 @@ class HuggingFaceLLM:
         except Exception as e:
             raise Exception(f"HuggingFace error: {str(e)}")
 
+    async def ask_ai_async(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        timeout: Optional[float] = None,
+        prefix: Optional[str] = None,
+        stats: Optional[dict] = None,
+        output_schema: Optional[dict] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """ask_ai over the shared httpx pool - same arguments, response and errors"""
+        client = get_async_client("huggingface")
+        try:
+            response = await client.post(
+                f"{self.base_url}/{self.model}",
+                headers=self._headers(),
+                json=self._payload(prompt, temperature),
+                timeout=timeout or self.timeout,
+            )
+            return self._generated_text(response)
+        except _ASYNC_TIMEOUT_ERRORS:
+            raise TimeoutError("HuggingFace response timeout")
+        except _ASYNC_CONNECT_ERRORS:
+            raise ConnectionError("Cannot connect to HuggingFace API")
+        except Exception as e:
+            raise Exception(f"HuggingFace error: {str(e)}")
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _payload(self, prompt: str, temperature: Optional[float] = None) -> dict:
+        return {
+            "inputs": prompt,
+            "parameters": {
+                "max_length": 1000,
+                "temperature": self.temperature if temperature is None else temperature,
+            }
+        }
+
+    @staticmethod
+    def _generated_text(response) -> str:
+        """Text from a requests / httpx response of the Inference API"""
+        if response.status_code == 429:
+            raise RateLimitError("HuggingFace rate limit exceeded - try later")
+
+        response.raise_for_status()
+        result = response.json()
+
+        if isinstance(result, list) and len(result) > 0:
+            return result[0].get("generated_text", "")
+        return str(result)
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker
+
+    Closed: calls go through and outcomes are recorded in a sliding window.
+    Open: once the failure rate in the window reaches the threshold, calls are
+    refused for LLM_BREAKER_OPEN_SECONDS so a dead backend stops tying up
+    worker threads. Half-open: after that, one trial call is let through;
+    success closes the breaker, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        window: Optional[int] = None,
+        failure_rate: Optional[float] = None,
+        min_calls: Optional[int] = None,
+        open_seconds: Optional[float] = None,
+    ):
+        self.window = int(window or os.getenv("LLM_BREAKER_WINDOW", "20"))
+        self.failure_rate = float(failure_rate or os.getenv("LLM_BREAKER_FAILURE_RATE", "0.5"))
+        self.min_calls = int(min_calls or os.getenv("LLM_BREAKER_MIN_CALLS", "5"))
+        self.open_seconds = float(open_seconds or os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+        self.state = self.CLOSED
+        self._outcomes = deque(maxlen=self.window)  # True = success
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._times_opened = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may be sent to the provider right now"""
+        with self._lock:
+            if self.state == self.OPEN and time.time() - self._opened_at >= self.open_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            self._outcomes.append(True)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def release_trial(self) -> None:
+        """Hand back an admitted half-open trial that ended without a verdict (deadline ran out, cancelled)"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.time()
+        self._trial_in_flight = False
+        self._times_opened += 1
+
+    def status(self) -> dict:
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = self._outcomes.count(False)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "window_failure_rate": round(failures / calls, 3) if calls else 0.0,
+                "times_opened": self._times_opened,
+                "rejected_calls": self._rejected,
+                "retry_in": max(round(self._opened_at + self.open_seconds - time.time(), 1), 0)
+                if self.state == self.OPEN else 0,
+            }
+
+
+class ProviderRegistry:
+    """
+    Process-wide set of LLM providers shared by every Custom_GenAI instance
+
+    Providers are created on first use rather than at import time, so a cold
+    start with Ollama down no longer blocks once per Custom_GenAI. A daemon
+    thread re-probes provider health every LLM_HEALTH_INTERVAL seconds, so a
+    recovered Ollama is picked up without restarting Flask.
+    """
+
+    PROVIDER_CLASSES = {
+        "ollama": OllamaLLM,
+        "openai": OpenAICompatibleLLM,
+        "llama_cpp": LlamaCppLLM,
+        "huggingface": HuggingFaceLLM,
+    }
+
+    def __init__(self, health_interval: Optional[float] = None):
+        self.health_interval = float(
+            health_interval if health_interval is not None else os.getenv("LLM_HEALTH_INTERVAL", "30")
+        )
+        self._providers = None  # [(name, provider)] in priority order, built on first use
+        self._breakers = {name: CircuitBreaker() for name in self.PROVIDER_CLASSES}
+        self._active = None
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    def _priority(self) -> list:
+        """Ollama first unless LLM_PROVIDER names another provider"""
+        order = list(self.PROVIDER_CLASSES)
+        preferred = os.getenv("LLM_PROVIDER", "").lower().strip()
+        if preferred in order:
+            order.remove(preferred)
+            order.insert(0, preferred)
+        return order
+
+    def providers(self) -> list:
+        """Providers in priority order, creating them on first call"""
+        with self._lock:
+            if self._providers is None:
+                self._providers = []
+                for name in self._priority():
+                    try:
+                        self._providers.append((name, self.PROVIDER_CLASSES[name]()))
+                    except Exception as e:
+                        print(f"⚠️ {name} not available: {e}")
+                self._start_probe()
+            return list(self._providers)
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        return self._breakers[name]
+
+    def candidates(self) -> list:
+        """Available providers in priority order (breaker state is checked by the caller)"""
+        return [(name, p) for name, p in self.providers() if getattr(p, "available", True)]
+
+    def active(self) -> tuple:
+        """
+        First available provider
+
+        Returns:
+            (name, provider instance)
+
+        Raises:
+            Exception: if no provider is currently available
+        """
+        for name, provider in self.providers():
+            if getattr(provider, "available", True):
+                if self._active != name:
+                    self._active = name
+                    print(f"✅ Using {name} ({provider.model})")
+                return name, provider
+
+        raise Exception(
+            "❌ No LLM provider available!\n\n"
+            "Setup options:\n"
+            "1. Ollama (recommended): https://ollama.ai\n"
+            "   - ollama pull mistral\n"
+            "   - ollama serve\n\n"
+            "2. HuggingFace: Add HUGGINGFACE_API_KEY to .env\n"
+            "   - Get free key: https://huggingface.co/settings/tokens\n\n"
+            "3. OpenAI-compatible server (llama.cpp server, vLLM):\n"
+            "   - Set OPENAI_BASE_URL in .env, e.g. http://localhost:8080/v1\n\n"
+            "4. In-process llama.cpp: pip install llama-cpp-python\n"
+            "   - Set LLAMA_CPP_MODEL_PATH in .env to a GGUF file"
+        )
+
+    def probe(self) -> None:
+        """Re-check every provider that supports a health check"""
+        for name, provider in self.providers():
+            check = getattr(provider, "check_health", None)
+            if check is None:
+                continue
+            was_available = provider.available
+            try:
+                check()
+            except Exception as e:
+                print(f"⚠️ Health probe for {name} failed: {e}")
+                provider.available = False
+            if provider.available != was_available:
+                print(f"{'✅' if provider.available else '⚠️'} {name} is now {'up' if provider.available else 'down'}")
+
+    def _start_probe(self) -> None:
+        if self.health_interval <= 0 or self._probe_thread is not None:
+            return
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="llm-health-probe", daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self) -> None:
+        while True:
+            time.sleep(self.health_interval)
+            self.probe()
+
+    def status(self) -> dict:
+        """Provider availability for /diagnostics (does not create providers)"""
+        with self._lock:
+            providers = list(self._providers) if self._providers is not None else None
+        if providers is None:
+            return {"initialized": False}
+        status = {}
+        for name, provider in providers:
+            status[name] = {
+                "available": getattr(provider, "available", True),
+                "model": provider.model,
+                "breaker": self._breakers[name].status(),
+            }
+            if hasattr(provider, "endpoint_stats"):
+                status[name]["endpoints"] = provider.endpoint_stats()
+            if hasattr(provider, "runtime_stats"):
+                status[name]["runtime"] = provider.runtime_stats()
+        return {
+            "initialized": True,
+            "active": self._active,
+            "health_interval": self.health_interval,
+            "providers": status,
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_provider_registry() -> ProviderRegistry:
+    """Shared registry used by every Custom_GenAI instance"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ProviderRegistry()
+        return _registry
+
+
+def llm_parallel_slots() -> int:
+    """
+    Generations the registered providers can run at once (creates them on first call)
+
+    The widest provider's scheduler limit: LLM_PARALLEL_SLOTS per Ollama
+    endpoint, OPENAI_PARALLEL_SLOTS, or LLM_PARALLEL_SLOTS when a provider
+    sets no limit.
+    """
+    providers = get_provider_registry().providers()
+    return max((getattr(p, "parallel_slots", None) or LLM_PARALLEL_SLOTS for _, p in providers), default=LLM_PARALLEL_SLOTS)
+
 
 class Custom_GenAI:
     """
@@ -157,72 +1933,825 @@ class Custom_GenAI:
     
     Priority:
     1. Ollama (local, fastest, no API key)
-    2. HuggingFace (free cloud API)
+    2. OpenAI-compatible local server (llama.cpp server, vLLM) when OPENAI_BASE_URL is set
+    3. In-process llama.cpp when LLAMA_CPP_MODEL_PATH is set
+    4. HuggingFace (free cloud API)
     
     Configuration via .env:
-    - LLM_PROVIDER: "ollama" or "huggingface" (auto-detect if not set)
-    - OLLAMA_URL: http://localhost:11434 (default)
+    - LLM_PROVIDER: "ollama", "openai", "llama_cpp" or "huggingface" (auto-detect if not set)
+    - OLLAMA_URL: http://localhost:11434 (default); several comma-separated servers
+      are load-balanced (model loaded first, then fewest calls running)
+    - OLLAMA_ENDPOINT_REFRESH: seconds between health / loaded-model checks of those servers (default 30)
     - OLLAMA_MODEL: mistral (default)
+    - OLLAMA_STREAM: stream tokens and stop early on complete queries (true by default)
+    - OLLAMA_PREFIX_CACHE: prime static prompt prefixes once and send only the question (false by default)
+    - OLLAMA_KEEP_ALIVE: how long Ollama keeps the model loaded (default 30m with prefix caching)
+    - OLLAMA_STRUCTURED_OUTPUT: constrain calls that pass output_schema to it (true by default)
+    - OLLAMA_JSON_NUM_PREDICT: token limit for schema-constrained calls (default 256)
+    - OLLAMA_CASCADE_MODELS: smaller models tried first, in order, by calls that pass
+      validate; OLLAMA_MODEL only answers when validate rejects their output
+    - OPENAI_BASE_URL: OpenAI-compatible server, e.g. http://localhost:8080/v1 (provider off if not set)
+    - OPENAI_MODEL / OPENAI_API_KEY: model name and key sent to it (local servers accept any key)
+    - OPENAI_STREAM: stream over server-sent events and stop early (true by default)
+    - OPENAI_MAX_TOKENS: completion token limit (default 512)
+    - OPENAI_PARALLEL_SLOTS: queue calls for this many server slots (default 0 = the server queues)
+    - OPENAI_STRUCTURED_OUTPUT: send output_schema as a json_schema response_format (true by default)
+    - LLAMA_CPP_MODEL_PATH: GGUF file to run in-process with llama-cpp-python (provider off if not set)
+    - LLAMA_CPP_THREADS / LLAMA_CPP_CTX: CPU threads (default: llama.cpp's choice) and context size (default 4096)
+    - LLAMA_CPP_GPU_LAYERS: layers offloaded to a GPU build (default 0)
+    - LLAMA_CPP_MAX_TOKENS: completion token limit (default 512)
+    - LLAMA_CPP_STRUCTURED_OUTPUT: enforce output_schema with a grammar (true by default)
     - HUGGINGFACE_API_KEY: your API key
     - HUGGINGFACE_MODEL: mistralai/Mistral-7B-Instruct-v0.1 (default)
+    - LLM_POOL_CONNECTIONS / LLM_POOL_MAXSIZE: hosts / connections per host kept alive
+    - LLM_POOL_BLOCK: wait for a free connection instead of exceeding LLM_POOL_MAXSIZE
+    - LLM_KEEP_ALIVE: reuse TCP connections between calls (true by default)
+    - LLM_BREAKER_WINDOW / LLM_BREAKER_FAILURE_RATE / LLM_BREAKER_MIN_CALLS:
+      open a provider's circuit when this share of its recent calls failed
+    - LLM_BREAKER_OPEN_SECONDS: how long an open circuit skips the provider
+    - LLM_HEALTH_INTERVAL: seconds between background provider health probes (0 = off)
+    - LLM_SINGLE_FLIGHT: concurrent identical prompts wait for one shared call (true by default)
+    - LLM_PARALLEL_SLOTS: generations each Ollama server runs at once (default OLLAMA_NUM_PARALLEL, else 4)
+    - LLM_SCHEDULER: queue calls for those slots, interactive before batch / background (true by default)
+    - LLM_HEDGE_CANDIDATES: generations ask_hedged races per question (default 1 = off; streaming providers only)
+    - LLM_HEDGE_AFTER_SECONDS: start the next candidate after this long without an answer (default 3, 0 = all at once)
+    - LLM_HEDGE_TEMPERATURE: sampling temperature of the extra candidates (default 0.7)
+    - LLM_CACHE: cache responses on disk, shared by all workers (true by default)
+      (see llm_cache.py for LLM_CACHE_PATH / LLM_CACHE_MAX_BYTES / LLM_CACHE_TTL)
     """
     
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, role: str = "primary"):
         """
-        Initialize LLM - automatically selects provider
+        Initialize LLM - providers are shared and connected lazily on first use
         
         Args:
             api_key: Ignored (for backward compatibility with old code)
+            role: Caller role recorded with every call's metrics ("primary", "syntax", ...)
         """
-        self.provider = None
-        self.llm = None
-        
-        # Try Ollama first
-        try:
-            ollama = OllamaLLM()
-            if ollama.available:
-                self.provider = "ollama"
-                self.llm = ollama
-                print(f"✅ Using Ollama ({ollama.model})")
-                return
-        except Exception as e:
-            print(f"⚠️ Ollama not available: {e}")
-        
-        # Fallback to HuggingFace
-        try:
-            huggingface = HuggingFaceLLM()
-            self.provider = "huggingface"
-            self.llm = huggingface
-            print(f"✅ Using HuggingFace ({huggingface.model})")
-            return
-        except Exception as e:
-            print(f"⚠️ HuggingFace not available: {e}")
-        
-        raise Exception(
-            "❌ No LLM provider available!\n\n"
-            "Setup options:\n"
-            "1. Ollama (recommended): https://ollama.ai\n"
-            "   - ollama pull mistral\n"
-            "   - ollama serve\n\n"
-            "2. HuggingFace: Add HUGGINGFACE_API_KEY to .env\n"
-            "   - Get free key: https://huggingface.co/settings/tokens"
-        )
+        self.registry = get_provider_registry()
+        self.role = role
+
+    @property
+    def provider(self) -> str:
+        """Name of the provider the next call will use"""
+        return self.registry.active()[0]
+
+    @property
+    def llm(self):
+        """Provider instance the next call will use"""
+        return self.registry.active()[1]
     
-    def ask_ai(self, prompt: str) -> str:
+    def ask_ai(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        prefix: Optional[str] = None,
+        role: Optional[str] = None,
+        output_schema: Optional[dict] = None,
+        validate: Optional[Callable[[str], bool]] = None,
+    ) -> str:
         """
-        Get response from LLM
+        Get response from LLM, failing over to the next provider on errors
+
+        Callers asking the same prompt while an identical call is in flight
+        wait for that call and share its response.
         
         Args:
             prompt: The prompt to send
+            stop_at: "json" or "sql" to stop generating once the query is complete
+            deadline: Request budget - each provider call only gets the time that is left
+            prefix: Static start of prompt (see static_prefix) for providers that cache it
+            role: Overrides the instance role in metrics for this call (e.g. "regeneration")
+            output_schema: JSON schema to constrain the response to (providers that support it)
+            validate: Check for a response (blocking, may query the database); with
+                OLLAMA_CASCADE_MODELS the smaller models' answers are used when it accepts them
             
         Returns:
             Generated response text
+
+        Raises:
+            LLMUnavailableError: every provider failed or has an open circuit
+            DeadlineExceeded: the request budget ran out before a provider answered
         """
-        if not self.llm:
-            raise Exception("LLM not initialized")
-        return self.llm.ask_ai(prompt)
+        deadline = deadline or Deadline(None)
+        role = role or self.role
+        if not LLM_SINGLE_FLIGHT:
+            return self._ask_providers(prompt, stop_at, deadline, prefix, role, output_schema, validate)
+
+        key = LLMResponseCache.hash_prompt(prompt, variant=output_variant(stop_at, output_schema))
+        leader, future = self._join_flight(key)
+        if not leader:
+            started = time.perf_counter()
+            try:
+                response = future.result(timeout=deadline.timeout(stage="shared LLM call"))
+            except FutureTimeout:
+                raise DeadlineExceeded(f"Request deadline of {deadline.budget}s exceeded waiting for a shared LLM call")
+            except DeadlineExceeded:
+                # The leader ran out of its own budget - ours may still have time left
+                with _in_flight_lock:
+                    _single_flight_stats["leader_retries"] += 1
+                return self._ask_providers(prompt, stop_at, deadline, prefix, role, output_schema, validate)
+            record_llm_call("single_flight", "-", role, "coalesced", time.perf_counter() - started)
+            return response
+
+        try:
+            response = self._ask_providers(prompt, stop_at, deadline, prefix, role, output_schema, validate)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response
+        finally:
+            self._leave_flight(key)
+
+    async def ask_ai_async(
+        self,
+        prompt: str,
+        stop_at: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        prefix: Optional[str] = None,
+        role: Optional[str] = None,
+        output_schema: Optional[dict] = None,
+        validate: Optional[Callable[[str], bool]] = None,
+    ) -> str:
+        """
+        ask_ai for coroutines - same arguments, failover, caching and errors
+
+        Provider calls go through the shared httpx pool and slot / single-flight
+        waits happen on the event loop, so a pending call holds no thread.
+        Single-flight is shared with ask_ai callers.
+        """
+        deadline = deadline or Deadline(None)
+        role = role or self.role
+        if not LLM_SINGLE_FLIGHT:
+            return await self._ask_providers_async(prompt, stop_at, deadline, prefix, role, output_schema, validate)
+
+        key = LLMResponseCache.hash_prompt(prompt, variant=output_variant(stop_at, output_schema))
+        leader, future = self._join_flight(key)
+        if not leader:
+            started = time.perf_counter()
+            try:
+                # shield: giving up must not cancel the call for the other waiters
+                response = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), deadline.timeout(stage="shared LLM call")
+                )
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"Request deadline of {deadline.budget}s exceeded waiting for a shared LLM call")
+            except DeadlineExceeded:
+                with _in_flight_lock:
+                    _single_flight_stats["leader_retries"] += 1
+                return await self._ask_providers_async(prompt, stop_at, deadline, prefix, role, output_schema, validate)
+            record_llm_call("single_flight", "-", role, "coalesced", time.perf_counter() - started)
+            return response
+
+        try:
+            response = await self._ask_providers_async(prompt, stop_at, deadline, prefix, role, output_schema, validate)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response
+        finally:
+            self._leave_flight(key)
+
+    def call(self, prompt: str, **kwargs) -> "LLMCall":
+        """
+        An ask_ai call to be made by a pipeline driver (see run_pipeline)
+
+        Pipelines are generators that yield their LLM calls, so the same code
+        runs blocking (run_pipeline) or on an event loop (run_pipeline_async).
+        """
+        return LLMCall(self, prompt, kwargs)
+
+    def hedged_call(self, prompt: str, validate: Callable[[str], bool], **kwargs) -> "LLMCall":
+        """An ask_hedged call to be made by a pipeline driver (see call)"""
+        return LLMCall(self, prompt, dict(kwargs, validate=validate), method="ask_hedged")
+
+    def ask_hedged(
+        self,
+        prompt: str,
+        validate: Callable[[str], bool],
+        stop_at: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        prefix: Optional[str] = None,
+        role: Optional[str] = None,
+        output_schema: Optional[dict] = None,
+        candidates: Optional[int] = None,
+        hedge_after: Optional[float] = None,
+    ) -> str:
+        """
+        Race up to `candidates` generations of prompt, keeping the first answer validate accepts
+
+        The first candidate starts at once. Another one starts when the newest
+        has run hedge_after seconds without an accepted answer, or as soon as an
+        answer is rejected or fails. Extra candidates sample at
+        LLM_HEDGE_TEMPERATURE so they differ, and skip single-flight and the
+        response cache. Each answer is checked as it arrives (in the candidate's
+        thread); once one passes, the streams of the others are closed. With a
+        single candidate (LLM_HEDGE_CANDIDATES=1), or when the provider cannot
+        stop a generation early (not cancellable), this is ask_ai(validate=...).
+
+        Args:
+            validate: Check for an answer (blocking, may query the database)
+            candidates: Generations to start at most (default LLM_HEDGE_CANDIDATES)
+            hedge_after: Seconds before starting the next one (default LLM_HEDGE_AFTER_SECONDS)
+            Others: as ask_ai
+
+        Returns:
+            The first accepted answer, else the first answer that arrived
+
+        Raises:
+            As ask_ai, when every candidate failed
+        """
+        candidates = candidates or LLM_HEDGE_CANDIDATES
+        if candidates <= 1 or not self._hedgeable():
+            return self.ask_ai(
+                prompt, stop_at=stop_at, deadline=deadline, prefix=prefix, role=role,
+                output_schema=output_schema, validate=validate,
+            )
+        hedge_after = LLM_HEDGE_AFTER_SECONDS if hedge_after is None else hedge_after
+        deadline = deadline or Deadline(None)
+        role = role or self.role
+        running = {}  # future -> (candidate index, cancel event)
+
+        def launch():
+            nonlocal started
+            index = started
+            started += 1
+            event = threading.Event()
+            context = contextvars.copy_context()  # keeps the priority and the request trace
+            context.run(_cancel.set, event)
+            future = _hedge_executor.submit(
+                context.run, self._hedge_candidate, prompt, validate, stop_at, deadline, prefix,
+                role if index == 0 else "hedge", output_schema, None if index == 0 else LLM_HEDGE_TEMPERATURE,
+            )
+            running[future] = (index, event)
+
+        started = 0
+        first = error = winner = None
+        launch()
+        try:
+            while running:
+                can_hedge = started < candidates
+                timeout = deadline.timeout(hedge_after if can_hedge else None, stage="hedged LLM call")
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    if can_hedge:
+                        if hedge_after:
+                            print(f"🏁 No answer after {hedge_after}s, starting another candidate")
+                        launch()
+                    continue
+                for future in done:
+                    index, _ = running.pop(future)
+                    try:
+                        response, accepted = future.result()
+                    except DeadlineExceeded:
+                        raise
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if accepted:
+                        winner = index
+                        return response
+                    if first is None:
+                        first = response
+                if started < candidates:
+                    launch()  # replace the rejected / failed candidate straight away
+            if first is not None:
+                return first
+            raise error
+        finally:
+            for _, event in running.values():
+                event.set()
+            extra = started - 1
+            if winner:
+                print(f"🏁 Hedge candidate {winner + 1} won ({extra} extra LLM calls)")
+            _count_hedge(extra, winner, len(running))
+
+    async def ask_hedged_async(
+        self,
+        prompt: str,
+        validate: Callable[[str], bool],
+        stop_at: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        prefix: Optional[str] = None,
+        role: Optional[str] = None,
+        output_schema: Optional[dict] = None,
+        candidates: Optional[int] = None,
+        hedge_after: Optional[float] = None,
+    ) -> str:
+        """
+        ask_hedged for coroutines - candidates are tasks, checks run in worker
+        threads and losing candidates are cancelled (closing their streams)
+        """
+        candidates = candidates or LLM_HEDGE_CANDIDATES
+        if candidates <= 1 or not self._hedgeable():
+            return await self.ask_ai_async(
+                prompt, stop_at=stop_at, deadline=deadline, prefix=prefix, role=role,
+                output_schema=output_schema, validate=validate,
+            )
+        hedge_after = LLM_HEDGE_AFTER_SECONDS if hedge_after is None else hedge_after
+        deadline = deadline or Deadline(None)
+        role = role or self.role
+        running = {}  # task -> (candidate index, cancel event)
+
+        def launch():
+            nonlocal started
+            index = started
+            started += 1
+            event = threading.Event()
+            task = asyncio.ensure_future(self._hedge_candidate_async(
+                event, prompt, validate, stop_at, deadline, prefix,
+                role if index == 0 else "hedge", output_schema, None if index == 0 else LLM_HEDGE_TEMPERATURE,
+            ))
+            running[task] = (index, event)
+
+        started = 0
+        first = error = winner = None
+        launch()
+        try:
+            while running:
+                can_hedge = started < candidates
+                timeout = deadline.timeout(hedge_after if can_hedge else None, stage="hedged LLM call")
+                done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if can_hedge:
+                        if hedge_after:
+                            print(f"🏁 No answer after {hedge_after}s, starting another candidate")
+                        launch()
+                    continue
+                for task in done:
+                    index, _ = running.pop(task)
+                    try:
+                        response, accepted = task.result()
+                    except DeadlineExceeded:
+                        raise
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    if accepted:
+                        winner = index
+                        return response
+                    if first is None:
+                        first = response
+                if started < candidates:
+                    launch()
+            if first is not None:
+                return first
+            raise error
+        finally:
+            for task, (_, event) in running.items():
+                event.set()
+                task.cancel()
+            extra = started - 1
+            if winner:
+                print(f"🏁 Hedge candidate {winner + 1} won ({extra} extra LLM calls)")
+            _count_hedge(extra, winner, len(running))
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+    def _hedgeable(self) -> bool:
+        """Hedge only when the first provider can stop a losing candidate (see cancellable)"""
+        candidates = self.registry.candidates()
+        return bool(candidates) and getattr(candidates[0][1], "cancellable", False)
+
+    def _hedge_candidate(self, prompt, validate, stop_at, deadline, prefix, role, output_schema, temperature) -> tuple:
+        """One hedged generation and its check: (response, accepted)"""
+        response = self._ask_providers(prompt, stop_at, deadline, prefix, role, output_schema, None, temperature)
+        if _cancelled():
+            return response, False
+        return response, self._check(validate, response)
+
+    async def _hedge_candidate_async(
+        self, event, prompt, validate, stop_at, deadline, prefix, role, output_schema, temperature
+    ) -> tuple:
+        _cancel.set(event)  # in this task's own context
+        response = await self._ask_providers_async(
+            prompt, stop_at, deadline, prefix, role, output_schema, None, temperature
+        )
+        if _cancelled():
+            return response, False
+        return response, await asyncio.to_thread(self._check, validate, response)
+
+    @staticmethod
+    def _join_flight(key: str) -> tuple:
+        """(True, new future) for the leading call of a prompt, else (False, the leader's future)"""
+        with _in_flight_lock:
+            future = _in_flight.get(key)
+            if future is not None:
+                _single_flight_stats["coalesced_calls"] += 1
+                print("🔗 Identical prompt already in flight, waiting for its result")
+                return False, future
+            future = Future()
+            future.set_running_or_notify_cancel()  # waiters cannot cancel it
+            _in_flight[key] = future
+            _single_flight_stats["leader_calls"] += 1
+            return True, future
+
+    @staticmethod
+    def _leave_flight(key: str) -> None:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+    def _ask_providers(
+        self,
+        prompt: str,
+        stop_at: Optional[str],
+        deadline: Deadline,
+        prefix: Optional[str],
+        role: str,
+        output_schema: Optional[dict] = None,
+        validate: Optional[Callable[[str], bool]] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """
+        Try each provider in priority order (cache, slot, circuit breaker, then the call itself)
+
+        A temperature override (hedge candidates) skips the response cache; extra
+        hedge candidates also skip providers that cannot be cancelled.
+        """
+        candidates = self.registry.candidates()
+        if not candidates:
+            self.registry.active()  # raises the setup instructions
+
+        last_error = None
+        variant = output_variant(stop_at, output_schema)
+        extra_candidate = temperature is not None and _cancel.get() is not None
+        for provider, llm in candidates:
+            if extra_candidate and not getattr(llm, "cancellable", False):
+                continue  # could not be stopped once another hedge candidate wins
+            started = time.perf_counter()
+            cached = self._cached(provider, llm, prompt, variant) if temperature is None else None
+            if cached is not None:
+                record_llm_call(provider, llm.model, role, "cache_hit", time.perf_counter() - started)
+                return cached
+
+            # Queue for a slot before the breaker admits a (possibly half-open trial) call
+            scheduler = get_scheduler(provider, getattr(llm, "parallel_slots", None))
+            if scheduler is not None:
+                scheduler.acquire(_priority.get(), deadline.timeout(stage=f"{provider} slot"))
+            admitted = settled = False  # a call the breaker let through must end with a verdict
+            try:
+                timeout = deadline.timeout(llm.timeout, stage=f"{provider} call")
+                breaker = self.registry.breaker(provider)
+                if not breaker.allow():
+                    print(f"⏭️ Skipping {provider} (circuit open)")
+                    record_llm_call(provider, llm.model, role, "circuit_open", 0.0)
+                    continue
+                admitted = True
+                kwargs = dict(stop_at=stop_at, prefix=prefix, output_schema=output_schema)
+                if temperature is not None:
+                    kwargs["temperature"] = temperature
+                stats = {}
+                started = time.perf_counter()
+                try:
+                    if self._tiers(llm, validate):
+                        answered = self._cascade(provider, llm, role, prompt, validate, deadline, kwargs)
+                        if answered is not None:
+                            settled = True
+                            breaker.record_success()
+                            model, response = answered
+                            self._store(provider, llm, prompt, variant, response, model=model)
+                            return response
+                        timeout = deadline.timeout(llm.timeout, stage=f"{provider} call")
+                        started = time.perf_counter()
+                    response = llm.ask_ai(prompt, timeout=timeout, stats=stats, **kwargs)
+                    if self._tiers(llm, validate):
+                        _count_tier(llm.model, "accepted", time.perf_counter() - started)
+                except Exception as e:
+                    last_error = self._failed(provider, llm, role, started, stats, deadline, breaker, e)
+                    settled = not _cancelled()
+                    continue
+                settled = self._succeeded(provider, llm, role, started, stats, breaker, prompt, variant, response, temperature)
+                return response
+            finally:
+                if admitted and not settled:
+                    breaker.release_trial()  # deadline or cancellation, not the provider's fault
+                if scheduler is not None:
+                    scheduler.release()
+
+        raise LLMUnavailableError(
+            f"All LLM providers are unavailable or their circuits are open (last error: {last_error})"
+        )
+
+    async def _ask_providers_async(
+        self,
+        prompt: str,
+        stop_at: Optional[str],
+        deadline: Deadline,
+        prefix: Optional[str],
+        role: str,
+        output_schema: Optional[dict] = None,
+        validate: Optional[Callable[[str], bool]] = None,
+        temperature: Optional[float] = None,
+    ) -> str:
+        """_ask_providers awaiting each provider's ask_ai_async"""
+        candidates = self.registry.candidates()
+        if not candidates:
+            self.registry.active()  # raises the setup instructions
+
+        last_error = None
+        variant = output_variant(stop_at, output_schema)
+        extra_candidate = temperature is not None and _cancel.get() is not None
+        for provider, llm in candidates:
+            if extra_candidate and not getattr(llm, "cancellable", False):
+                continue  # could not be stopped once another hedge candidate wins
+            started = time.perf_counter()
+            cached = self._cached(provider, llm, prompt, variant) if temperature is None else None
+            if cached is not None:
+                record_llm_call(provider, llm.model, role, "cache_hit", time.perf_counter() - started)
+                return cached
+
+            scheduler = get_scheduler(provider, getattr(llm, "parallel_slots", None))
+            if scheduler is not None:
+                await scheduler.acquire_async(_priority.get(), deadline.timeout(stage=f"{provider} slot"))
+            admitted = settled = False  # a call the breaker let through must end with a verdict
+            try:
+                timeout = deadline.timeout(llm.timeout, stage=f"{provider} call")
+                breaker = self.registry.breaker(provider)
+                if not breaker.allow():
+                    print(f"⏭️ Skipping {provider} (circuit open)")
+                    record_llm_call(provider, llm.model, role, "circuit_open", 0.0)
+                    continue
+                admitted = True
+                kwargs = dict(stop_at=stop_at, prefix=prefix, output_schema=output_schema)
+                if temperature is not None:
+                    kwargs["temperature"] = temperature
+                stats = {}
+                started = time.perf_counter()
+                try:
+                    if self._tiers(llm, validate):
+                        answered = await self._cascade_async(provider, llm, role, prompt, validate, deadline, kwargs)
+                        if answered is not None:
+                            settled = True
+                            breaker.record_success()
+                            model, response = answered
+                            self._store(provider, llm, prompt, variant, response, model=model)
+                            return response
+                        timeout = deadline.timeout(llm.timeout, stage=f"{provider} call")
+                        started = time.perf_counter()
+                    response = await llm.ask_ai_async(prompt, timeout=timeout, stats=stats, **kwargs)
+                    if self._tiers(llm, validate):
+                        _count_tier(llm.model, "accepted", time.perf_counter() - started)
+                except LLMUnavailableError as e:
+                    print(f"⏭️ Skipping {provider} ({e})")
+                    last_error = e  # this process cannot call it; not a provider failure
+                    continue
+                except Exception as e:
+                    last_error = self._failed(provider, llm, role, started, stats, deadline, breaker, e)
+                    settled = not _cancelled()
+                    continue
+                settled = self._succeeded(provider, llm, role, started, stats, breaker, prompt, variant, response, temperature)
+                return response
+            finally:
+                if admitted and not settled:
+                    breaker.release_trial()  # deadline, cancellation or no httpx: not the provider's fault
+                if scheduler is not None:
+                    scheduler.release()
+
+        raise LLMUnavailableError(
+            f"All LLM providers are unavailable or their circuits are open (last error: {last_error})"
+        )
+
+    @staticmethod
+    def _tiers(llm, validate) -> list:
+        """Cascade models to try before llm.model (none without a validate callback)"""
+        return getattr(llm, "cascade_models", []) if validate is not None else []
+
+    def _cascade(self, provider, llm, role, prompt, validate, deadline, kwargs) -> Optional[tuple]:
+        """
+        Ask the provider's smaller models in order, checking each answer
+
+        Returns:
+            (model, answer) for the first answer validate accepts, or None to ask llm.model
+        """
+        for model in self._tiers(llm, validate):
+            stats = {}
+            timeout = deadline.timeout(llm.timeout, stage=f"{provider} {model} call")
+            started = time.perf_counter()
+            try:
+                response = llm.ask_ai(prompt, timeout=timeout, stats=stats, model=model, **kwargs)
+            except Exception as e:
+                self._tier_failed(provider, model, role, started, stats, e)
+                continue
+            if self._tier_checked(provider, model, role, started, stats, self._check(validate, response)):
+                return model, response
+        return None
+
+    async def _cascade_async(self, provider, llm, role, prompt, validate, deadline, kwargs) -> Optional[tuple]:
+        """_cascade awaiting ask_ai_async; validate runs in a worker thread"""
+        for model in self._tiers(llm, validate):
+            stats = {}
+            timeout = deadline.timeout(llm.timeout, stage=f"{provider} {model} call")
+            started = time.perf_counter()
+            try:
+                response = await llm.ask_ai_async(prompt, timeout=timeout, stats=stats, model=model, **kwargs)
+            except Exception as e:
+                self._tier_failed(provider, model, role, started, stats, e)
+                continue
+            accepted = await asyncio.to_thread(self._check, validate, response)
+            if self._tier_checked(provider, model, role, started, stats, accepted):
+                return model, response
+        return None
+
+    @staticmethod
+    def _check(validate, response: str) -> bool:
+        try:
+            return bool(validate(response))
+        except Exception as e:
+            print(f"⚠️ Answer check failed, treating it as rejected: {e}")
+            return False
+
+    @staticmethod
+    def _tier_failed(provider, model, role, started, stats, error) -> None:
+        seconds = time.perf_counter() - started
+        record_llm_call(provider, model, role, "error", seconds, stats)
+        _count_tier(model, "errors", seconds)
+        print(f"⚠️ {model} failed, escalating: {error}")
+
+    @staticmethod
+    def _tier_checked(provider, model, role, started, stats, accepted: bool) -> bool:
+        seconds = time.perf_counter() - started
+        record_llm_call(provider, model, role, "ok" if accepted else "escalated", seconds, stats)
+        _count_tier(model, "accepted" if accepted else "rejected", seconds)
+        print(f"🪜 {model} answer {'accepted' if accepted else 'rejected, escalating'}")
+        return accepted
+
+    @staticmethod
+    def _failed(provider, llm, role, started, stats, deadline, breaker, error) -> Exception:
+        """Record a failed provider call; returns the error to report if every provider fails"""
+        record_llm_call(provider, llm.model, role, "error", time.perf_counter() - started, stats)
+        if deadline.expired():
+            # Cut short by the request budget, not the provider's fault
+            raise DeadlineExceeded(f"Request deadline of {deadline.budget}s exceeded during {provider} call") from error
+        if _cancelled():
+            return error  # a hedge stopped it, not the provider's fault
+        breaker.record_failure()
+        print(f"⚠️ {provider} failed, trying next provider: {error}")
+        return error
+
+    def _succeeded(self, provider, llm, role, started, stats, breaker, prompt, variant, response, temperature=None) -> bool:
+        """Record a finished call; False when a hedge cut it short, which says nothing about the provider"""
+        cancelled = _cancelled()  # a hedge stopped it - the response is partial
+        record_llm_call(provider, llm.model, role, "cancelled" if cancelled else "ok", time.perf_counter() - started, stats)
+        if cancelled:
+            return False
+        breaker.record_success()
+        if temperature is None:
+            self._store(provider, llm, prompt, variant, response)
+        return True
+
+    @staticmethod
+    def _cache_key(provider: str, llm, prompt: str, variant: str, model: Optional[str] = None) -> tuple:
+        """model: the cascade tier that answered, when it was not llm.model"""
+        return (provider, model or llm.model, llm.temperature, LLMResponseCache.hash_prompt(prompt, variant=variant))
+
+    def _cached(self, provider: str, llm, prompt: str, variant: str) -> Optional[str]:
+        cache = get_response_cache()
+        if cache is None:
+            return None
+        return cache.get(*self._cache_key(provider, llm, prompt, variant))
+
+    def _store(self, provider: str, llm, prompt: str, variant: str, response: str, model: Optional[str] = None) -> None:
+        cache = get_response_cache()
+        if cache is not None and response:
+            cache.put(*self._cache_key(provider, llm, prompt, variant, model), response)
+
+
+class LLMCall:
+    """A Custom_GenAI.ask_ai (or ask_hedged) call yielded by a pipeline, made by its driver"""
+
+    __slots__ = ("llm", "prompt", "kwargs", "method")
+
+    def __init__(self, llm: "Custom_GenAI", prompt: str, kwargs: dict, method: str = "ask_ai"):
+        self.llm = llm
+        self.prompt = prompt
+        self.kwargs = kwargs
+        self.method = method
+
+
+def _advance(steps, response, error) -> tuple:
+    """Run a pipeline up to its next LLM call: (True, LLMCall) or (False, return value)"""
+    try:
+        return True, (steps.throw(error) if error is not None else steps.send(response))
+    except StopIteration as done:
+        return False, done.value
+
+
+def run_pipeline(steps):
+    """
+    Drive a pipeline generator with blocking ask_ai calls
+
+    Each yielded LLMCall is answered by sending the response back into the
+    generator, or by raising the call's error at the yield. The generator's
+    return value is returned.
+    """
+    response = error = None
+    while True:
+        pending, call = _advance(steps, response, error)
+        if not pending:
+            return call
+        response = error = None
+        try:
+            response = getattr(call.llm, call.method)(call.prompt, **call.kwargs)
+        except Exception as e:
+            error = e
+
+
+async def run_pipeline_async(steps):
+    """
+    run_pipeline on an event loop
+
+    LLM calls are awaited with ask_ai_async. The code between them (database
+    queries, file reads) runs in a worker thread so it does not block the
+    loop, which means a thread is only held while there is work to do.
+    """
+    response = error = None
+    while True:
+        pending, call = await asyncio.to_thread(_advance, steps, response, error)
+        if not pending:
+            return call
+        response = error = None
+        try:
+            response = await getattr(call.llm, f"{call.method}_async")(call.prompt, **call.kwargs)
+        except Exception as e:
+            error = e
+
+
+def _metrics_rows() -> list:
+    """Wrapper internals exported on /metrics next to the per-call figures"""
+    rows = []
+    single_flight = get_single_flight_stats()
+    for key in ("leader_calls", "coalesced_calls", "leader_retries"):
+        rows.append((f"recipellm_llm_single_flight_{key}_total", "counter",
+                     "Single-flight leader / coalesced / retried calls", {}, single_flight[key]))
+    rows.append(("recipellm_llm_in_flight_prompts", "gauge", "Distinct prompts currently in flight", {},
+                 single_flight["in_flight"]))
+    with _stream_stats_lock:
+        streams = dict(_stream_stats)
+    rows.append(("recipellm_llm_streams_total", "counter", "Streamed generations", {}, streams["streams"]))
+    rows.append(("recipellm_llm_early_stops_total", "counter", "Streams closed once the query was complete", {},
+                 streams["early_stops"]))
+    hedging = get_hedge_stats()
+    for key in ("questions", "won_by_extra", "none_accepted", "cancelled"):
+        rows.append((f"recipellm_llm_hedge_{key}_total", "counter",
+                     "Hedged questions / won by an extra candidate / with no accepted answer / cancelled candidates",
+                     {}, hedging[key]))
+    for model, tier in get_cascade_stats()["tiers"].items():
+        for outcome in ("accepted", "rejected", "errors"):
+            rows.append(("recipellm_llm_cascade_answers_total", "counter", "Cascade tier answers by outcome",
+                         {"model": model, "outcome": outcome}, tier[outcome]))
+        rows.append(("recipellm_llm_cascade_latency_ms", "gauge", "Average call latency of a cascade tier",
+                     {"model": model}, tier["avg_latency_ms"]))
+    for name, info in get_scheduler_stats()["providers"].items():
+        rows.append(("recipellm_llm_slots_busy", "gauge", "Provider slots currently generating",
+                     {"provider": name}, info["busy"]))
+        for priority, depth in info["queued_now"].items():
+            rows.append(("recipellm_llm_queue_depth", "gauge", "LLM calls waiting for a provider slot",
+                         {"provider": name, "priority": priority}, depth))
+        rows.append(("recipellm_llm_queue_timeouts_total", "counter", "Calls whose deadline ran out in the queue",
+                     {"provider": name}, info["timeouts"]))
+    providers = get_provider_registry().status().get("providers", {})
+    for name, info in providers.items():
+        rows.append(("recipellm_llm_provider_available", "gauge", "1 if the provider passed its last health check",
+                     {"provider": name}, int(info["available"])))
+        rows.append(("recipellm_llm_circuit_open", "gauge", "1 if the provider's circuit breaker is open",
+                     {"provider": name}, int(info["breaker"]["state"] == CircuitBreaker.OPEN)))
+        runtime = info.get("runtime")
+        if runtime:
+            if runtime["load_seconds"] is not None:
+                rows.append(("recipellm_llm_model_load_seconds", "gauge", "Time the in-process model took to load",
+                             {"provider": name}, runtime["load_seconds"]))
+            rows.append(("recipellm_llm_tokens_per_second", "gauge", "Average in-process generation speed",
+                         {"provider": name}, runtime["tokens_per_second"]))
+        for url, endpoint in info.get("endpoints", {}).items():
+            labels = {"provider": name, "endpoint": url}
+            rows.append(("recipellm_llm_endpoint_healthy", "gauge", "1 if the endpoint passed its last check",
+                         labels, int(endpoint["healthy"])))
+            rows.append(("recipellm_llm_endpoint_model_loaded", "gauge", "1 if the endpoint has the model in memory",
+                         labels, int(endpoint["model_loaded"])))
+            rows.append(("recipellm_llm_endpoint_outstanding", "gauge", "Calls currently routed to the endpoint",
+                         labels, endpoint["outstanding"]))
+            rows.append(("recipellm_llm_endpoint_requests_total", "counter", "Calls routed to the endpoint",
+                         labels, endpoint["requests"]))
+            rows.append(("recipellm_llm_endpoint_errors_total", "counter", "Failed calls on the endpoint",
+                         labels, endpoint["errors"]))
+            rows.append(("recipellm_llm_endpoint_latency_ms", "gauge", "Average call latency on the endpoint",
+                         labels, endpoint["avg_latency_ms"]))
+    return rows
+
+
+register_collector(_metrics_rows)
 
 
 class RateLimitError(Exception):
     """Raised when API rate limit is exceeded"""
     pass
+
+
+class LLMUnavailableError(Exception):
+    """Raised when every provider failed or has an open circuit breaker"""
+    pass
@@ -0,0 +1,189 @@
+"""
+Schema Pruning - Only put the tables / collections a question needs into the prompt.
+Prompt evaluation dominates latency on CPU Ollama, and most questions touch
+one or two tables, so sending the whole schema every time is wasted work.
+
+The schema file is split into one block per table (or collection). A block is
+kept when the question names the table or one of its keywords; when nothing
+names a table, blocks whose fields the question mentions are kept instead.
+Wide blocks are cut down to their key fields plus the fields the question
+mentions. When nothing matches at all the full schema is used.
+"""
+
+import os
+import re
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+_WORD_RE = re.compile(r"[a-z][a-z0-9_]*")
+_FIELD_RE = re.compile(r"^\s*-\s*`?([A-Za-z_]\w*)")
+
+# Too common in field names to say anything about which table is meant
+GENERIC_WORDS = {"name", "id", "type", "date", "category", "unit", "value", "the", "and", "with"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt token count (~4 characters per token for English and code)"""
+    return (len(text) + 3) // 4
+
+
+def _words(text: str) -> set:
+    words = set()
+    for word in _WORD_RE.findall(text.lower()):
+        words.add(word)
+        if len(word) > 4 and word.endswith("ies"):
+            words.add(word[:-3] + "y")  # countries -> country
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            words.add(word[:-1])  # recipes -> recipe, prices -> price
+    return words
+
+
+class _Block:
+    __slots__ = ("name", "header", "lines", "fields")
+
+    def __init__(self, name, header):
+        self.name = name
+        self.header = header
+        self.lines = []  # (field name or None, line)
+        self.fields = []
+
+
+class SchemaPruner:
+    """
+    Cuts a schema listing down to the blocks relevant to a question.
+
+    Configuration via .env:
+    - SCHEMA_PRUNING: prune the schema in prompts (true by default)
+    - SCHEMA_PRUNE_MIN_FIELDS: only drop fields from blocks wider than this (default 12)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        header_pattern: str,
+        keywords: Optional[Dict[str, Iterable[str]]] = None,
+        key_fields: Optional[Dict[str, Iterable[str]]] = None,
+        links: Optional[Iterable[Tuple[Iterable[str], Iterable[str]]]] = None,
+        field_synonyms: Optional[Dict[str, Iterable[str]]] = None,
+    ):
+        """
+        Args:
+            name: Label for log lines ("SQL", "Mongo")
+            header_pattern: Regex matching a block header line, with a (?P<name>...) group
+            keywords: {table: words that mean the question is about it}
+            key_fields: {table: fields always kept when the block's fields are pruned}
+            links: [(tables, join tables)] - the join tables are added when all the tables are kept
+            field_synonyms: {question word: field names it refers to}, e.g. "calorie" -> energy_kcal
+        """
+        self.name = name
+        self.header_re = re.compile(header_pattern)
+        self.keywords = {t: set(w) for t, w in (keywords or {}).items()}
+        self.key_fields = {t: set(f) for t, f in (key_fields or {}).items()}
+        self.links = [(set(ends), set(joins)) for ends, joins in (links or [])]
+        self.field_synonyms = {w: set(f) for w, f in (field_synonyms or {}).items()}
+        self.enabled = os.getenv("SCHEMA_PRUNING", "true").lower() == "true"
+        self.min_fields = int(os.getenv("SCHEMA_PRUNE_MIN_FIELDS", "12"))
+        self._lock = threading.Lock()
+        self._stats = {"prompts": 0, "pruned": 0, "tokens_before": 0, "tokens_after": 0}
+
+    def _parse(self, schema_text: str):
+        preamble, blocks = [], []
+        for line in schema_text.splitlines():
+            match = self.header_re.match(line)
+            if match:
+                blocks.append(_Block(match.group("name"), line))
+            elif blocks:
+                field = _FIELD_RE.match(line)
+                field_name = field.group(1) if field else None
+                blocks[-1].lines.append((field_name, line))
+                if field_name:
+                    blocks[-1].fields.append(field_name)
+            else:
+                preamble.append(line)
+        return preamble, blocks
+
+    def _field_matches(self, field: str, words: set) -> bool:
+        field = field.lower()
+        if field in words:
+            return True
+        if any(field in self.field_synonyms.get(w, ()) for w in words):
+            return True
+        parts = [p for p in field.split("_") if len(p) >= 3]
+        for word in words:
+            if len(word) < 3 or word in GENERIC_WORDS:
+                continue
+            # protein -> proteincontent / protein_g, carb -> carbohydrate_g
+            if word in parts or field.startswith(word) or any(p.startswith(word) for p in parts):
+                return True
+        return False
+
+    def prune(self, schema_text: str, text: str) -> str:
+        """
+        Keep only the schema blocks and fields relevant to text
+
+        Args:
+            schema_text: Full schema listing
+            text: The question, plus any generated query whose tables must stay
+
+        Returns:
+            Pruned schema listing (the full listing if nothing matched)
+        """
+        if not self.enabled:
+            return schema_text
+        preamble, blocks = self._parse(schema_text)
+        if not blocks:
+            return schema_text
+
+        words = _words(text)
+        named = {
+            b.name for b in blocks
+            if b.name.lower() in words or words & self.keywords.get(b.name, set())
+        }
+        matched_fields = {b.name: [f for f in b.fields if self._field_matches(f, words)] for b in blocks}
+        selected = named or {b.name for b in blocks if matched_fields[b.name]}
+        if not selected:
+            return schema_text
+        for ends, joins in self.links:
+            if ends <= selected:
+                selected |= joins
+
+        lines = list(preamble)
+        for block in blocks:
+            if block.name not in selected:
+                continue
+            keep = None
+            key_fields = self.key_fields.get(block.name, set(block.fields[:2]))
+            if len(block.fields) > self.min_fields and set(matched_fields[block.name]) - key_fields:
+                keep = key_fields | set(matched_fields[block.name])
+            lines.append(block.header)
+            lines.extend(line for field, line in block.lines if keep is None or field is None or field in keep)
+        return "\n".join(lines).strip() + "\n"
+
+    def render(self, template: str, schema_text: str, question: str) -> str:
+        """
+        Fill {SCHEMA} with the schema pruned for question, and {QUESTION}
+
+        Logs the estimated prompt size with the full and the pruned schema.
+        """
+        full_prompt = template.replace("{SCHEMA}", schema_text).replace("{QUESTION}", question)
+        pruned_schema = self.prune(schema_text, question)
+        prompt = template.replace("{SCHEMA}", pruned_schema).replace("{QUESTION}", question)
+
+        before, after = estimate_tokens(full_prompt), estimate_tokens(prompt)
+        with self._lock:
+            self._stats["prompts"] += 1
+            self._stats["pruned"] += int(after < before)
+            self._stats["tokens_before"] += before
+            self._stats["tokens_after"] += after
+        print(f"✂️ {self.name} prompt: ~{before} -> ~{after} tokens after schema pruning")
+        return prompt
+
+    def stats(self) -> Dict[str, float]:
+        """Prompt size counters for /diagnostics"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["enabled"] = self.enabled
+        stats["token_reduction"] = (
+            round(1 - stats["tokens_after"] / stats["tokens_before"], 3) if stats["tokens_before"] else 0.0
+        )
+        return stats
@@ -0,0 +1,272 @@
+"""
+Benchmark the models pulled in Ollama on the agents' own prompts and rank them.
+
+Every model listed by /api/tags (or the ones given with --models) answers a
+golden set of recipe, nutrition and price questions through the SQL and the
+Mongo prompt templates. For each model the report gives time to first token,
+tokens per second, time until the query was complete (what the agents wait
+for with OLLAMA_STREAM) and the share of queries that pass the same checks the
+agents use: the EXPLAIN dry-run for SQL, the local validator for Mongo.
+
+    python scripts/benchmark_models.py
+    python scripts/benchmark_models.py --models mistral,qwen2.5-coder:7b --runs 3 --write-env
+
+Models are ranked by validity first, then by median latency. The report is
+written as Markdown and JSON; --write-env sets OLLAMA_MODEL in .env to the winner.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import requests
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+load_dotenv(ROOT / ".env")
+
+from llm_wrapper_opensource import (  # noqa: E402
+    OLLAMA_JSON_NUM_PREDICT,
+    OLLAMA_JSON_STOP,
+    OLLAMA_STRUCTURED_OUTPUT,
+    is_complete_output,
+)
+
+GOLDEN_QUESTIONS = [
+    "Show me chicken recipes with more than 4.5 rating",
+    "Which vegetarian recipes have under 300 calories?",
+    "List the 5 recipes with the most reviews",
+    "How much protein is in 100g of lentils?",
+    "Which ingredients have the most fiber?",
+    "Compare the iron content of spinach and kale",
+    "What is the average price of maize in Kenya?",
+    "Which market sells the cheapest rice in Nigeria?",
+]
+
+
+def list_models(base_url: str) -> list:
+    response = requests.get(f"{base_url}/api/tags", timeout=5)
+    response.raise_for_status()
+    return sorted(m["name"] for m in response.json().get("models", []))
+
+
+def load_agents():
+    """The agent modules, for their prompt templates, schema pruners and validators"""
+    import Mongodb.agent3 as mongo_agent
+    import SQL.agent3_sql_final as sql_agent
+    return sql_agent, mongo_agent
+
+
+def build_cases(questions: list, modes: list) -> list:
+    """(mode, question, prompt, stop_at, output schema or None, validity check) per question and agent"""
+    sql_agent, mongo_agent = load_agents()
+    cases = []
+    if "sql" in modes:
+        schema = sql_agent.SQL_SCHEMA_PATH.read_text(encoding="utf-8")
+        template = sql_agent.SQL_PROMPT_PATH.read_text(encoding="utf-8")
+
+        def sql_valid(text):
+            return sql_agent.explain_sql_query(sql_agent.clean_sql_query(text)) is None
+
+        for question in questions:
+            prompt = sql_agent.SCHEMA_PRUNER.render(template, schema, question)
+            cases.append(("sql", question, prompt, "sql", None, sql_valid))
+    if "mongo" in modes:
+        schema = mongo_agent.MONGO_SCHEMA_PATH.read_text(encoding="utf-8")
+        template = mongo_agent.MONGO_PROMPT_PATH.read_text(encoding="utf-8")
+        for question in questions:
+            prompt = mongo_agent.SCHEMA_PRUNER.render(template, schema, question)
+            cases.append(("mongo", question, prompt, "json", mongo_agent.QUERY_OBJECT_FORMAT, mongo_agent.is_valid_query))
+    return cases
+
+
+def generate(base_url: str, model: str, prompt: str, stop_at: str, output_schema, timeout: float) -> dict:
+    """
+    One streamed generation, run to the end so Ollama reports its figures
+
+    Returns:
+        {"text", "ttft_s", "complete_s", "total_s", "tokens", "tokens_per_second", "load_s"}
+    """
+    payload = {"model": model, "prompt": prompt, "stream": True, "options": {"temperature": 0.1}}
+    if output_schema and OLLAMA_STRUCTURED_OUTPUT:
+        payload["format"] = output_schema
+        payload["options"].update(num_predict=OLLAMA_JSON_NUM_PREDICT, stop=OLLAMA_JSON_STOP)
+
+    started = time.perf_counter()
+    first_token = complete = None
+    chunks = []
+    final = {}
+    with requests.post(f"{base_url}/api/generate", json=payload, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if "error" in data:
+                raise RuntimeError(data["error"])
+            token = data.get("response", "")
+            now = time.perf_counter()
+            if token and first_token is None:
+                first_token = now
+            chunks.append(token)
+            if complete is None and is_complete_output(stop_at, "".join(chunks), token):
+                complete = now  # where the agents close the stream
+            if data.get("done"):
+                final = data
+                break
+    finished = time.perf_counter()
+
+    eval_seconds = final.get("eval_duration", 0) / 1e9
+    return {
+        "text": "".join(chunks),
+        "ttft_s": (first_token or finished) - started,
+        "complete_s": (complete or finished) - started,
+        "total_s": finished - started,
+        "tokens": final.get("eval_count", len(chunks)),
+        "tokens_per_second": final.get("eval_count", 0) / eval_seconds if eval_seconds else 0.0,
+        "load_s": final.get("load_duration", 0) / 1e9,
+    }
+
+
+def check(valid, text: str):
+    """True / False, or None when the check itself could not run (database down)"""
+    try:
+        return bool(valid(text))
+    except Exception as e:
+        print(f"   ⚠️ validity check unavailable: {e}")
+        return None
+
+
+def benchmark_model(base_url: str, model: str, cases: list, runs: int, timeout: float) -> dict:
+    print(f"\n🏎️ {model}")
+    try:
+        warmup = generate(base_url, model, "Say OK.", "sql", None, timeout)
+    except Exception as e:
+        print(f"   ❌ failed to load: {e}")
+        return {"model": model, "error": str(e)}
+    print(f"   loaded in {warmup['load_s']:.1f}s")
+
+    results = []
+    for mode, question, prompt, stop_at, output_schema, valid in cases:
+        for _ in range(runs):
+            try:
+                result = generate(base_url, model, prompt, stop_at, output_schema, timeout)
+            except Exception as e:
+                print(f"   ❌ [{mode}] {question}: {e}")
+                results.append({"mode": mode, "question": question, "error": str(e), "valid": False})
+                continue
+            result.update(mode=mode, question=question, valid=check(valid, result.pop("text")))
+            mark = {True: "✅", False: "❌", None: "❔"}[result["valid"]]
+            print(f"   {mark} [{mode}] {question} ({result['complete_s']:.2f}s)")
+            results.append(result)
+    return summarize(model, warmup["load_s"], results)
+
+
+def summarize(model: str, load_s: float, results: list) -> dict:
+    ok = [r for r in results if "error" not in r]
+    checked = [r for r in results if r["valid"] is not None]
+    summary = {
+        "model": model,
+        "load_s": round(load_s, 2),
+        "runs": len(results),
+        "errors": len(results) - len(ok),
+        "validity": round(sum(r["valid"] for r in checked) / len(checked), 3) if checked else None,
+    }
+    for mode in ("sql", "mongo"):
+        mode_checked = [r for r in checked if r["mode"] == mode]
+        if mode_checked:
+            summary[f"{mode}_validity"] = round(sum(r["valid"] for r in mode_checked) / len(mode_checked), 3)
+    if ok:
+        latencies = sorted(r["complete_s"] for r in ok)
+        summary.update(
+            median_latency_s=round(statistics.median(latencies), 2),
+            p90_latency_s=round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))], 2),
+            median_ttft_s=round(statistics.median(r["ttft_s"] for r in ok), 2),
+            tokens_per_second=round(statistics.mean(r["tokens_per_second"] for r in ok), 1),
+        )
+    return summary
+
+
+def rank(summaries: list) -> list:
+    """Most valid first, then fastest; models that failed to run go last"""
+    def key(s):
+        if "median_latency_s" not in s:
+            return (1, 0.0, float("inf"))
+        return (0, -(s["validity"] or 0.0), s["median_latency_s"])
+    return sorted(summaries, key=key)
+
+
+def write_report(ranked: list, path: Path, questions: int, runs: int) -> None:
+    columns = [
+        ("model", "Model"), ("validity", "Valid"), ("sql_validity", "SQL valid"), ("mongo_validity", "Mongo valid"),
+        ("median_latency_s", "Median latency (s)"), ("p90_latency_s", "p90 (s)"), ("median_ttft_s", "TTFT (s)"),
+        ("tokens_per_second", "Tokens/s"), ("load_s", "Load (s)"), ("errors", "Errors"),
+    ]
+    lines = [
+        "# Ollama model benchmark",
+        "",
+        f"{time.strftime('%Y-%m-%d %H:%M')} - {questions} questions x {runs} run(s) per agent prompt. "
+        "Latency is the time until the query was complete, as the agents see it.",
+        "",
+        "| # | " + " | ".join(title for _, title in columns) + " |",
+        "|---|" + "---|" * len(columns),
+    ]
+    for position, summary in enumerate(ranked, 1):
+        cells = [str(summary.get(key, "-")) if summary.get(key) is not None else "-" for key, _ in columns]
+        lines.append(f"| {position} | " + " | ".join(cells) + " |")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    path.with_suffix(".json").write_text(json.dumps(ranked, indent=2), encoding="utf-8")
+    print(f"\n📝 Report written to {path} (and {path.with_suffix('.json').name})")
+
+
+def write_env_model(model: str, env_path: Path) -> None:
+    """Set OLLAMA_MODEL in .env, keeping every other line"""
+    lines = env_path.read_text(encoding="utf-8").splitlines() if env_path.exists() else []
+    lines = [line for line in lines if not line.strip().startswith("OLLAMA_MODEL=")]
+    lines.append(f"OLLAMA_MODEL={model}")
+    env_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    print(f"🔧 OLLAMA_MODEL={model} written to {env_path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark and rank the local Ollama models")
+    parser.add_argument("--url", default=os.getenv("OLLAMA_URL", "http://localhost:11434").split(",")[0].strip())
+    parser.add_argument("--models", help="comma-separated models (default: every model in /api/tags)")
+    parser.add_argument("--mode", choices=["sql", "mongo", "both"], default="both")
+    parser.add_argument("--questions", type=Path, help="file with one question per line (default: golden set)")
+    parser.add_argument("--runs", type=int, default=1, help="runs per question")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", type=Path, default=ROOT / "benchmark_report.md")
+    parser.add_argument("--write-env", action="store_true", help="set OLLAMA_MODEL in .env to the best model")
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip("/")
+    models = [m.strip() for m in args.models.split(",")] if args.models else list_models(base_url)
+    if not models:
+        sys.exit(f"No models found at {base_url} - pull one with: ollama pull mistral")
+    questions = GOLDEN_QUESTIONS
+    if args.questions:
+        questions = [q.strip() for q in args.questions.read_text(encoding="utf-8").splitlines() if q.strip()]
+    modes = ["sql", "mongo"] if args.mode == "both" else [args.mode]
+
+    cases = build_cases(questions, modes)
+    print(f"Benchmarking {len(models)} model(s) on {len(cases)} prompts x {args.runs} run(s)")
+    ranked = rank([benchmark_model(base_url, model, cases, args.runs, args.timeout) for model in models])
+    write_report(ranked, args.output, len(questions), args.runs)
+
+    best = ranked[0]
+    if "median_latency_s" not in best:
+        sys.exit("❌ No model completed the benchmark")
+    print(f"🏆 Recommended: OLLAMA_MODEL={best['model']} "
+          f"(valid {best['validity']}, median {best['median_latency_s']}s)")
+    if args.write_env:
+        write_env_model(best["model"], ROOT / ".env")
+
+
+if __name__ == "__main__":
+    main()
@@ -119,9 +119,12 @@ def run_schema(db_name: str, user: str, password: str, host: str, port: str) ->
             related_table TEXT,
             ingredient_id INT,
             recipe_id INT,
-            price_id INT
+            price_id INT,
+            llm_stats JSONB
         );
         """,
+        # Databases created before llm_stats existed
+        "ALTER TABLE query_logs ADD COLUMN IF NOT EXISTS llm_stats JSONB;",
     ]
 
     for stmt in statements:
@@ -0,0 +1,262 @@
+"""
+Semantic Query Cache - Reuses generated queries for differently worded questions.
+"chicken recipes" and "show me recipes with chicken" normalize to the same
+terms, so the second question can reuse the SQL / Mongo query generated for
+the first one instead of paying for another PRIMARY_LLM + SYNTAX_LLM round.
+
+Questions are matched by TF-IDF cosine similarity over word and character
+trigram features. Numbers, countries and words that change the meaning of a
+query (without, under, top, ...) must match exactly, so "under 300 calories"
+never reuses the query for "under 500 calories".
+"""
+
+import math
+import os
+import re
+import threading
+from collections import OrderedDict, Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+STOPWORDS = {
+    "a", "an", "the", "me", "my", "i", "you", "we", "us", "please", "can", "could",
+    "would", "show", "find", "get", "give", "list", "display", "tell", "fetch",
+    "what", "which", "is", "are", "was", "be", "all", "any", "some", "of", "for",
+    "with", "in", "on", "at", "to", "from", "that", "have", "has", "contain",
+    "contains", "containing", "want", "need", "like", "about", "using", "use",
+}
+
+# Words that change the result set - two questions only match if they agree on these
+GUARD_WORDS = {
+    "not", "no", "without", "except", "exclude", "excluding", "and", "or",
+    "under", "over", "below", "above", "less", "more", "least", "most", "than",
+    "highest", "lowest", "top", "bottom", "min", "max", "minimum", "maximum",
+    "average", "avg", "count", "many", "much", "cheapest", "expensive",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+_ISO3_RE = re.compile(r"\b[A-Z]{3}\b")
+
+
+class _Entry:
+    __slots__ = ("question", "words", "features", "guards", "query")
+
+    def __init__(self, question, words, features, guards, query):
+        self.question = question
+        self.words = words
+        self.features = features
+        self.guards = guards
+        self.query = query
+
+
+class SemanticQueryCache:
+    """
+    Bounded LRU cache of successful question -> query pairs.
+
+    Configuration via .env:
+    - SEMANTIC_CACHE: enable lookups and stores (true by default)
+    - SEMANTIC_CACHE_MAX_ENTRIES: entries kept per agent (default 512)
+    - SEMANTIC_CACHE_THRESHOLD: minimum cosine similarity for a hit (default 0.85)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        schema_paths: Iterable[Path],
+        normalizer: Optional[Callable[[str], str]] = None,
+        max_entries: Optional[int] = None,
+        threshold: Optional[float] = None,
+    ):
+        self.name = name
+        self.schema_paths = [Path(p) for p in schema_paths]
+        self.normalizer = normalizer
+        self.enabled = os.getenv("SEMANTIC_CACHE", "true").lower() == "true"
+        self.max_entries = int(max_entries or os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+        self.threshold = float(threshold or os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+
+        self._entries = OrderedDict()  # normalized key -> _Entry, oldest first
+        self._doc_freq = Counter()  # feature -> number of entries containing it
+        self._word_index = {}  # word -> set of keys, narrows candidates for scoring
+        self._schema_signature = self._read_schema_signature()
+        self._lock = threading.Lock()
+        self._stats = {
+            "lookups": 0, "hits": 0, "exact_hits": 0, "stores": 0,
+            "evictions": 0, "invalidations": 0,
+        }
+
+    # ------------------------------------------------------------------ #
+    # Normalization
+    # ------------------------------------------------------------------ #
+    def _analyze(self, question: str):
+        """Split a question into content words, scoring features and guard terms"""
+        text = question
+        if self.normalizer:
+            text = self.normalizer(question)
+        countries = set(_ISO3_RE.findall(text))  # ISO3 codes, whether typed or normalized
+
+        words = []
+        for word in _WORD_RE.findall(text.lower()):
+            if word in STOPWORDS:
+                continue
+            if len(word) > 4 and word.endswith("oes"):
+                word = word[:-2]  # tomatoes -> tomato
+            elif len(word) > 3 and word.endswith("s") and not word.endswith("ss") and not word[0].isdigit():
+                word = word[:-1]  # recipes -> recipe, chickens -> chicken
+            words.append(word)
+
+        numbers = {w for w in words if w[0].isdigit()}
+        guards = frozenset(
+            {w for w in words if w in GUARD_WORDS} | numbers | {c.lower() for c in countries}
+        )
+
+        features = Counter()
+        for word in words:
+            features[f"w:{word}"] += 2
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                features[f"c:{padded[i:i + 3]}"] += 1
+
+        return words, features, guards
+
+    @staticmethod
+    def _key(words) -> str:
+        return " ".join(sorted(words))
+
+    # ------------------------------------------------------------------ #
+    # Schema invalidation
+    # ------------------------------------------------------------------ #
+    def _read_schema_signature(self):
+        signature = []
+        for path in self.schema_paths:
+            try:
+                stat = path.stat()
+                signature.append((str(path), stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((str(path), None, None))
+        return tuple(signature)
+
+    def _check_schema(self) -> None:
+        """Drop every entry when a schema or prompt file changed since they were stored"""
+        signature = self._read_schema_signature()
+        if signature != self._schema_signature:
+            if self._entries:
+                print(f"♻️ {self.name} semantic cache invalidated (schema changed)")
+                self._stats["invalidations"] += 1
+            self._entries.clear()
+            self._doc_freq.clear()
+            self._word_index.clear()
+            self._schema_signature = signature
+
+    # ------------------------------------------------------------------ #
+    # Index maintenance
+    # ------------------------------------------------------------------ #
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._doc_freq.subtract(entry.features.keys())
+        for feature in entry.features:
+            if self._doc_freq[feature] <= 0:
+                del self._doc_freq[feature]
+        for word in set(entry.words):
+            keys = self._word_index.get(word)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._word_index[word]
+
+    def _vector(self, features: Counter) -> Dict[str, float]:
+        n = len(self._entries)
+        vector = {
+            f: tf * (math.log((n + 1) / (self._doc_freq.get(f, 0) + 1)) + 1)
+            for f, tf in features.items()
+        }
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {f: v / norm for f, v in vector.items()}
+
+    # ------------------------------------------------------------------ #
+    # Public API
+    # ------------------------------------------------------------------ #
+    def lookup(self, question: str) -> Optional[Any]:
+        """
+        Find the stored query for the most similar past question
+
+        Args:
+            question: Raw user question
+
+        Returns:
+            The stored query if a past question is similar enough, else None
+        """
+        if not self.enabled:
+            return None
+        words, features, guards = self._analyze(question)
+        if not words:
+            return None
+
+        with self._lock:
+            self._check_schema()
+            self._stats["lookups"] += 1
+            key = self._key(words)
+
+            entry = self._entries.get(key)
+            if entry is not None and entry.guards == guards:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["exact_hits"] += 1
+                print(f"♻️ {self.name} semantic cache hit (exact): '{entry.question}'")
+                return entry.query
+
+            candidates = set()
+            for word in set(words):
+                candidates |= self._word_index.get(word, set())
+
+            query_vec = self._vector(features)
+            best_key, best_score = None, 0.0
+            for candidate in candidates:
+                entry = self._entries[candidate]
+                if entry.guards != guards:
+                    continue
+                entry_vec = self._vector(entry.features)
+                score = sum(v * entry_vec.get(f, 0.0) for f, v in query_vec.items())
+                if score > best_score:
+                    best_key, best_score = candidate, score
+
+            if best_key is None or best_score < self.threshold:
+                return None
+
+            entry = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self._stats["hits"] += 1
+            print(f"♻️ {self.name} semantic cache hit ({best_score:.2f}): '{entry.question}'")
+            return entry.query
+
+    def store(self, question: str, query: Any) -> None:
+        """Remember the query that successfully answered a question"""
+        if not self.enabled:
+            return
+        words, features, guards = self._analyze(question)
+        if not words:
+            return
+
+        with self._lock:
+            self._check_schema()
+            key = self._key(words)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(question, words, features, guards, query)
+            self._doc_freq.update(features.keys())
+            for word in set(words):
+                self._word_index.setdefault(word, set()).add(key)
+            self._stats["stores"] += 1
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit rate and size counters for /diagnostics"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["misses"] = stats["lookups"] - stats["hits"]
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 3) if stats["lookups"] else 0.0
+        stats["enabled"] = self.enabled
+        return stats
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+import llm_wrapper_opensource as wrapper
+from deadline import Deadline, DeadlineExceeded
+from llm_wrapper_opensource import CircuitBreaker, Custom_GenAI, ProviderRegistry
+
+
+class SlowLLM:
+    """Provider whose calls outlive any short deadline"""
+
+    model = "slow"
+    timeout = 5
+    parallel_slots = None
+
+    def ask_ai(self, prompt, timeout=None, stats=None, **kwargs):
+        time.sleep(timeout)
+        raise TimeoutError("read timed out")
+
+
+@pytest.fixture
+def genai(monkeypatch):
+    monkeypatch.setattr(wrapper, "get_response_cache", lambda: None)
+    registry = ProviderRegistry(health_interval=0)
+    registry._providers = [("ollama", SlowLLM())]
+    registry._breakers["ollama"] = CircuitBreaker(window=4, failure_rate=0.5, min_calls=1, open_seconds=0.05)
+    llm = Custom_GenAI(role="test")
+    llm.registry = registry
+    return llm
+
+
+def test_release_trial_reopens_half_open_slot():
+    breaker = CircuitBreaker(window=4, failure_rate=0.5, min_calls=1, open_seconds=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert not breaker.allow()  # one trial at a time
+    breaker.release_trial()
+    assert breaker.allow()
+
+
+def test_deadline_expired_trial_does_not_wedge_breaker(genai):
+    breaker = genai.registry.breaker("ollama")
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+
+    with pytest.raises(DeadlineExceeded):
+        genai._ask_providers("prompt", None, Deadline(0.05), None, "test")
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
@@ -0,0 +1,148 @@
+import os
+import threading
+
+import psycopg2
+import psycopg2.pool
+import pytest
+
+from SQL import db_utils
+
+
+class FakeCursor:
+    description = None  # no result set
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.conn.stale:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.executed.append((sql, params))
+
+
+class FakeConnection:
+    def __init__(self, stale=False):
+        self.stale = stale
+        self.closed = 0
+        self.executed = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """Hands out the given connections in order, then fresh ones"""
+
+    def __init__(self, *connections):
+        self._pool = list(connections)  # the attributes get_pool_stats reads
+        self._used = {}
+        self.returned = []
+
+    def getconn(self):
+        conn = self._pool.pop(0) if self._pool else FakeConnection()
+        self._used[id(conn)] = conn
+        return conn
+
+    def putconn(self, conn, close=False):
+        self._used.pop(id(conn), None)
+        self.returned.append((conn, close))
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Install a FakePool with two slots: pool(*connections) -> FakePool"""
+    monkeypatch.setattr(db_utils, "DB_POOL_MAX", 2)
+    monkeypatch.setattr(db_utils, "DB_POOL_HEALTH_CHECK", True)
+    monkeypatch.setattr(db_utils, "_pool_slots", threading.BoundedSemaphore(2))
+    monkeypatch.setattr(db_utils, "_pool_stats", dict.fromkeys(db_utils._pool_stats, 0))
+    monkeypatch.setattr(db_utils, "_pool_pid", os.getpid())
+
+    def install(*connections):
+        fake = FakePool(*connections)
+        monkeypatch.setattr(db_utils, "_pool", fake)
+        return fake
+
+    return install
+
+
+def test_stale_connections_are_replaced(pool):
+    stale, healthy = FakeConnection(stale=True), FakeConnection()
+    fake = pool(stale, healthy)
+    with db_utils.db_connection() as conn:
+        assert conn is healthy
+    assert fake.returned == [(stale, True), (healthy, False)]
+    stats = db_utils.get_pool_stats()
+    assert stats["in_use"] == 0
+    assert stats["discarded"] == 1
+    assert stats["checkouts"] == 1
+
+
+def test_connection_lost_mid_query_is_closed_not_reused(pool):
+    fake = pool()
+    with pytest.raises(RuntimeError):
+        with db_utils.db_connection() as conn:
+            conn.closed = 2
+            raise RuntimeError("query failed")
+    assert fake.returned == [(conn, True)]
+
+
+def test_checkout_waits_then_times_out_when_every_slot_is_busy(pool):
+    pool()
+    with db_utils.db_connection(), db_utils.db_connection():
+        with pytest.raises(psycopg2.pool.PoolError, match="no PostgreSQL connection free"):
+            with db_utils.db_connection(timeout=0.05):
+                pass
+    stats = db_utils.get_pool_stats()
+    assert stats["waited"] == 1
+    assert stats["timeouts"] == 1
+    with db_utils.db_connection():  # both slots came back
+        pass
+
+
+def test_failed_connect_gives_the_slot_back(pool):
+    class Unreachable(FakePool):
+        def getconn(self):
+            raise psycopg2.OperationalError("could not connect to server")
+
+    pool()
+    db_utils._pool = Unreachable()
+    for _ in range(3):
+        with pytest.raises(psycopg2.OperationalError):
+            with db_utils.db_connection(timeout=0.05):
+                pass
+    assert db_utils.get_pool_stats()["connect_errors"] == 3
+    assert db_utils.get_pool_stats()["timeouts"] == 0
+
+
+def test_statement_timeout_is_set_per_transaction(pool):
+    fake = pool()
+    rows, cols = db_utils.execute_sql_query("SELECT 1", timeout=1.5)
+    conn = fake.returned[0][0]
+    assert ("SET LOCAL statement_timeout = %s", (1500,)) in conn.executed
+    assert conn.executed[-1] == ("SELECT 1", None)
+
+
+@pytest.mark.parametrize("sql, statement", [
+    ("SELECT 1;", "SELECT 1"),
+    ("SELECT 1 ;; ", "SELECT 1"),
+    ("SELECT 'a;b' FROM t;", "SELECT 'a;b' FROM t"),
+])
+def test_single_statement(sql, statement):
+    assert db_utils.single_statement(sql) == statement
+
+
+def test_single_statement_rejects_a_second_statement():
+    with pytest.raises(ValueError, match="multiple SQL statements"):
+        db_utils.single_statement("SELECT 1; DROP TABLE recipes;")
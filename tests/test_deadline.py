@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+import deadline
+from deadline import DEADLINE_HEADER, MIN_DB_TIMEOUT, Deadline, DeadlineExceeded
+
+
+def test_no_budget_never_expires():
+    unlimited = Deadline(None)
+    assert not unlimited.expired()
+    assert unlimited.timeout() is None
+    assert unlimited.timeout(30) == 30
+    assert unlimited.db_timeout() is None
+
+
+def test_stage_timeout_is_capped_by_what_is_left():
+    budget = Deadline(10)
+    assert budget.timeout(60) <= 10
+    assert budget.timeout(2) == 2
+    assert 9 < budget.timeout() <= 10
+
+
+def test_spent_budget_raises_with_the_stage_name():
+    spent = Deadline(0.01)
+    time.sleep(0.02)
+    assert spent.expired()
+    with pytest.raises(DeadlineExceeded, match="before SQL generation"):
+        spent.timeout(stage="SQL generation")
+    assert isinstance(DeadlineExceeded("x"), TimeoutError)
+
+
+def test_db_timeout_never_raises():
+    spent = Deadline(0.01)
+    time.sleep(0.02)
+    assert spent.db_timeout() == MIN_DB_TIMEOUT
+
+
+@pytest.mark.parametrize("header, budget", [
+    ("20", 20.0),
+    ("0.5", 0.5),
+    (None, "default"),
+    ("", "default"),
+    ("soon", "default"),
+    ("0", "default"),
+    ("-5", "default"),
+])
+def test_from_headers(header, budget):
+    headers = {DEADLINE_HEADER: header} if header is not None else {}
+    expected = deadline.DEFAULT_ASK_DEADLINE if budget == "default" else budget
+    assert Deadline.from_headers(headers).budget == expected
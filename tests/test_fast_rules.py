@@ -0,0 +1,97 @@
+import pytest
+
+import fast_rules
+from fast_rules import match_mongo, match_sql
+
+
+@pytest.mark.parametrize("question, rule, params", [
+    ("recipes with chicken under 400 calories", "recipes_with_ingredient_under_calories", ("%chicken%", 400.0)),
+    ("Show me recipes with eggs?", "recipes_with_ingredient", ("%egg%",)),
+    ("recipes containing tomatoes", "recipes_with_ingredient", ("%tomato%",)),
+    ("recipes with olive oil", "recipes_with_ingredient", ("%olive oil%",)),
+    ("price of rice in Kenya", "price_of_commodity_in_country", ("%rice%", "KEN")),
+    ("what is the price of maize in south africa", "price_of_commodity_in_country", ("%maize%", "ZAF")),
+    ("protein in spinach", "nutrient_in_ingredient", ("%spinach%",)),
+    ("how much fat is in brown rice", "nutrient_in_ingredient", ("%brown rice%",)),
+])
+def test_matches_known_shapes(question, rule, params):
+    answer = match_sql(question)
+    assert answer["rule"] == rule
+    assert answer["params"] == params
+    assert match_mongo(question)["rule"] == rule
+
+
+@pytest.mark.parametrize("question", [
+    "recipes with the most reviews",
+    "recipes with high protein",
+    "show me recipes with chicken sorted by rating",
+    "recipes with a rating above four",
+    "recipes with chicken above 4.5 stars",
+    "how much protein is in chicken recipes",
+    "fat in the highest rated recipe",
+    "recipes with chicken and rice",
+    "recipes without nuts",
+    "price of rice in kenya sorted by date",
+    "price of rice in atlantis",
+    "what is the most popular recipe",
+])
+def test_leaves_near_misses_to_the_llm(question):
+    assert match_sql(question) is None
+    assert match_mongo(question) is None
+
+
+def test_nutrient_column_comes_from_the_fixed_list():
+    answer = match_sql("how much fibre is in oats")
+    assert "fiber_g" in answer["sql"]
+    assert answer["params"] == ("%oat%",)
+    assert match_mongo("calories in avocado")["query"]["projection"] == {
+        "ingredient_name": 1, "energy_kcal": 1, "_id": 0,
+    }
+
+
+def test_mongo_regex_is_escaped():
+    query = match_mongo("recipes with mother's ruin")["query"]
+    assert query["query"]["recipeingredientparts"] == {"$regex": "mother's\\ ruin", "$options": "i"}
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(fast_rules, "FAST_RULES", False)
+    assert match_sql("protein in spinach") is None
+
+
+def test_empty_fast_result_falls_through_to_the_semantic_cache(monkeypatch):
+    import SQL.agent3_sql_final as agent
+
+    executed = []
+
+    def execute(sql, params=None, timeout=None):
+        executed.append(sql)
+        return ([], []) if params else ([(1, "Egg")], ["id", "name"])
+
+    monkeypatch.setattr(agent, "execute_sql_query", execute)
+    monkeypatch.setattr(agent, "insert_log", lambda *a, **k: None)
+    monkeypatch.setattr(agent.SEMANTIC_CACHE, "lookup", lambda question: "SELECT id, name FROM recipes;")
+
+    result = agent.process_query("recipes with unobtainium", interactive=False)
+    assert executed[-1] == "SELECT id, name FROM recipes;"
+    assert "Egg" in result
+
+
+def test_empty_mongo_fast_result_falls_through_to_the_semantic_cache(monkeypatch):
+    import Mongodb.agent3 as agent
+
+    cached = {"collection": "recipes", "query": {"name": {"$regex": "egg"}}, "limit": 10}
+    executed = []
+
+    def execute(query, timeout=None):
+        executed.append(query)
+        return [{"name": "Egg"}] if query == cached else []
+
+    monkeypatch.setattr(agent, "execute_mongo_query", execute)
+    monkeypatch.setattr(agent, "insert_log", lambda *a, **k: None)
+    monkeypatch.setattr(agent.SEMANTIC_CACHE, "lookup", lambda question: dict(cached))
+    monkeypatch.setattr(agent.SEMANTIC_CACHE, "store", lambda *a, **k: None)
+
+    result = agent.process_query("recipes with unobtainium", interactive=False)
+    assert executed[-1] == cached
+    assert "Egg" in result
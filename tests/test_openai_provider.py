@@ -0,0 +1,157 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_wrapper_opensource as wrapper
+from llm_wrapper_opensource import Custom_GenAI, LLMUnavailableError, OpenAICompatibleLLM, ProviderRegistry
+
+SQL_ANSWER = "SELECT name FROM recipes WHERE rating > 4.5;"
+TRAILING_TEXT = "\n\nExplanation: this query selects the names of all highly rated recipes. " * 5
+USAGE = {"prompt_tokens": 12, "completion_tokens": 9}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """A minimal OpenAI-compatible server: /v1/models and /v1/chat/completions"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/v1/models":
+            self._send_json({"data": [{"id": "stand-in"}]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.server.requests.append((self.path, request))
+        if self.path != "/v1/chat/completions":
+            return self._send_json({"error": "not found"}, 404)
+        if self.server.status >= 500:
+            return self._send_json({"error": "model crashed"}, self.server.status)
+
+        text = self.server.text
+        if not request.get("stream"):
+            return self._send_json({
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}}],
+                "usage": USAGE,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i in range(0, len(text), 4):
+                self._event({"choices": [{"index": 0, "delta": {"content": text[i:i + 4]}}]})
+            self._event({"choices": [], "usage": USAGE})
+            self._event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            self.server.aborted += 1  # the client closed the stream early
+            self.close_connection = True
+
+    def _event(self, body):
+        line = b"data: " + (body if isinstance(body, str) else json.dumps(body)).encode("utf-8") + b"\n\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+
+@pytest.fixture
+def stand_in():
+    """Start stand-in servers on ephemeral ports: stand_in(text=..., status=...) -> server"""
+    servers = []
+
+    def start(text=SQL_ANSWER, status=200):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        server.text = text
+        server.status = status
+        server.requests = []
+        server.aborted = 0
+        server.url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def provider(monkeypatch, server, stream):
+    monkeypatch.setenv("OPENAI_BASE_URL", server.url)
+    monkeypatch.setenv("OPENAI_STREAM", "true" if stream else "false")
+    monkeypatch.delenv("OPENAI_PARALLEL_SLOTS", raising=False)
+    llm = OpenAICompatibleLLM()
+    assert llm.available
+    return llm
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_chat_completion(monkeypatch, stand_in, stream):
+    server = stand_in()
+    stats = {}
+    answer = provider(monkeypatch, server, stream).ask_ai("Show highly rated recipes", stats=stats)
+
+    assert answer == SQL_ANSWER
+    path, request = server.requests[0]
+    assert path == "/v1/chat/completions"
+    assert request["messages"] == [{"role": "user", "content": "Show highly rated recipes"}]
+    assert request["stream"] is stream
+    assert stats["prompt_eval_count"] == USAGE["prompt_tokens"]
+
+
+def test_stream_stops_once_query_is_complete(monkeypatch, stand_in):
+    server = stand_in(text=SQL_ANSWER + TRAILING_TEXT)
+    stats = {}
+    answer = provider(monkeypatch, server, stream=True).ask_ai("Show highly rated recipes", stop_at="sql", stats=stats)
+
+    assert answer.strip() == SQL_ANSWER
+    assert "Explanation" not in answer
+    assert stats["eval_count"] < len(SQL_ANSWER + TRAILING_TEXT) // 4
+
+
+def test_fails_over_when_server_returns_5xx(monkeypatch, stand_in):
+    broken, healthy = stand_in(status=500), stand_in(text="SELECT 1;")
+    registry = ProviderRegistry(health_interval=0)
+    # the healthy stand-in takes the slot of the next provider in the fallback order
+    registry._providers = [
+        ("openai", provider(monkeypatch, broken, stream=False)),
+        ("huggingface", provider(monkeypatch, healthy, stream=True)),
+    ]
+    monkeypatch.setattr(wrapper, "get_response_cache", lambda: None)
+    llm = Custom_GenAI(role="test")
+    llm.registry = registry
+
+    assert llm.ask_ai("Show highly rated recipes", stop_at="sql") == "SELECT 1;"
+    assert len(broken.requests) == 1
+    assert len(healthy.requests) == 1
+    assert registry.breaker("openai").status()["window_failure_rate"] == 1.0
+
+
+def test_async_call_without_httpx_leaves_the_breaker_alone(monkeypatch, stand_in):
+    registry = ProviderRegistry(health_interval=0)
+    registry._providers = [("openai", provider(monkeypatch, stand_in(), stream=False))]
+    monkeypatch.setattr(wrapper, "get_response_cache", lambda: None)
+    monkeypatch.setattr(wrapper, "httpx", None)
+    llm = Custom_GenAI(role="test")
+    llm.registry = registry
+
+    with pytest.raises(LLMUnavailableError, match="needs httpx"):
+        asyncio.run(llm.ask_ai_async("Show highly rated recipes"))
+    assert registry.breaker("openai").status()["window_failure_rate"] == 0.0
@@ -0,0 +1,52 @@
+import pytest
+
+from Mongodb.query_validator import query_object_schema, validate_mongo_query
+
+SCHEMA = {
+    "recipes": {"name", "calories", "recipeingredientparts", "nutrition"},
+    "food_prices": {"commodity", "countryiso3", "price", "date"},
+}
+
+
+@pytest.mark.parametrize("query_obj", [
+    {"collection": "recipes", "query": {"calories": {"$lt": 300}}, "limit": 5},
+    {"collection": "recipes", "query": {"name": "Pancakes"}},
+    {"collection": "recipes", "query": {"recipeingredientparts": {"$regex": "chicken", "$options": "i"}}},
+    {"collection": "recipes", "query": {"nutrition.protein_g": {"$gte": 20}}, "sort": {"calories": -1}},
+    {"collection": "recipes", "query": {"$or": [{"calories": {"$lt": 200}}, {"name": {"$in": ["Soup"]}}]}},
+    {"collection": "recipes", "query": {"calories": {"$not": {"$gt": 500}}}, "projection": {"name": 1, "_id": 0}},
+    {"collection": "food_prices", "query": {}, "limit": 0, "explanation": "every price"},
+])
+def test_accepts_valid_queries(query_obj):
+    assert validate_mongo_query(query_obj, SCHEMA) == []
+
+
+@pytest.mark.parametrize("query_obj, problem", [
+    ([], "query must be a JSON object"),
+    ({"collection": "users", "query": {}}, "unknown collection `users`"),
+    ({"collection": "recipes", "query": {}, "pipeline": []}, "unexpected keys: pipeline"),
+    ({"collection": "recipes", "query": "calories < 300"}, "`query` must be an object"),
+    ({"collection": "recipes", "query": {"rating": 5}}, "unknown field `rating`"),
+    ({"collection": "recipes", "query": {"$where": "this.calories < 300"}}, "top-level operator `$where`"),
+    ({"collection": "recipes", "query": {"$and": {"calories": 1}}}, "`$and` needs a list of filters"),
+    ({"collection": "recipes", "query": {"$or": [{"rating": 1}]}}, "unknown field `rating`"),
+    ({"collection": "recipes", "query": {"calories": {"$function": "x"}}}, "operator `$function` is not allowed"),
+    ({"collection": "recipes", "query": {"name": {"$in": "Soup"}}}, "`$in` on `name` needs a list"),
+    ({"collection": "recipes", "query": {"name": {"$regex": 5}}}, "`$regex` on `name` needs a string"),
+    ({"collection": "recipes", "query": {"name": {"$regex": "a", "$options": "g"}}}, "must only use i, m, x, s"),
+    ({"collection": "recipes", "query": {"name": {"$not": {"$eval": 1}}}}, "operator `$eval` is not allowed"),
+    ({"collection": "recipes", "query": {}, "limit": "5"}, "`limit` must be a non-negative integer"),
+    ({"collection": "recipes", "query": {}, "limit": True}, "`limit` must be a non-negative integer"),
+    ({"collection": "recipes", "query": {}, "projection": {"rating": 1}}, "unknown projection field `rating`"),
+    ({"collection": "recipes", "query": {}, "projection": {"name": 2}}, "projection for `name` must be 0 or 1"),
+    ({"collection": "recipes", "query": {}, "sort": {"calories": "desc"}}, "sort direction for `calories`"),
+])
+def test_reports_problems(query_obj, problem):
+    errors = validate_mongo_query(query_obj, SCHEMA)
+    assert any(problem in error for error in errors), errors
+
+
+def test_output_schema_limits_collections():
+    schema = query_object_schema(SCHEMA)
+    assert schema["properties"]["collection"]["enum"] == ["recipes", "food_prices"]
+    assert schema["required"] == ["collection", "query"]
@@ -0,0 +1,90 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import llm_wrapper_opensource as wrapper
+from deadline import DeadlineExceeded
+from llm_wrapper_opensource import LLMScheduler, get_scheduler
+
+
+def wait_until(condition, timeout=2.0):
+    give_up_at = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < give_up_at, "timed out waiting"
+        time.sleep(0.005)
+
+
+def test_free_slots_are_taken_without_queueing():
+    scheduler = LLMScheduler("test", 2)
+    assert scheduler.acquire("interactive") < 0.05
+    assert scheduler.acquire("batch") < 0.05
+    assert scheduler.status()["busy"] == 2
+    scheduler.release()
+    scheduler.release()
+    assert scheduler.status()["busy"] == 0
+    assert scheduler.status()["queued"] == 0
+
+
+def test_released_slot_goes_to_the_best_ranked_waiter():
+    scheduler = LLMScheduler("test", 1)
+    scheduler.acquire("interactive")
+    order = []
+
+    def call(priority):
+        with scheduler.slot(priority, timeout=5):
+            order.append(priority)
+
+    threads = []
+    for priority in ("background", "batch", "interactive"):
+        threads.append(threading.Thread(target=call, args=(priority,)))
+        threads[-1].start()
+        wait_until(lambda: scheduler.status()["queued_now"][priority] == 1)
+
+    scheduler.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["interactive", "batch", "background"]
+    assert scheduler.status()["busy"] == 0
+
+
+def test_waiter_leaves_the_queue_when_its_deadline_runs_out():
+    scheduler = LLMScheduler("test", 1)
+    scheduler.acquire("interactive")
+    with pytest.raises(DeadlineExceeded, match="No test slot"):
+        scheduler.acquire("batch", timeout=0.05)
+
+    status = scheduler.status()
+    assert status["timeouts"] == 1
+    assert status["queued_now"]["batch"] == 0
+    scheduler.release()
+    assert scheduler.status()["busy"] == 0  # the timed-out waiter was skipped
+
+
+def test_async_waiters_hold_no_thread_and_cancelled_ones_pass_the_slot_on():
+    scheduler = LLMScheduler("test", 1)
+
+    async def main():
+        await scheduler.acquire_async("interactive")
+        cancelled = asyncio.create_task(scheduler.acquire_async("interactive", timeout=5))
+        waiting = asyncio.create_task(scheduler.acquire_async("batch", timeout=5))
+        await asyncio.sleep(0.02)
+        assert scheduler.status()["queued_now"] == {"interactive": 1, "batch": 1, "background": 0}
+
+        cancelled.cancel()
+        scheduler.release()
+        await waiting
+        assert scheduler.status()["busy"] == 1
+        scheduler.release()
+
+    threads = threading.active_count()
+    asyncio.run(main())
+    assert threading.active_count() == threads
+    assert scheduler.status()["busy"] == 0
+
+
+def test_providers_without_a_slot_limit_are_not_scheduled(monkeypatch):
+    assert get_scheduler("test-unlimited", None) is None
+    monkeypatch.setattr(wrapper, "LLM_SCHEDULER", False)
+    assert get_scheduler("test-disabled", 4) is None
@@ -0,0 +1,71 @@
+import pytest
+
+from schema_pruner import SchemaPruner, estimate_tokens
+
+WIDE_FIELDS = ["ingredient_id", "ingredient_name"] + [f"extra_{i}" for i in range(12)] + ["protein_g", "fat_g"]
+SCHEMA = "\n".join(
+    ["Tables in the recipe database:", "TABLE: recipes", "- recipeid", "- name", "- calories", "- recipecategory",
+     "TABLE: food_prices", "- commodity", "- countryiso3", "- price",
+     "TABLE: recipe_ingredients", "- recipeid", "- ingredient_id",
+     "TABLE: ingredient_nutrition"]
+    + [f"- {field}" for field in WIDE_FIELDS]
+) + "\n"
+
+
+@pytest.fixture
+def pruner(monkeypatch):
+    monkeypatch.delenv("SCHEMA_PRUNING", raising=False)
+    monkeypatch.delenv("SCHEMA_PRUNE_MIN_FIELDS", raising=False)
+    return SchemaPruner(
+        "test",
+        r"^TABLE:\s*(?P<name>\w+)",
+        keywords={"food_prices": {"price", "cost", "market"}, "ingredient_nutrition": {"nutrition"}},
+        key_fields={"ingredient_nutrition": {"ingredient_id", "ingredient_name"}},
+        links=[({"recipes", "ingredient_nutrition"}, {"recipe_ingredients"})],
+        field_synonyms={"calorie": {"energy_kcal"}},
+    )
+
+
+def tables(schema):
+    return [line.split()[-1] for line in schema.splitlines() if line.startswith("TABLE:")]
+
+
+def test_keeps_the_table_a_keyword_names(pruner):
+    pruned = pruner.prune(SCHEMA, "what is the cost of rice in Kenya")
+    assert tables(pruned) == ["food_prices"]
+    assert pruned.startswith("Tables in the recipe database:")
+
+
+def test_falls_back_to_tables_whose_fields_are_mentioned(pruner):
+    assert tables(pruner.prune(SCHEMA, "which commodity is cheapest")) == ["food_prices"]
+
+
+def test_adds_the_join_table_when_both_ends_are_kept(pruner):
+    pruned = pruner.prune(SCHEMA, "recipes ranked by nutrition protein")
+    assert tables(pruned) == ["recipes", "recipe_ingredients", "ingredient_nutrition"]
+
+
+def test_wide_table_keeps_key_fields_and_mentioned_fields(pruner):
+    pruned = pruner.prune(SCHEMA, "protein in nutrition data for spinach")
+    fields = [line[2:] for line in pruned.splitlines() if line.startswith("- ")]
+    assert fields == ["ingredient_id", "ingredient_name", "protein_g"]
+
+
+def test_unmatched_question_gets_the_full_schema(pruner):
+    assert pruner.prune(SCHEMA, "hello there") == SCHEMA
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setenv("SCHEMA_PRUNING", "false")
+    pruner = SchemaPruner("test", r"^TABLE:\s*(?P<name>\w+)")
+    assert pruner.prune(SCHEMA, "cost of rice") == SCHEMA
+
+
+def test_render_fills_the_template_and_counts_tokens(pruner):
+    prompt = pruner.render("Schema:\n{SCHEMA}\nQuestion: {QUESTION}", SCHEMA, "price of maize")
+    assert "TABLE: food_prices" in prompt and "TABLE: recipes" not in prompt
+    assert prompt.endswith("Question: price of maize")
+    stats = pruner.stats()
+    assert stats["pruned"] == 1
+    assert stats["tokens_after"] == estimate_tokens(prompt)
+    assert 0 < stats["token_reduction"] < 1
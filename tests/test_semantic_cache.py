@@ -0,0 +1,73 @@
+import pytest
+
+from semantic_cache import SemanticQueryCache
+
+
+@pytest.fixture
+def schema(tmp_path):
+    path = tmp_path / "schema.txt"
+    path.write_text("TABLE: recipes")
+    return path
+
+
+@pytest.fixture
+def cache(schema, monkeypatch):
+    monkeypatch.delenv("SEMANTIC_CACHE", raising=False)
+    return SemanticQueryCache("test", [schema], max_entries=3, threshold=0.85)
+
+
+def test_reworded_question_reuses_the_query(cache):
+    cache.store("chicken recipes", "SELECT 1;")
+    assert cache.lookup("show me recipes with chicken") == "SELECT 1;"
+    assert cache.stats()["exact_hits"] == 1
+
+
+def test_near_spelling_hits_only_above_the_threshold(schema):
+    strict = SemanticQueryCache("test", [schema], threshold=0.85)
+    loose = SemanticQueryCache("test", [schema], threshold=0.7)
+    for cache in (strict, loose):
+        cache.store("vegetarian lasagna recipes", "SELECT 2;")
+        cache.store("chicken soup", "SELECT 3;")
+
+    assert strict.lookup("vegetarian lasagne recipes") is None
+    assert loose.lookup("vegetarian lasagne recipes") == "SELECT 2;"
+    assert loose.lookup("beef lasagna recipes") is None
+
+
+@pytest.mark.parametrize("stored, asked", [
+    ("recipes under 300 calories", "recipes under 500 calories"),
+    ("recipes with chicken", "recipes without chicken"),
+    ("cheapest rice", "most expensive rice"),
+    ("price of rice in KEN", "price of rice in UGA"),
+])
+def test_guard_words_must_agree(cache, stored, asked):
+    cache.store(stored, "SELECT 3;")
+    assert cache.lookup(asked) is None
+
+
+def test_unrelated_question_misses(cache):
+    cache.store("chicken recipes", "SELECT 1;")
+    assert cache.lookup("fiber in lentils") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_oldest_entry_is_evicted(cache):
+    for i, ingredient in enumerate(["chicken", "beef", "pork", "tofu"]):
+        cache.store(f"{ingredient} recipes", f"SELECT {i};")
+    assert cache.lookup("chicken recipes") is None
+    assert cache.lookup("tofu recipes") == "SELECT 3;"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_schema_change_invalidates_entries(cache, schema):
+    cache.store("chicken recipes", "SELECT 1;")
+    schema.write_text("TABLE: recipes\nTABLE: food_prices")
+    assert cache.lookup("chicken recipes") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_disabled(schema, monkeypatch):
+    monkeypatch.setenv("SEMANTIC_CACHE", "false")
+    cache = SemanticQueryCache("test", [schema])
+    cache.store("chicken recipes", "SELECT 1;")
+    assert cache.lookup("chicken recipes") is None